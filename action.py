@@ -1,5 +1,60 @@
-from utils import FunctionCall, FunctionName
+import asyncio
+from utils import FunctionCall, FunctionName, ToolCall
 from mcp import ClientSession
+from mcp_schemas import GCodeOutput
+from tracing import tracer
+
+
+def extract_gcode(result: list[str] | str) -> list[str]:
+    """
+    Get the G-code blocks out of a flattened tool result.
+
+    Args:
+        result (list | str): The text items returned by a tool
+
+    Returns:
+        list: The G-code blocks, empty if the tool did not return G-code
+    """
+    items = result if isinstance(result, list) else [result]
+    blocks = []
+    for item in items:
+        try:
+            blocks.extend(GCodeOutput.model_validate_json(item).result)
+        except ValueError:
+            continue
+    return blocks
+
+
+def flatten_result(result) -> tuple:
+    """
+    Flatten the result of a tool call into text.
+
+    Args:
+        result (CallToolResult): The result returned by the session
+
+    Returns:
+        tuple: The text items of the result (a list, or a string if the result has no
+        content list) and their rendering in the memory entry of the call
+    """
+    # Get the full result content
+    if hasattr(result, "content"):
+        # Handle multiple content items
+        if isinstance(result.content, list):
+            iteration_result = [
+                (item.text if hasattr(item, "text") else str(item))
+                for item in result.content
+            ]
+        else:
+            iteration_result = str(result.content)
+    else:
+        iteration_result = str(result)
+
+    # Format the response based on result type
+    if isinstance(iteration_result, list):
+        result_str = f"[{', '.join(iteration_result)}]"
+    else:
+        result_str = str(iteration_result)
+    return iteration_result, result_str
 
 
 class Action:
@@ -12,11 +67,14 @@ class Action:
     2. Handles tool execution results and formats them appropriately
     3. Stores execution results in memory for future reference
     4. Manages the continuation state of the agent's execution
+    5. Runs batches of tool calls planned in a single decision
 
     Attributes:
         tools (list): List of available tools that can be executed
         memory (Memory): Reference to the Memory instance for storing execution history
         logger (Logger): Logger instance for logging execution details
+        trace (list): Record of every executed tool call with its arguments, result and error flag
+        finished (bool): Whether a decision reached the final answer
     """
 
     def __init__(self, tools, memory, logger):
@@ -31,6 +89,9 @@ class Action:
         self.tools = tools
         self.memory = memory
         self.logger = logger
+        self.trace = []
+        self.finished = False
+        self._recorded = None
 
     async def execute_action(
         self,
@@ -38,77 +99,220 @@ class Action:
         session: ClientSession,
         session_id: str,
         iteration: int,
+        recorded: asyncio.Event | None = None,
     ) -> bool:
         """
-        Execute a tool call based on the function_call decision.
+        Execute the tool calls of a function_call decision.
+
+        A decision carries either a single call or an ordered batch of calls. The calls
+        of a batch run one after the other over the same session, or concurrently when
+        the decision marks them as independent. In a sequential batch a failing call
+        aborts the rest of the batch and control goes back to the LLM, as does a failing
+        call of an independent batch, even when the batch carries the final answer.
+
+        Args:
+            function_call (FunctionCall | None): The decision to execute one or more tools
+            session: The MCP session for executing tools
+            session_id (str): Unique identifier for the current session
+            iteration (int): Current iteration number
+            recorded (asyncio.Event): Set once the decision is in memory, for calls dispatched
+                before the end of a streamed reply. Their results are stored after it
+
+        Returns:
+            bool: True if execution should continue, False if it should stop
+        """
+        if not isinstance(function_call, FunctionCall):
+            # The decision could not be parsed, the failure is in memory for the next decision
+            self.logger.warning(f"No valid decision in iteration {iteration}, no tool was called")
+            return True
+
+        calls = function_call.planned_calls()
+        with tracer.span(
+            "action", iteration=iteration, calls=len(calls), independent=function_call.independent
+        ):
+            self._recorded = recorded
+            try:
+                return await self._execute_calls(
+                    calls, function_call.independent, session, session_id, iteration
+                )
+            finally:
+                self._recorded = None
+
+    async def _decision_recorded(self) -> None:
+        """Wait until the decision of the calls is in memory, so that it reads before their results"""
+        if self._recorded is not None:
+            await self._recorded.wait()
+
+    async def _execute_calls(
+        self,
+        calls: list[ToolCall],
+        independent: bool,
+        session: ClientSession,
+        session_id: str,
+        iteration: int,
+    ) -> bool:
+        if independent and len(calls) > 1:
+            to_run = [c for c in calls if c.tool_name != FunctionName.FINAL_ANSWER]
+            succeeded = await asyncio.gather(
+                *(
+                    self._execute_call(call, session, session_id, iteration)
+                    for call in to_run
+                )
+            )
+            if not all(succeeded):
+                failed = [call.tool_name.value for call, ok in zip(to_run, succeeded) if not ok]
+                if len(to_run) < len(calls):
+                    self.logger.warning(f"Not taking the final answer of the batch after {', '.join(failed)} failed")
+                    self.memory.store(
+                        f"In iteration {iteration} the calls to {', '.join(failed)} failed, so the final answer "
+                        f"of the batch was not taken.\n",
+                        session_id,
+                        kind="batch_aborted",
+                        iteration=iteration,
+                    )
+                return True
+            if len(to_run) < len(calls):
+                self.logger.info("Agent execution completed!")
+                self.finished = True
+                return False
+            return True
+
+        for position, call in enumerate(calls):
+            # Handle the function call based on its type
+            if call.tool_name == FunctionName.FINAL_ANSWER:
+                self.logger.info("Agent execution completed!")
+                self.finished = True
+                return False
+
+            succeeded = await self._execute_call(call, session, session_id, iteration)
+            skipped = calls[position + 1 :]
+            if not succeeded and skipped:
+                self.logger.warning(
+                    f"Skipping {len(skipped)} calls of the batch after {call.tool_name.value} failed"
+                )
+                self.memory.store(
+                    f"In iteration {iteration} the call to {call.tool_name.value} failed, so the remaining calls "
+                    f"of the batch were not executed: {', '.join(c.tool_name.value for c in skipped)}.\n",
+                    session_id,
+                    kind="batch_aborted",
+                    iteration=iteration,
+                )
+                break
+
+        return True
+
+    async def _execute_call(
+        self,
+        call: ToolCall,
+        session: ClientSession,
+        session_id: str,
+        iteration: int,
+    ) -> bool:
+        """
+        Execute a single tool call and record it.
 
         This method:
         1. Validates the tool call
         2. Executes the tool with provided arguments
         3. Processes and formats the result
         4. Stores the execution details in memory
-        5. Determines if execution should continue
 
         Args:
-            function_call (FunctionCall): The decision to execute a specific tool
+            call (ToolCall): The tool call to execute
             session: The MCP session for executing tools
             session_id (str): Unique identifier for the current session
             iteration (int): Current iteration number
 
+        A call which raises, e.g. for an unknown tool or a broken transport, is recorded
+        as a failed call, so that the batch is aborted and the LLM decides what to do next.
+
         Returns:
-            bool: True if execution should continue, False if it should stop
+            bool: True if the tool executed without an error
         """
-        # Handle the function call based on its type
-        if function_call.tool_name == FunctionName.FINAL_ANSWER:
-            self.logger.info("Agent execution completed!")
-            return False
-
-        tool = next(
-            (t for t in self.tools if t.name == function_call.tool_name.value),
-            None,
-        )
+        with tracer.span("action.call", tool=call.tool_name.value) as span:
+            try:
+                return await self._call(call, session, session_id, iteration)
+            except Exception as e:
+                span.set(error=type(e).__name__)
+                self.logger.error(f"The call to {call.tool_name.value} raised: {e}")
+                error = f"{type(e).__name__}: {e}"
+                await self._decision_recorded()
+                self.trace.append(
+                    {
+                        "iteration": iteration,
+                        "tool_name": call.tool_name.value,
+                        "arguments": call.arguments,
+                        "result": [error],
+                        "is_error": True,
+                    }
+                )
+                self.memory.store(
+                    f"In iteration {iteration} you called {call.tool_name.value} with {call.arguments} parameters, "
+                    f"and the call raised {error}.\n",
+                    session_id,
+                    kind="tool_call",
+                    tool_name=call.tool_name.value,
+                    arguments=call.arguments,
+                    result=[error],
+                    iteration=iteration,
+                )
+                return False
+
+    async def _call(
+        self,
+        call: ToolCall,
+        session: ClientSession,
+        session_id: str,
+        iteration: int,
+    ) -> bool:
+        with tracer.span("action.lookup"):
+            tool = next(
+                (t for t in self.tools if t.name == call.tool_name.value),
+                None,
+            )
 
         if not tool:
             self.logger.error(f"Available tools: {[t.name for t in self.tools]}")
-            raise ValueError(f"Unknown tool: {function_call.tool_name.value}")
+            raise ValueError(f"Unknown tool: {call.tool_name.value}")
 
         self.logger.debug(f"Found tool: {tool.name}")
         self.logger.debug(f"Tool schema: {tool.inputSchema}")
 
-        result = await session.call_tool(
-            function_call.tool_name.value,
-            arguments=function_call.arguments,
-        )
+        with tracer.span("action.call_tool", tool=call.tool_name.value) as span:
+            result = await session.call_tool(
+                call.tool_name.value,
+                arguments=call.arguments,
+            )
+            span.set(is_error=bool(getattr(result, "isError", False)))
 
         self.logger.debug(f"Raw result: {result}")
 
-        # Get the full result content
-        if hasattr(result, "content"):
-            self.logger.debug("Result has content attribute")
-            # Handle multiple content items
-            if isinstance(result.content, list):
-                iteration_result = [
-                    (item.text if hasattr(item, "text") else str(item))
-                    for item in result.content
-                ]
-            else:
-                iteration_result = str(result.content)
-        else:
-            self.logger.debug("Result has no content attribute")
-            iteration_result = str(result)
-
+        iteration_result, result_str = flatten_result(result)
         self.logger.debug(f"Final iteration result: {iteration_result}")
 
-        # Format the response based on result type
-        if isinstance(iteration_result, list):
-            result_str = f"[{', '.join(iteration_result)}]"
-        else:
-            result_str = str(iteration_result)
+        self.trace.append(
+            {
+                "iteration": iteration,
+                "tool_name": call.tool_name.value,
+                "arguments": call.arguments,
+                "result": iteration_result,
+                "is_error": bool(getattr(result, "isError", False)),
+            }
+        )
 
         # Add the tool call, execution result and the return value of the function to the memory
-        self.memory.session[session_id].append(
-            f"In iteration {iteration} you called {function_call.tool_name.value} with {function_call.arguments} parameters, "
-            f"and the function returned {result_str}.\n"
-        )
+        await self._decision_recorded()
+        with tracer.span("action.memory_append", response_bytes=len(result_str)):
+            self.memory.store(
+                f"In iteration {iteration} you called {call.tool_name.value} with {call.arguments} parameters, "
+                f"and the function returned {result_str}.\n",
+                session_id,
+                kind="tool_call",
+                tool_name=call.tool_name.value,
+                arguments=call.arguments,
+                result=iteration_result,
+                iteration=iteration,
+                gcode=extract_gcode(iteration_result),
+            )
 
-        return True
+        return not getattr(result, "isError", False)
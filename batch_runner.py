@@ -0,0 +1,170 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from action import extract_gcode
+from mcp_client import run_agent, logger, response_cache, server_params
+from mcp_schemas import ProgramOutput
+from session_pool import MCPSessionPool
+from utils import FunctionName
+
+
+def load_tasks(path: str) -> list[dict]:
+    """
+    Load the task specs of a batch.
+
+    Every non-empty line of the file is a JSON object with a `query`, and optionally an
+    `id` and the user `preferences` for that task.
+
+    Args:
+        path (str): Path of the JSONL file
+
+    Returns:
+        list: The task specs, each with an id
+    """
+    tasks = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            task = json.loads(line)
+            task.setdefault("id", f"task-{line_number}")
+            task.setdefault("preferences", "")
+            tasks.append(task)
+    return tasks
+
+
+def extract_program(trace: list[dict]) -> str:
+    """
+    Get the program produced by an agent run.
+
+    The finalized program of the server is preferred, then the text shown in the paint
+    tool; when the run never got there, the G-code returned by the tools is concatenated
+    in call order.
+
+    Args:
+        trace (list): The tool calls recorded by the Action of the run
+
+    Returns:
+        str: The CNC program
+    """
+    for call in reversed(trace):
+        if call["tool_name"] == FunctionName.FINALIZE_PROGRAM.value:
+            try:
+                return "\n".join(ProgramOutput.model_validate_json(call["result"][0]).result)
+            except (ValueError, IndexError):
+                pass
+        if call["tool_name"] == FunctionName.ADD_TEXT_IN_PAINT.value:
+            arguments = call["arguments"] or {}
+            text = arguments.get("input", arguments).get("text")
+            if text:
+                return text
+
+    return "\n".join(block for call in trace for block in extract_gcode(call["result"]))
+
+
+async def run_task(
+    task: dict,
+    output_dir: str,
+    semaphore: asyncio.Semaphore,
+    session_pool: MCPSessionPool | None = None,
+) -> bool:
+    """
+    Run the agent loop of one task and write its program and trace.
+
+    Args:
+        task (dict): The task spec
+        output_dir (str): Directory under which the task's outputs are written
+        semaphore (asyncio.Semaphore): Limits the number of agent loops running at once
+        session_pool (MCPSessionPool): Warm action servers to lease from
+
+    Returns:
+        bool: True if the run produced a program
+    """
+    async with semaphore:
+        logger.info(f"Starting task {task['id']}")
+        mem, session_id, action = await run_agent(
+            task["query"],
+            task["preferences"],
+            interactive=False,
+            session_pool=session_pool,
+        )
+
+    task_dir = os.path.join(output_dir, task["id"])
+    os.makedirs(task_dir, exist_ok=True)
+    trace = action.trace if action else []
+    program = extract_program(trace)
+
+    with open(os.path.join(task_dir, "program.nc"), "w") as f:
+        f.write(program)
+    with open(os.path.join(task_dir, "trace.jsonl"), "w") as f:
+        for call in trace:
+            f.write(json.dumps(call) + "\n")
+    with open(os.path.join(task_dir, "memory.txt"), "w") as f:
+        f.write(mem.recall(session_id, include_preferences=True))
+
+    logger.info(f"Finished task {task['id']} with {len(trace)} tool calls")
+    return bool(program)
+
+
+async def run_batch(
+    tasks: list[dict], output_dir: str, concurrency: int, servers: int | None = None
+) -> dict:
+    """
+    Run many agent loops concurrently.
+
+    The action servers are spawned once into a pool and leased to the agent loops, so
+    only the first tasks pay for the server startup.
+
+    Args:
+        tasks (list): The task specs
+        output_dir (str): Directory under which every task's outputs are written
+        concurrency (int): Maximum number of agent loops running at once
+        servers (int): Number of warm action servers, one per concurrent loop by default
+
+    Returns:
+        dict: Summary of the batch with its throughput in tasks per minute
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.perf_counter()
+    session_pool = MCPSessionPool(server_params, size=servers or concurrency)
+    await session_pool.start()
+    try:
+        results = await asyncio.gather(
+            *(run_task(task, output_dir, semaphore, session_pool) for task in tasks),
+            return_exceptions=True,
+        )
+    finally:
+        await session_pool.close()
+    elapsed = time.perf_counter() - start
+
+    failed = [
+        task["id"] for task, result in zip(tasks, results) if result is not True
+    ]
+    summary = {
+        "tasks": len(tasks),
+        "succeeded": len(tasks) - len(failed),
+        "failed": failed,
+        "elapsed_seconds": round(elapsed, 3),
+        "tasks_per_minute": round(len(tasks) / elapsed * 60, 3) if elapsed else None,
+    }
+    with open(os.path.join(output_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many CNC tasks concurrently.")
+    parser.add_argument("tasks", help="JSONL file with one task spec per line")
+    parser.add_argument("--output-dir", default="batch_output")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--servers", type=int, default=None)
+    args = parser.parse_args()
+
+    summary = asyncio.run(
+        run_batch(load_tasks(args.tasks), args.output_dir, args.concurrency, args.servers)
+    )
+    logger.info(f"Batch summary: {summary}")
+    logger.info(f"LLM response cache: {response_cache.stats()}")
@@ -0,0 +1,460 @@
+import argparse
+import asyncio
+import gc
+import inspect
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+from contextlib import AsyncExitStack, redirect_stdout
+import httpx
+from mcp.shared.memory import create_connected_server_and_client_session
+from mcp.types import CallToolResult, TextContent
+
+# The suite runs fully offline: the only LLM it reaches is a stub transport
+import mcp_action_server
+from action import extract_gcode, flatten_result
+from decision import Decision
+from gcode_tools import pure_gcode_tools
+from json_stream import IncrementalObjectParser
+from llm_backend import LLMBackend
+from llm_stand_in import default_trajectory, stream_chunk_chars
+from memory import Memory
+from perception import PerceptionObject
+from prompt_engine import PromptEngine
+from structured_output import StructuredOutput
+from utils import FunctionCall, get_description_from_tools
+
+logger = logging.getLogger("benchmarks")
+
+# Numbers of memory entries at which recall is measured
+memory_sizes = (10, 100, 1000, 10000)
+
+# Arguments of the G-code tools, taken from the scripted run of the default task
+tool_arguments = {
+    call["tool_name"]: call["arguments"]
+    for decision in default_trajectory["decisions"]
+    for call in decision["calls"]
+}
+
+
+class BenchmarkSuite:
+    """
+    The BenchmarkSuite class times the code run on every iteration of the agent loop.
+
+    The BenchmarkSuite class:
+    1. Registers named benchmarks, each a function or coroutine function without arguments
+    2. Calibrates the number of loops of a benchmark so that one repeat lasts `min_time`
+    3. Times several repeats with the garbage collector disabled, as `timeit` does, and
+       keeps the median and the minimum time per operation
+    4. Compares the results with stored baselines and flags the regressions
+
+    Attributes:
+        repeats (int): Number of timed repeats of every benchmark
+        min_time (float): Minimum duration in seconds of one repeat
+        benchmarks (dict): The registered functions by benchmark name
+    """
+
+    def __init__(self, repeats: int = 5, min_time: float = 0.05) -> None:
+        """
+        Initialize an empty suite.
+
+        Args:
+            repeats (int): Number of timed repeats of every benchmark
+            min_time (float): Minimum duration in seconds of one repeat
+        """
+        self.repeats = repeats
+        self.min_time = min_time
+        self.benchmarks = {}
+
+    def add(self, name: str, function) -> None:
+        """
+        Register a benchmark.
+
+        Args:
+            name (str): Unique name of the benchmark, e.g. "memory.recall[1000]"
+            function: The operation to time, a function or a coroutine function
+        """
+        self.benchmarks[name] = function
+
+    async def _time(self, function, loops: int) -> float:
+        if inspect.iscoroutinefunction(function):
+            start = time.perf_counter_ns()
+            for _ in range(loops):
+                await function()
+            return time.perf_counter_ns() - start
+        start = time.perf_counter_ns()
+        for _ in range(loops):
+            function()
+        return time.perf_counter_ns() - start
+
+    async def measure(self, function) -> dict:
+        """
+        Time one operation.
+
+        Args:
+            function: The operation, a function or a coroutine function
+
+        Returns:
+            dict: Median and minimum nanoseconds per operation and the loops per repeat
+        """
+        loops = 1
+        while await self._time(function, loops) < self.min_time * 1e9:
+            loops *= 2
+
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            per_op = [await self._time(function, loops) / loops for _ in range(self.repeats)]
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        return {
+            "median_ns": round(statistics.median(per_op), 1),
+            "min_ns": round(min(per_op), 1),
+            "loops": loops,
+        }
+
+    async def run(self, pattern: str | None = None) -> dict:
+        """
+        Run the benchmarks.
+
+        Args:
+            pattern (str): Only run the benchmarks whose name contains it, all if not given
+
+        Returns:
+            dict: The measurements by benchmark name
+        """
+        results = {}
+        for name, function in self.benchmarks.items():
+            if pattern and pattern not in name:
+                continue
+            results[name] = await self.measure(function)
+            logger.info(f"{name}: {format_ns(results[name]['median_ns'])}")
+        return results
+
+
+def format_ns(ns: float) -> str:
+    """Render a duration with a readable unit"""
+    for unit, scale in (("s", 1e9), ("ms", 1e6), ("us", 1e3)):
+        if ns >= scale:
+            return f"{ns / scale:.2f} {unit}"
+    return f"{ns:.0f} ns"
+
+
+def compare(results: dict, baselines: dict, threshold: float) -> list[dict]:
+    """
+    Compare measurements with their baselines.
+
+    Args:
+        results (dict): The measurements by benchmark name
+        baselines (dict): The stored measurements by benchmark name
+        threshold (float): Relative slowdown of the median above which a benchmark regressed
+
+    Returns:
+        list: One row per benchmark with its change, None when it has no baseline
+    """
+    rows = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        change = (
+            result["median_ns"] / baseline["median_ns"] - 1
+            if baseline and baseline["median_ns"]
+            else None
+        )
+        rows.append(
+            {
+                "name": name,
+                "median_ns": result["median_ns"],
+                "baseline_ns": baseline["median_ns"] if baseline else None,
+                "change": change,
+                "regressed": change is not None and change > threshold,
+            }
+        )
+    return rows
+
+
+def environment() -> dict:
+    """Describe the interpreter and the machine the baselines were measured on"""
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+    }
+
+
+def load_baselines(path: str) -> tuple:
+    """
+    Load stored baselines.
+
+    Args:
+        path (str): Path of the JSON baselines file
+
+    Returns:
+        tuple: The measurements by benchmark name and the environment they were measured
+        in, empty if the file does not exist
+    """
+    try:
+        with open(path) as f:
+            stored = json.load(f)
+    except FileNotFoundError:
+        return {}, {}
+    return stored["results"], stored.get("environment", {})
+
+
+def save_baselines(path: str, results: dict) -> None:
+    """
+    Store measurements as the new baselines, keeping those of the benchmarks not run.
+
+    Args:
+        path (str): Path of the JSON baselines file
+        results (dict): The measurements by benchmark name
+    """
+    baselines, _ = load_baselines(path)
+    baselines.update(results)
+    with open(path, "w") as f:
+        json.dump(
+            {"environment": environment(), "results": dict(sorted(baselines.items()))},
+            f,
+            indent=2,
+        )
+        f.write("\n")
+
+
+def stub_transport() -> httpx.MockTransport:
+    """Transport answering every chat completion with the first decision of the default task"""
+    content = json.dumps(default_trajectory["decisions"][0])
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            200,
+            json={
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": 0,
+                "model": "stub",
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": content},
+                    }
+                ],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            },
+        )
+
+    return httpx.MockTransport(handler)
+
+
+def tool_call_entry(iteration: int) -> str:
+    """A memory entry of the size of a typical tool call"""
+    return (
+        f"In iteration {iteration} you called do_turning with "
+        f"{tool_arguments['do_turning']} parameters, and the function returned "
+        '[{"result": ["G0 X52 Z2", "G1 X46 F0.2", "G1 Z-100", "G0 X52", "G0 Z2"]}].\n'
+    )
+
+
+async def build_suite(stack: AsyncExitStack, suite: BenchmarkSuite) -> BenchmarkSuite:
+    """
+    Register the benchmarks of the agent hot paths.
+
+    Args:
+        stack (AsyncExitStack): Keeps the in-memory MCP session open while the suite runs
+        suite (BenchmarkSuite): The suite to register the benchmarks in
+
+    Returns:
+        BenchmarkSuite: The suite
+    """
+    # Memory recall of a session with a growing number of entries, with its rendered
+    # view up to date (the common case) and rebuilt from scratch
+    for size in memory_sizes:
+        memory = Memory()
+        memory.preferences.append("Use a carbide insert")
+        memory.new_session("bench")
+        for iteration in range(size):
+            memory.store(tool_call_entry(iteration), "bench", kind="tool_call")
+
+        def recall(memory=memory):
+            memory.recall("bench")
+
+        def recall_cold(memory=memory):
+            memory._rendered.pop("bench", None)
+            memory.recall("bench")
+
+        suite.add(f"memory.recall[{size}]", recall)
+        suite.add(f"memory.recall_cold[{size}]", recall_cold)
+
+    # Prompts built from the tool list of the action server
+    tools = await mcp_action_server.mcp.list_tools()
+    client = LLMBackend(api_key="offline", transport=stub_transport())
+    stack.push_async_callback(client.aclose)
+    memory = Memory()
+    memory.new_session("bench")
+    decision = Decision(memory, client, logger, PromptEngine(plan_mode=True), interactive=False)
+    suite.add("decision.get_base_prompt", lambda: decision._get_base_prompt(tools))
+    suite.add(
+        "decision.get_base_prompt_cold",
+        lambda: Decision(memory, client, logger, interactive=False)._get_base_prompt(tools),
+    )
+    suite.add("utils.get_description_from_tools", lambda: get_description_from_tools(tools))
+
+    async def decide():
+        await decision.decide("bench", "Turn the rod to 30 mm", tools)
+
+    suite.add("decision.decide_stubbed_llm", decide)
+
+    # Validation of the LLM replies
+    decision_json = json.dumps(default_trajectory["decisions"][1])
+    perception_json = json.dumps(default_trajectory["perception"])
+    structured_output = StructuredOutput()
+    suite.add("validate.function_call", lambda: FunctionCall.model_validate_json(decision_json))
+    suite.add(
+        "validate.perception_object",
+        lambda: PerceptionObject.model_validate_json(perception_json),
+    )
+    suite.add("validate.structured_output", lambda: structured_output.parse(decision_json, tools))
+
+    # Incremental parse of a streamed decision, chunked like the stand-in streams it
+    chunks = [
+        decision_json[start : start + stream_chunk_chars]
+        for start in range(0, len(decision_json), stream_chunk_chars)
+    ]
+
+    def parse_stream():
+        parser = IncrementalObjectParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+
+    suite.add("validate.incremental_stream", parse_stream)
+
+    # Flattening of a tool result into the trace and the memory entry
+    result = CallToolResult(
+        content=[
+            TextContent(type="text", text=json.dumps({"result": ["G0 X52 Z2", "G1 X46 F0.2"] * 20}))
+        ]
+    )
+    suite.add("action.flatten_result", lambda: flatten_result(result))
+    suite.add("action.extract_gcode", lambda: extract_gcode(flatten_result(result)[0]))
+
+    # Every G-code tool, called directly and through an in-memory MCP session
+    session = await stack.enter_async_context(
+        create_connected_server_and_client_session(mcp_action_server.mcp._mcp_server)
+    )
+    sections = []
+    for tool in pure_gcode_tools:
+        name = tool.__name__
+        arguments = tool_arguments.get(name, {})
+        input_type = tool.__annotations__.get("input")
+
+        if input_type is None:
+            direct = tool
+        else:
+
+            def direct(tool=tool, input_type=input_type, arguments=arguments["input"]):
+                return tool(input_type(**arguments))
+
+        sections.append({"section": name, "blocks": direct().result})
+
+        async def through_session(name=name, arguments=arguments):
+            await session.call_tool(name, arguments=arguments)
+
+        suite.add(f"tool.{name}.direct", direct)
+        suite.add(f"tool.{name}.mcp_session", through_session)
+
+    # The program tools, on programs seeded with the G-code of the default task and named
+    # by id, so that the G-code tools above do not grow them while they are measured
+    def seed_direct() -> str:
+        program = mcp_action_server.programs.start(None)
+        for section in sections:
+            program.append(section["blocks"], section["section"])
+        return program.program_id
+
+    async def seed_session() -> str:
+        result = await session.call_tool("start_program", arguments={})
+        program_id = json.loads(result.content[0].text)["program_id"]
+        await session.call_tool(
+            "append_to_program", arguments={"input": {"program_id": program_id, "sections": sections}}
+        )
+        return program_id
+
+    program_arguments = {
+        "get_program": {},
+        "annotate_program": {"index": 0, "comment": "Metric, absolute"},
+        "reorder_program": {"order": list(range(sum(len(s["blocks"]) for s in sections)))},
+        "simulate_program": tool_arguments["simulate_program"]["input"],
+        "estimate_cycle_time": {},
+        "finalize_program": {},
+    }
+    direct_id, session_id = seed_direct(), await seed_session()
+    for name, arguments in program_arguments.items():
+        tool = getattr(mcp_action_server, name)
+        input_type = tool.__annotations__["input"]
+        if name == "finalize_program":
+            # A finalized program can no longer change, so finalizing gets programs of its own
+            direct_id, session_id = seed_direct(), await seed_session()
+            # and the G-code tools append to a program of their own again
+            await session.call_tool("start_program", arguments={})
+
+        def direct(tool=tool, input_type=input_type, arguments={**arguments, "program_id": direct_id}):
+            tool(input_type(**arguments))
+
+        async def through_session(name=name, arguments={**arguments, "program_id": session_id}):
+            await session.call_tool(name, arguments={"input": arguments})
+
+        suite.add(f"tool.{name}.direct", direct)
+        suite.add(f"tool.{name}.mcp_session", through_session)
+
+    return suite
+
+
+async def main(args: argparse.Namespace) -> int:
+    async with AsyncExitStack() as stack:
+        suite = await build_suite(stack, BenchmarkSuite(args.repeats, args.min_time))
+        # The LLM helpers print their progress, which would flood the report
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            results = await suite.run(args.filter)
+
+    if args.save:
+        save_baselines(args.baselines, results)
+        print(f"Saved {len(results)} baselines to {args.baselines}")
+        return 0
+
+    baselines, measured_in = load_baselines(args.baselines)
+    if measured_in and measured_in != environment():
+        print(f"Warning: the baselines were measured in {measured_in}, not {environment()}")
+
+    rows = compare(results, baselines, args.threshold)
+    width = max(len(row["name"]) for row in rows)
+    for row in rows:
+        change = "new" if row["change"] is None else f"{row['change']:+.1%}"
+        status = "REGRESSED" if row["regressed"] else ""
+        print(f"{row['name']:<{width}}  {format_ns(row['median_ns']):>10}  {change:>8}  {status}")
+
+    regressed = [row["name"] for row in rows if row["regressed"]]
+    if regressed:
+        print(f"{len(regressed)} benchmarks regressed by more than {args.threshold:.0%}: {', '.join(regressed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths of the agent loop.")
+    parser.add_argument("-k", "--filter", help="Only run the benchmarks whose name contains this")
+    parser.add_argument("--baselines", default="benchmark_baselines.json")
+    parser.add_argument("--save", action="store_true", help="Store the results as the new baselines")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.05)
+    args = parser.parse_args()
+
+    # Keep the request logs of the in-memory MCP server out of the report
+    logging.basicConfig(format="%(message)s")
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,170 @@
+import math
+from gcode_parser import ModalState, expand_cycles, iter_blocks
+from mcp_schemas import BlockTime, CycleTimeOutput, MachineProfile
+
+
+class CycleTimeEstimator:
+    """
+    The CycleTimeEstimator class estimates how long a turning program runs on the machine.
+
+    The CycleTimeEstimator class:
+    1. Interprets the modal state of the program (G0/G1, G20/G21, G90/G91, G94/G95, G96/G97, F, S, T, M03/M04/M05)
+    2. Times rapid moves with the rapid traverse rate of each axis, the slower axis setting the time
+    3. Times feed moves from the feed per minute, or the feed per revolution times the spindle speed
+    4. Adds the overheads of tool changes, spindle starts and dwells
+    5. Reports the totals and the time of every block, a block which moves after a tool
+       change or a spindle start having one entry for its overhead and one for its move
+
+    X is programmed as a diameter, and its rapid rate applies to the radial motion.
+
+    Attributes:
+        machine (MachineProfile): Rapid rates, spindle limit and overheads of the machine
+    """
+
+    def __init__(self, machine: MachineProfile | None = None) -> None:
+        """
+        Initialize the estimator.
+
+        Args:
+            machine (MachineProfile): Machine to estimate for, the default profile if not given
+        """
+        self.machine = machine or MachineProfile()
+
+    def run(self, lines, start: int = 1, breakdown: bool = True) -> CycleTimeOutput:
+        """
+        Estimate the cycle time of a program.
+
+        Args:
+            lines: The G-code program, as a list of lines, one string or blocks streamed
+                by `gcode_parser.iter_file`
+            start (int): Number of the first block in the breakdown
+            breakdown (bool): Report the time of every block, turn off to keep the memory
+                use constant on very long programs
+
+        Returns:
+            CycleTimeOutput: Total, cutting, rapid and overhead seconds and the time of every block
+        """
+        machine = self.machine
+        state = ModalState()
+        x, z = machine.home_x, machine.home_z
+        totals = {"cutting": 0.0, "rapid": 0.0, "overhead": 0.0}
+        blocks, warnings = [], []
+
+        for block in expand_cycles(iter_blocks(lines, start)):
+            state.update(block)
+            # Time of the block by kind, the overhead first since it happens before the move
+            timed = {}
+            if 4 in block.g:
+                # Dwell, given in seconds by X or in milliseconds by P
+                timed["overhead"] = block.words.get("X", block.words.get("P", 0.0) / 1000)
+            if 70 in block.g or 71 in block.g:
+                warnings.append(
+                    f"Block {block.line_number} '{block.raw}' is a canned cycle which could not be "
+                    "expanded and is not timed"
+                )
+            if state.tool_changed:
+                timed["overhead"] = timed.get("overhead", 0.0) + machine.tool_change_time
+            if state.spindle_started:
+                timed["overhead"] = timed.get("overhead", 0.0) + machine.spindle_start_time
+
+            if block.moves:
+                x1, z1 = state.endpoint(block, x, z)
+                radial, axial = abs(x1 - x) / 2, abs(z1 - z)
+                if state.motion == 0:
+                    timed["rapid"] = 60 * max(
+                        radial / machine.rapid_rate_x, axial / machine.rapid_rate_z
+                    )
+                else:
+                    rate = self._feed_per_minute(state, (x + x1) / 2)
+                    if rate is None:
+                        warnings.append(
+                            f"Block {block.line_number} '{block.raw}' feeds without a feed rate "
+                            "or spindle speed and is not timed"
+                        )
+                    timed["cutting"] = 0.0 if rate is None else 60 * math.hypot(radial, axial) / rate
+                x, z = x1, z1
+
+            for kind, seconds in timed.items():
+                totals[kind] += seconds
+                if breakdown:
+                    blocks.append(
+                        BlockTime(
+                            line_number=block.line_number,
+                            block=block.raw,
+                            kind=kind,
+                            seconds=round(seconds, 3),
+                        )
+                    )
+
+        return CycleTimeOutput(
+            total_seconds=round(sum(totals.values()), 3),
+            cutting_seconds=round(totals["cutting"], 3),
+            rapid_seconds=round(totals["rapid"], 3),
+            overhead_seconds=round(totals["overhead"], 3),
+            blocks=blocks,
+            warnings=warnings,
+        )
+
+    def _feed_per_minute(self, state: ModalState, diameter: float) -> float | None:
+        """
+        Get the feed rate of a move in mm/min.
+
+        Args:
+            state (ModalState): Modal state of the move, for the feed, speed and their modes
+            diameter (float): Mean diameter of the move in mm, for the constant surface speed
+
+        Returns:
+            float | None: The feed rate, None if it cannot be known
+        """
+        if not state.feed:
+            return None
+        if not state.per_revolution:
+            return state.feed
+        rpm = state.speed
+        if state.constant_surface_speed:
+            rpm = 1000 * state.speed / (math.pi * max(diameter, 1e-3))
+        rpm = min(rpm, self.machine.max_spindle_speed)
+        return state.feed * rpm if rpm > 0 else None
+
+
+def estimate_cycle_time(
+    lines,
+    machine: MachineProfile | None = None,
+    start: int = 1,
+    breakdown: bool = True,
+) -> CycleTimeOutput:
+    """
+    Estimate how long a program runs on the machine.
+
+    Args:
+        lines: The G-code program, as a list of blocks or one string
+        machine (MachineProfile): Machine to estimate for, the default profile if not given
+        start (int): Number of the first block in the breakdown
+        breakdown (bool): Report the time of every block
+
+    Returns:
+        CycleTimeOutput: Total, cutting, rapid and overhead seconds and the time of every block
+    """
+    return CycleTimeEstimator(machine).run(lines, start, breakdown)
+
+
+def rank_programs(programs: dict, machine: MachineProfile | None = None) -> list:
+    """
+    Rank candidate programs by estimated cycle time, the fastest first.
+
+    Programs with blocks which could not be timed are ranked after the others,
+    as their estimate is only a lower bound.
+
+    Args:
+        programs (dict): Candidate programs by name
+        machine (MachineProfile): Machine to estimate for, the default profile if not given
+
+    Returns:
+        list: (name, CycleTimeOutput) pairs in rank order
+    """
+    estimates = [
+        (name, estimate_cycle_time(lines, machine, breakdown=False)) for name, lines in programs.items()
+    ]
+    return sorted(
+        estimates, key=lambda item: (bool(item[1].warnings), item[1].total_seconds)
+    )
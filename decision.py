@@ -1,8 +1,16 @@
+import asyncio
 from memory import Memory
-from sub_prompts import *
-from utils import get_description_from_tools, generate_with_timeout, FunctionCall
-from openai import OpenAI
+from history import HistoryManager
+from prompt_engine import PromptEngine
+from utils import generate_with_timeout, FunctionCall
+from llm_backend import LLMBackend
+from llm_cache import ResponseCache
+from structured_output import StructuredOutput
+from json_stream import IncrementalObjectParser
+from openai import BadRequestError
+from tracing import tracer
 from logging import Logger
+import time
 from typing import List
 from mcp import Tool
 
@@ -15,41 +23,70 @@ class Decision:
     The Decision class:
     1. Constructs prompts for the LLM based on available tools and memory
     2. Makes decisions about which tool to execute next
-    3. Validates the decisions before they are executed
+    3. Validates the decisions before they are executed, constraining the output to the tool
+       schemas when the backend supports it and repairing or retrying malformed replies otherwise
     4. Ensures decisions align with the overall task goals
+    5. Optionally streams the decisions and dispatches their calls as soon as they are
+       determined, before the prose of the reply is complete
 
     Attributes:
         memory (Memory): Reference to the Memory instance for accessing history
-        client (OpenAI): OpenAI client for making LLM calls
+        client (LLMBackend): Async LLM backend for making LLM calls
         logger (Logger): Logger instance for logging decision details
+        prompt_engine (PromptEngine): Builds the cached prompt prefix and the message history
+        cache (ResponseCache | None): Response cache for the decision calls, None to always sample afresh
+        interactive (bool): Whether to pause in an interactive console before every LLM call
+        history (HistoryManager): Keeps the history sent to the LLM within a token budget
+        structured_output (StructuredOutput): Derives the decision schema and repairs replies
+        max_repair_retries (int): LLM round trips spent on a reply which cannot be repaired locally
+        streaming (bool): Whether decisions are streamed, which bypasses the response cache
     """
 
     def __init__(
         self,
         memory: Memory,
-        client: OpenAI,
+        client: LLMBackend,
         logger: Logger,
+        prompt_engine: PromptEngine | None = None,
+        cache: ResponseCache | None = None,
+        interactive: bool = True,
+        history: HistoryManager | None = None,
+        structured_output: StructuredOutput | None = None,
+        max_repair_retries: int = 1,
+        streaming: bool = False,
     ):
         """
         Initialize the Decision class with necessary dependencies.
 
         Args:
             memory (Memory): Reference to the Memory instance
-            client (OpenAI): OpenAI client for LLM calls
+            client (LLMBackend): Async LLM backend for LLM calls
             logger (Logger): Logger instance for logging
+            prompt_engine (PromptEngine): Shared prompt engine, a new one is created if not given
+            cache (ResponseCache): Opt-in response cache, decision calls bypass caching by default
+            interactive (bool): Pause in an interactive console for debugging, disable for unattended runs
+            history (HistoryManager): History windowing policy, a default budget is used if not given
+            structured_output (StructuredOutput): Schema and repair layer, a new one is created if not given
+            max_repair_retries (int): Round trips spent asking the LLM to fix an unrepairable reply
+            streaming (bool): Stream the decisions, so that their calls can be dispatched early
         """
         self.memory = memory
         self.client = client
         self.logger = logger
+        self.prompt_engine = prompt_engine or PromptEngine()
+        self.cache = cache
+        self.interactive = interactive
+        self.history = history or HistoryManager()
+        self.structured_output = structured_output or StructuredOutput()
+        self.max_repair_retries = max_repair_retries
+        self.streaming = streaming
 
     def _get_base_prompt(self, tools) -> str:
         """
         Construct the base prompt for decision making.
 
-        This method:
-        1. Gets tool descriptions
-        2. Combines general instructions, tool descriptions, and special instructions
-        3. Creates a comprehensive prompt for the LLM
+        The prompt combines general instructions, tool descriptions, and special
+        instructions. It is rendered once per tool-set version by the prompt engine.
 
         Args:
             tools (list): List of available tools
@@ -57,66 +94,208 @@ class Decision:
         Returns:
             str: The complete base prompt for decision making
         """
-        tools_description = get_description_from_tools(tools)
-        system_prompt = f"""
-{general_instructions}
-
-Here is a list of all the tools available at your disposal:
-{tools_description}
-
-{special_instructions}
-
-{fallback_handling}
-
-{decision_response_instruction}
-"""
-        return system_prompt
+        return self.prompt_engine.static_prefix(tools)
 
-    async def decide(self, session_id: str, query: str, tools: List[Tool]) -> FunctionCall:
+    async def decide(
+        self, session_id: str, query: str, tools: List[Tool], dispatch=None
+    ) -> FunctionCall | None:
         """
         Make a decision about which tool to execute next.
 
         This method:
-        1. Constructs the complete prompt including history and current query
-        2. Gets the LLM's response
-        3. Validates the response as a FunctionCall
-        4. Returns the validated decision
+        1. Constructs the messages: the cached prefix, the query and the windowed history turns
+        2. Gets the LLM's response, constrained to the decision schema if the backend supports it
+        3. Validates the response as a FunctionCall, repairing it locally if needed
+        4. Asks the LLM to fix a reply which cannot be repaired, a bounded number of times
+        5. Returns the validated decision
+
+        When streaming, the calls are handed to `dispatch` as soon as their fields are
+        complete and valid, and the prose of the reply is kept in memory once it ends.
+        The dispatched calls store their results only after that, so the history reads
+        the decision before the calls it made.
 
         Args:
             session_id (str): Unique identifier for the current session
             query (str): The current task query
             tools (list): List of available tools
+            dispatch: Called with the decision as soon as its calls are determined, at most
+                once, e.g. to start executing them while the reply streams. The second
+                argument is an asyncio.Event set once the decision is in memory
 
         Returns:
-            FunctionCall: The validated decision about which tool to execute
+            FunctionCall | None: The validated decision about which tool to execute, None if
+            no valid decision could be obtained, in which case the failure is kept in memory
         """
-        # Construct the base prompt
-        what_i_need_to_ask = self._get_base_prompt(tools)
-
-        # Add the task that is asked for by the user
-        what_i_need_to_ask += f"\nUser Query:\n{query}"
-
-        # Add the things which I have already done in the past based on the memory
-        history = self.memory.recall(session_id, include_preferences=True)
-        what_i_need_to_ask += f"\n{history}\n"
+        recorded = asyncio.Event()
+        with tracer.span("decision") as span:
+            try:
+                function_call = await self._decide(session_id, query, tools, dispatch, recorded)
+            finally:
+                # Also when no prose could be stored, the dispatched calls must not wait forever
+                recorded.set()
+            span.set(valid=function_call is not None)
+        return function_call
 
-        what_i_need_to_ask += "What should I do next?"
+    async def _decide(
+        self, session_id: str, query: str, tools: List[Tool], dispatch, recorded: asyncio.Event
+    ) -> FunctionCall | None:
+        with tracer.span("decision.prompt_build") as span:
+            # Stable prefix and task first, then the budgeted window of the previous iterations
+            what_i_need_to_ask = self.prompt_engine.build_messages(
+                tools,
+                query,
+                self.memory.preferences,
+                self.history.window(self.memory, session_id),
+            )
+            span.set(
+                messages=len(what_i_need_to_ask),
+                prompt_bytes=sum(len(m["content"]) for m in what_i_need_to_ask),
+            )
 
-        import code
+        if self.interactive:
+            import code
 
-        code.interact(local=locals())
+            code.interact(local=locals())
 
-        try:
-            response_text = await generate_with_timeout(
-                self.client, what_i_need_to_ask, 60
+        response_format = None
+        if self.client.structured_outputs:
+            # Streamed decisions put their calls before the prose, to dispatch them early
+            response_format = self.structured_output.response_format(
+                tools, self.prompt_engine.plan_mode, calls_first=self.streaming
             )
+
+        attempt = 0
+        dispatched = None
+        while True:
+            try:
+                with tracer.span("decision.llm_wait", attempt=attempt) as span:
+                    if self.streaming:
+                        response_text, dispatched = await self._stream(
+                            what_i_need_to_ask, tools, response_format, dispatch, recorded, span
+                        )
+                    else:
+                        response_text = await generate_with_timeout(
+                            self.client,
+                            what_i_need_to_ask,
+                            60,
+                            cache=self.cache,
+                            response_format=response_format,
+                            validate=FunctionCall.model_validate_json,
+                        )
+            except BadRequestError as e:
+                if response_format is None:
+                    raise
+                # The model does not support json_schema, fall back to the local repairs
+                self.logger.warning(f"Constrained decoding is not supported, falling back: {e}")
+                self.client.structured_outputs = False
+                response_format = None
+                continue
             self.logger.info(f"Decision Step Response: {response_text}")
 
-            # Validate the model output
-            function_call = FunctionCall.model_validate_json(response_text)
-            self.logger.info(f"Validated the Decision Step response")
-        except Exception as e:
-            function_call = f"Error in parsing {response_text}\nCould not validate the function call output because {str(e)}"
-            self.logger.error(f"Decision step response could not be validated")
+            with tracer.span("decision.validation") as span:
+                try:
+                    function_call = self.structured_output.parse(response_text, tools)
+                    self.logger.info(f"Validated the Decision Step response")
+                    if self.streaming:
+                        self.memory.store(
+                            f"Your assessment of the previous step: {function_call.what_was_done_in_previous_step}\n"
+                            f"Your plan for this step: {function_call.what_needs_to_be_done_next}\n",
+                            session_id,
+                            kind="decision",
+                        )
+                    return function_call
+                except ValueError as e:
+                    error = e
+                    span.set(error="invalid decision")
+                    self.logger.error(f"Decision step response could not be validated: {e}")
 
-        return function_call
+            if dispatched is not None:
+                # The calls are running already, only the prose of the reply is lost
+                return dispatched
+
+            if attempt == self.max_repair_retries:
+                break
+            attempt += 1
+            self.structured_output.stats["retried"] += 1
+            what_i_need_to_ask = what_i_need_to_ask + [
+                {"role": "assistant", "content": response_text},
+                {
+                    "role": "user",
+                    "content": f"Your reply could not be parsed as a decision: {error}\n"
+                    "Reply again with only the JSON object of the required schema.",
+                },
+            ]
+
+        self.memory.store(
+            f"Your last reply could not be parsed as a decision and no tool was called: {error}\n",
+            session_id,
+            kind="decision_error",
+        )
+        return None
+
+    async def _stream(
+        self, messages: list, tools: List[Tool], response_format, dispatch, recorded, span
+    ):
+        """
+        Stream a decision, dispatching its calls as soon as they are determined.
+
+        Args:
+            messages (list): Chat messages to send
+            tools (list): List of available tools
+            response_format (dict): Response format of the call, the default one if None
+            dispatch: Called with the decision once its calls are determined, None to only stream
+            recorded (asyncio.Event): Handed to `dispatch`, set once the decision is in memory
+            span: Span of the LLM wait, which records when the stream started and the calls were dispatched
+
+        Returns:
+            tuple: The whole reply and the decision dispatched before its end, None if none was
+        """
+        parser = IncrementalObjectParser()
+        dispatched = None
+        started = time.perf_counter()
+        async for chunk in self.client.stream(messages, 60, response_format=response_format):
+            if not parser.text:
+                span.set(first_chunk_ms=round((time.perf_counter() - started) * 1000, 3))
+            completed = parser.feed(chunk)
+            if completed and dispatch is not None and dispatched is None:
+                dispatched = self._determined_call(parser.fields, tools)
+                if dispatched is not None:
+                    span.set(dispatch_ms=round((time.perf_counter() - started) * 1000, 3))
+                    self.logger.info(f"Dispatching the calls before the end of the reply")
+                    dispatch(dispatched, recorded)
+        return parser.text, dispatched
+
+    def _determined_call(self, fields: dict, tools: List[Tool]) -> FunctionCall | None:
+        """
+        Get the decision of a streaming reply once its calls are known.
+
+        Args:
+            fields (dict): The top-level fields decoded so far
+            tools (list): List of available tools
+
+        Returns:
+            FunctionCall | None: The decision, with empty prose, or None if its calls are
+            not complete or not valid yet. A batch of several calls also waits for
+            "independent", or for the next field if the reply has none
+        """
+        if "calls" in fields:
+            calls = fields["calls"]
+            if (
+                isinstance(calls, list)
+                and len(calls) > 1
+                and "independent" not in fields
+                and next(reversed(fields)) == "calls"
+            ):
+                # Whether the batch may run concurrently is not known yet
+                return None
+            call_fields = {"calls": calls, "independent": fields.get("independent", False)}
+        elif "call" in fields:
+            call_fields = {"call": fields["call"]}
+        elif "tool_name" in fields and "arguments" in fields:
+            call_fields = {"tool_name": fields["tool_name"], "arguments": fields["arguments"]}
+        else:
+            return None
+        try:
+            return self.structured_output.validate_fields(call_fields, tools)
+        except ValueError:
+            return None
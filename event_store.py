@@ -0,0 +1,192 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class Event:
+    """
+    One typed entry of a session's interaction history.
+
+    Attributes:
+        session_id (str): Session the event belongs to
+        seq (int): Position of the event within its session
+        kind (str): What the event records, e.g. "perception" or "tool_call"
+        text (str): Prompt rendering of the event
+        tool_name (str | None): Tool called, for tool calls
+        arguments (dict | None): Arguments of the tool call
+        result (list | str | None): Flattened result of the tool call
+        iteration (int | None): Agent iteration in which the event happened
+        gcode (list): G-code blocks emitted by the tool call
+        timestamp (float): Time at which the event was recorded
+        tokens (int): Estimated number of tokens of the text
+    """
+
+    __slots__ = (
+        "session_id",
+        "seq",
+        "kind",
+        "text",
+        "tool_name",
+        "arguments",
+        "result",
+        "iteration",
+        "gcode",
+        "timestamp",
+        "tokens",
+    )
+
+    def __init__(
+        self,
+        session_id: str,
+        seq: int,
+        kind: str,
+        text: str,
+        tool_name: str | None = None,
+        arguments: dict | None = None,
+        result: list | str | None = None,
+        iteration: int | None = None,
+        gcode: list | None = None,
+        timestamp: float | None = None,
+        tokens: int = 0,
+    ) -> None:
+        self.session_id = session_id
+        self.seq = seq
+        self.kind = kind
+        self.text = text
+        self.tool_name = tool_name
+        self.arguments = arguments
+        self.result = result
+        self.iteration = iteration
+        self.gcode = gcode or []
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.tokens = tokens
+
+    def __repr__(self) -> str:
+        return (
+            f"Event(session_id={self.session_id!r}, seq={self.seq}, kind={self.kind!r}, "
+            f"tool_name={self.tool_name!r}, iteration={self.iteration})"
+        )
+
+
+class EventStore:
+    """
+    The EventStore class persists the events of every session in an append-only SQLite log.
+
+    The EventStore class:
+    1. Appends events, never rewriting the ones already stored
+    2. Loads the events of a session only when that session is first accessed
+    3. Serializes access with a lock so that many sessions can share one store
+
+    Attributes:
+        path (str): Location of the SQLite database
+    """
+
+    def __init__(self, path: str = ".agent_events.sqlite3") -> None:
+        """
+        Open (or create) the event log.
+
+        Args:
+            path (str): Location of the SQLite database, ":memory:" for a process-local log
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS events (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                text TEXT NOT NULL,
+                tool_name TEXT,
+                arguments TEXT,
+                result TEXT,
+                iteration INTEGER,
+                gcode TEXT NOT NULL,
+                timestamp REAL NOT NULL,
+                tokens INTEGER NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            )
+            """
+        )
+        self._db.commit()
+
+    def append(self, event: Event) -> None:
+        """
+        Persist an event at the end of its session's log.
+
+        Args:
+            event (Event): The event to persist
+        """
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    event.session_id,
+                    event.seq,
+                    event.kind,
+                    event.text,
+                    event.tool_name,
+                    json.dumps(event.arguments),
+                    json.dumps(event.result),
+                    event.iteration,
+                    json.dumps(event.gcode),
+                    event.timestamp,
+                    event.tokens,
+                ),
+            )
+            self._db.commit()
+
+    def load(self, session_id: str) -> list[Event]:
+        """
+        Load all the events of a session.
+
+        Args:
+            session_id (str): Unique identifier for the session
+
+        Returns:
+            list: The events of the session in order, empty for an unknown session
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM events WHERE session_id = ? ORDER BY seq", (session_id,)
+            ).fetchall()
+        return [
+            Event(
+                session_id=row[0],
+                seq=row[1],
+                kind=row[2],
+                text=row[3],
+                tool_name=row[4],
+                arguments=json.loads(row[5]),
+                result=json.loads(row[6]),
+                iteration=row[7],
+                gcode=json.loads(row[8]),
+                timestamp=row[9],
+                tokens=row[10],
+            )
+            for row in rows
+        ]
+
+    def sessions(self) -> list[str]:
+        """
+        List the sessions present in the log.
+
+        Returns:
+            list: Session identifiers in order of first appearance
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT session_id FROM events GROUP BY session_id ORDER BY MIN(rowid)"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self) -> None:
+        """
+        Close the underlying database.
+        """
+        with self._lock:
+            self._db.close()
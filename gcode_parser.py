@@ -0,0 +1,439 @@
+import io
+import mmap
+import re
+import sys
+from turning_cycles import plan_roughing_passes
+
+# A word is an address letter followed by a signed number, e.g. G1, X-12.5 or T0101
+word_pattern = re.compile(r"([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+comment_pattern = re.compile(r"\([^)]*\)|;.*$")
+
+
+class Block:
+    """
+    One parsed G-code block.
+
+    Attributes:
+        line_number (int): Position of the block in the program, starting at 1
+        raw (str): The block as written
+        sequence (int | None): The N word of the block, e.g. 100, which canned cycles refer to
+        g (list): G codes of the block, e.g. [0] or [21]
+        m (list): M codes of the block, e.g. [3]
+        words (dict): Value of every other address letter, e.g. {"X": 30.0, "F": 0.2}
+        tool (str | None): The T word as written, e.g. "0101", since its digits are not a number
+        comment (str): Comments of the block, without their delimiters
+    """
+
+    __slots__ = ("line_number", "raw", "sequence", "g", "m", "words", "tool", "comment")
+
+    def __init__(self, line_number: int, raw: str) -> None:
+        self.line_number = line_number
+        self.raw = raw
+        self.sequence = None
+        self.g = []
+        self.m = []
+        self.words = {}
+        self.tool = None
+        self.comment = ""
+
+    def __repr__(self) -> str:
+        return f"Block({self.line_number}: {self.raw!r})"
+
+    @property
+    def moves(self) -> bool:
+        """Whether the block moves an axis, a dwell (G4 X) does not"""
+        return ("X" in self.words or "Z" in self.words) and 4 not in self.g
+
+
+def parse_block(line: str, line_number: int = 0) -> Block:
+    """
+    Parse one line of G-code.
+
+    Args:
+        line (str): The line to parse
+        line_number (int): Position of the line in the program
+
+    Returns:
+        Block: The parsed block, without any words for an empty or comment-only line
+    """
+    block = Block(line_number, line.strip())
+    if "(" in line or ";" in line:
+        block.comment = " ".join(
+            c.strip("(); ") for c in comment_pattern.findall(line)
+        ).strip()
+        line = comment_pattern.sub(" ", line)
+    for letter, value in word_pattern.findall(line.upper()):
+        if letter == "G":
+            block.g.append(int(float(value)))
+        elif letter == "M":
+            block.m.append(int(float(value)))
+        elif letter == "T":
+            block.tool = value
+        elif letter == "N":
+            block.sequence = int(float(value))
+        else:
+            block.words[letter] = float(value)
+    return block
+
+
+def iter_blocks(lines, start: int = 1):
+    """
+    Parse a program lazily, one block at a time.
+
+    Args:
+        lines: The program as one string, as bytes or a memory map, or as an iterable
+            of lines, which may also be blocks parsed already
+        start (int): Number of the first block, 0 to match the indices of a program buffer
+
+    Yields:
+        Block: The parsed blocks in program order
+    """
+    if isinstance(lines, str):
+        lines = io.StringIO(lines)
+    elif isinstance(lines, (bytes, bytearray)):
+        lines = io.BytesIO(lines)
+    elif isinstance(lines, mmap.mmap):
+        lines = iter(lines.readline, b"")
+    for number, line in enumerate(lines, start=start):
+        if isinstance(line, Block):
+            yield line
+            continue
+        if isinstance(line, (bytes, bytearray)):
+            line = line.decode("utf-8", errors="replace")
+        yield parse_block(line, number)
+
+
+def iter_file(path: str, start: int = 1):
+    """
+    Parse a program file lazily through a memory map, so that memory use does not grow with its length.
+
+    Args:
+        path (str): Path of the program file
+        start (int): Number of the first block
+
+    Yields:
+        Block: The parsed blocks in program order
+    """
+    with open(path, "rb") as file:
+        # An empty file cannot be memory-mapped
+        if not file.seek(0, io.SEEK_END):
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield from iter_blocks(mapped, start)
+
+
+async def aiter_blocks(stream, start: int = 1):
+    """
+    Parse a program lazily from an async stream of lines, e.g. an asyncio.StreamReader.
+
+    Args:
+        stream: Async iterable of lines, as str or bytes
+        start (int): Number of the first block
+
+    Yields:
+        Block: The parsed blocks in program order
+    """
+    number = start
+    async for line in stream:
+        if isinstance(line, (bytes, bytearray)):
+            line = line.decode("utf-8", errors="replace")
+        yield parse_block(line, number)
+        number += 1
+
+
+def parse_program(lines, start: int = 1) -> list[Block]:
+    """
+    Parse a whole program.
+
+    Args:
+        lines: The lines of the program, as a list or as one string
+        start (int): Number of the first block, 0 to match the indices of a program buffer
+
+    Returns:
+        list: The parsed blocks
+    """
+    return list(iter_blocks(lines, start))
+
+
+def _contour_profile(contour: list, x: float, z: float) -> list | None:
+    """
+    Get the steps of a canned cycle contour.
+
+    Args:
+        contour (list): The blocks of the contour, between P and Q
+        x (float): X of the cycle start point, as a diameter
+        z (float): Z of the cycle start point
+
+    Returns:
+        list | None: (diameter, z_end) steps from the face inwards, None if the contour is
+        not a shaft whose diameters grow away from the face, e.g. a taper or an undercut
+    """
+    steps = []
+    for block in contour:
+        if not block.moves:
+            continue
+        x1, z1 = block.words.get("X", x), block.words.get("Z", z)
+        if z1 != z:
+            if x1 != x or (steps and (z1 >= steps[-1][1] or x < steps[-1][0])):
+                return None
+            steps.append((x, z1))
+        x, z = x1, z1
+    return steps or None
+
+
+def _cycle_block(text: str, cycle: Block) -> Block:
+    """Parse a block generated by the expansion of a canned cycle, reported as the cycle block"""
+    return parse_block(f"{text} (G{cycle.g[0]} of block {cycle.line_number})", cycle.line_number)
+
+
+def expand_cycles(blocks):
+    """
+    Expand the G71 roughing and G70 finishing cycles of a program into plain moves.
+
+    A G71 is expanded into the roughing passes of `turning_cycles.plan_roughing_passes`
+    down to its contour plus the finishing allowance, and a G70 into its contour, both
+    returning to the cycle start point. The contour between P and Q, which the control
+    only runs through the cycles, is not yielded. A cycle which cannot be expanded (in
+    G91, without a contour, or with a contour which is not a plain stepped shaft) is
+    yielded as it is.
+
+    Args:
+        blocks: Iterable of parsed blocks, e.g. from `iter_blocks` or `iter_file`
+
+    Yields:
+        Block: The blocks of the program with the cycles expanded, the generated blocks
+        numbered like the cycle they come from
+    """
+    blocks = iter(blocks)
+    contours = {}
+    absolute = True
+    x = z = None
+    depth, retract = None, 0.5
+    for block in blocks:
+        for g in block.g:
+            if g in (90, 91):
+                absolute = g == 90
+        if 71 in block.g and "P" not in block.words:
+            # First G71 block: depth of cut and retract
+            depth = block.words.get("U", depth)
+            retract = block.words.get("R", retract)
+            continue
+        if 71 in block.g or 70 in block.g:
+            first, last = block.words.get("P"), block.words.get("Q")
+            pending = [block]
+            if 71 in block.g:
+                # The contour follows the roughing cycle, up to its block Q
+                for contour_block in blocks:
+                    pending.append(contour_block)
+                    if contour_block.sequence == last:
+                        break
+                contour = [b for b in pending[1:] if b.sequence is None or b.sequence >= first]
+                if contour and contour[-1].sequence == last:
+                    contours[(first, last)] = contour
+            contour = contours.get((first, last))
+            steps = None
+            if absolute and x is not None and contour is not None:
+                steps = _contour_profile(contour, x, z)
+            if steps is None or (71 in block.g and not depth):
+                # Left to the consumer, which reports it as not verified
+                yield from pending
+                for moved in pending:
+                    if moved.moves and absolute:
+                        x, z = moved.words.get("X", x), moved.words.get("Z", z)
+                continue
+            if 71 in block.g:
+                allowance = block.words.get("U", 0.0) / 2
+                feed = f" F{block.words['F']}" if "F" in block.words else ""
+                for diameter, z_end in plan_roughing_passes(x, steps, depth, allowance):
+                    if z_end is None:
+                        continue
+                    yield _cycle_block(f"G0 X{round(diameter, 3)}", block)
+                    yield _cycle_block(f"G1 Z{round(z_end, 3)}{feed}", block)
+                    yield _cycle_block(f"G0 X{round(diameter + 2 * retract, 3)}", block)
+                    yield _cycle_block(f"G0 Z{z}", block)
+            else:
+                for contour_block in contour:
+                    yield _cycle_block(re.sub(r"^N\d+\s*", "", contour_block.raw), block)
+            yield _cycle_block(f"G0 X{x} Z{z}", block)
+            continue
+        if block.moves:
+            if absolute:
+                x, z = block.words.get("X", x), block.words.get("Z", z)
+            else:
+                x = z = None
+        yield block
+
+
+class ModalState:
+    """
+    The ModalState class follows the modal state of a lathe control through a program.
+
+    The ModalState class:
+    1. Keeps the modal codes in force (G0/G1, G20/G21, G90/G91, G94/G95, G96/G97) and F, S and T
+    2. Tracks whether the spindle runs (M03/M04 and M05/M30)
+    3. Flags, for the last block only, whether it changed the tool or started the spindle
+    4. Resolves the end point of a move in mm, with X as a diameter
+
+    Attributes:
+        scale (float): Millimetres per programmed unit, 25.4 under G20
+        absolute (bool): Whether coordinates are absolute (G90)
+        motion (int): Motion mode in force, 0 for rapid and 1 for feed
+        per_revolution (bool): Whether the feed is per revolution (G95)
+        constant_surface_speed (bool): Whether S is a surface speed (G96)
+        feed (float | None): Feed in force in mm/rev or mm/min
+        speed (float): Spindle speed in force
+        spindle_on (bool): Whether the spindle runs
+        tool (str | None): Tool in force
+        units_set (bool): Whether G20 or G21 was programmed
+        distance_set (bool): Whether G90 or G91 was programmed
+        tool_changed (bool): Whether the last block changed the tool
+        spindle_started (bool): Whether the last block started the spindle
+    """
+
+    __slots__ = (
+        "scale",
+        "absolute",
+        "motion",
+        "per_revolution",
+        "constant_surface_speed",
+        "feed",
+        "speed",
+        "spindle_on",
+        "tool",
+        "units_set",
+        "distance_set",
+        "tool_changed",
+        "spindle_started",
+    )
+
+    def __init__(self) -> None:
+        self.scale = 1.0
+        self.absolute = True
+        self.motion = 0
+        self.per_revolution = True
+        self.constant_surface_speed = False
+        self.feed = None
+        self.speed = 0.0
+        self.spindle_on = False
+        self.tool = None
+        self.units_set = False
+        self.distance_set = False
+        self.tool_changed = False
+        self.spindle_started = False
+
+    def update(self, block: Block) -> None:
+        """
+        Apply the modal words of a block.
+
+        Args:
+            block (Block): The block, in program order
+        """
+        for g in block.g:
+            if g in (0, 1):
+                self.motion = g
+            elif g in (20, 21):
+                self.scale = 25.4 if g == 20 else 1.0
+                self.units_set = True
+            elif g in (90, 91):
+                self.absolute = g == 90
+                self.distance_set = True
+            elif g in (94, 95):
+                self.per_revolution = g == 95
+            elif g in (96, 97):
+                self.constant_surface_speed = g == 96
+        if "S" in block.words:
+            self.speed = block.words["S"]
+        if "F" in block.words:
+            self.feed = block.words["F"] * self.scale
+        self.tool_changed = block.tool is not None and block.tool != self.tool
+        if block.tool is not None:
+            self.tool = block.tool
+        self.spindle_started = False
+        for m in block.m:
+            if m in (3, 4):
+                self.spindle_started = not self.spindle_on
+                self.spindle_on = True
+            elif m in (5, 30):
+                self.spindle_on = False
+
+    def endpoint(self, block: Block, x: float, z: float) -> tuple:
+        """
+        Get the end point of a move.
+
+        Args:
+            block (Block): The moving block, after `update`
+            x (float): Current X in mm, as a diameter
+            z (float): Current Z in mm
+
+        Returns:
+            tuple: X and Z at the end of the move in mm
+        """
+        if self.absolute:
+            return (
+                block.words.get("X", x / self.scale) * self.scale,
+                block.words.get("Z", z / self.scale) * self.scale,
+            )
+        return (
+            x + block.words.get("X", 0.0) * self.scale,
+            z + block.words.get("Z", 0.0) * self.scale,
+        )
+
+
+def lint_blocks(blocks):
+    """
+    Check the modal state of a program on the fly.
+
+    Every block is yielded with the issues found on it, so that a consumer can lint the
+    program in the same pass in which it processes it. Missing units or distance mode
+    are reported on the first move only.
+
+    Args:
+        blocks: Iterable of parsed blocks, e.g. from `iter_blocks` or `iter_file`
+
+    Yields:
+        tuple: The block, the modal state after it and the list of issues found on it
+    """
+    state = ModalState()
+    mode_reported = False
+    for block in blocks:
+        state.update(block)
+        issues = []
+        if block.moves:
+            if not mode_reported and not (state.units_set and state.distance_set):
+                issues.append(
+                    f"Block {block.line_number} '{block.raw}' moves before the units (G20/G21) "
+                    "and the distance mode (G90/G91) are set"
+                )
+                mode_reported = True
+            if state.motion == 1:
+                if not state.feed:
+                    issues.append(f"Block {block.line_number} '{block.raw}' feeds without a feed rate")
+                if not state.spindle_on:
+                    issues.append(f"Block {block.line_number} '{block.raw}' feeds with the spindle stopped")
+                if state.tool is None:
+                    issues.append(f"Block {block.line_number} '{block.raw}' feeds before a tool is selected")
+        yield block, state, issues
+
+
+def lint_file(path: str):
+    """
+    Lint a program file without loading it, or its issues, in memory.
+
+    Args:
+        path (str): Path of the program file
+
+    Yields:
+        str: Every issue found, in program order
+    """
+    for _, _, issues in lint_blocks(iter_file(path)):
+        yield from issues
+
+
+if __name__ == "__main__":
+    # Usage: python gcode_parser.py program.nc [...]
+    failed = False
+    for path in sys.argv[1:]:
+        for issue in lint_file(path):
+            print(f"{path}: {issue}")
+            failed = True
+    sys.exit(1 if failed else 0)
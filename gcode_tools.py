@@ -0,0 +1,167 @@
+from mcp_schemas import *
+from turning_cycles import turning_cycle
+
+# Tools which only turn their inputs into G-code, without any side effect.
+# They are served by the MCP action server and can be executed in the client process as well.
+
+
+def set_units_and_mode() -> GCodeOutput:
+    """
+    Sets the CNC machine to use metric units, absolute positioning,
+    feed per revolution mode, and selects the XZ plane.
+
+    Returns:
+        GcodeOutput (list of strings): A list of G-code commands to set the units and mode
+    """
+    return GCodeOutput(
+        result=[
+            "G21",  # Units in mm
+            "G90",  # Absolute positioning
+            "G95",  # Feed per revolution
+            "G18",  # XZ plane selection
+        ]
+    )
+
+
+def select_tool_and_start_spindle(input: SelectToolAndStartSpindleInput) -> GCodeOutput:
+    """
+    Selects the tool and starts the spindle at a given speed.
+
+    Args:
+        input (SelectToolAndStartSpindleInput): Input parameters containing:
+            - tool_number (str): Tool number (e.g. T0101)
+            - offset (int): Tool offset number
+            - spindle_speed (int): Spindle speed in RPM
+
+    Returns:
+        GCodeOutput (list of strings): A list of G-code commands to select the tool and start the spindle
+    """
+    return GCodeOutput(
+        result=[
+            f"T{input.tool_number}{input.offset:02d}",  # Tool selection
+            f"G97 S{input.spindle_speed} M03",  # Spindle on clockwise with RPM
+        ]
+    )
+
+
+def move_to_safe_start(input: MoveToSafeStartInput) -> GCodeOutput:
+    """
+    Moves the tool to a safe starting position before cutting.
+
+    Args:
+        input (MoveToSafeStartInput): Input parameters containing:
+            - x (float): X-coordinate in mm
+            - z (float): Z-coordinate in mm
+
+    Returns:
+        GcodeOutput (list of strings): A list of G-code commands to move the tool to a safe starting position
+    """
+    return GCodeOutput(result=[f"G0 X{input.x} Z{input.z}"])
+
+
+def face_stock(input: FaceStockInput) -> GCodeOutput:
+    """
+    Faces the end of the stock to ensure it's flat.
+
+    Args:
+        input (FaceStockInput): Input parameters containing:
+            - z_face (float): Final Z position to face to (usually 0)
+            - feed_rate (float): Feed rate for facing
+
+    Returns:
+        GcodeOutput (list of strings): A list of G-code commands to face the end of the stock
+    """
+    return GCodeOutput(
+        result=[
+            f"G1 Z{input.z_face} F{input.feed_rate}",  # Feed to face
+            "G0 Z2",  # Retract after facing
+        ]
+    )
+
+
+def do_turning(input: DoTurningInput) -> GCodeOutput:
+    """
+    Turns along the full length of the cylinder to reduce its diameter uniformly.
+    With a maximum depth of cut, the stock is removed in roughing passes followed by a finishing pass.
+    Without one, a profile, finishing pass or canned cycle is still planned, with a single roughing depth.
+
+    Args:
+        input (DoTurningInput): Input parameters containing:
+            - start_diameter (float): Initial diameter of the rod in mm
+            - final_diameter (float): Final diameter after turning in mm
+            - length (float): Length of the cut along Z-axis in mm
+            - feed_rate (float): Feed rate in mm/rev
+            - max_depth_of_cut (float): Largest radial depth of a roughing pass in mm (optional, the whole depth in one pass if not given)
+            - finishing_allowance (float): Radial stock left for the finishing pass in mm (default: 0)
+            - finishing_feed_rate (float): Feed rate of the finishing pass in mm/rev (optional, feed_rate if not given)
+            - profile (list of TurningProfileStep): Steps of a stepped shaft, each a diameter and its length from the face (optional)
+            - canned_cycle (bool): Emit G71/G70 canned cycles instead of one block per move (default: false)
+
+    Returns:
+        GcodeOutput (list of strings)A list of G-code commands to cut along the full length of the cylinder
+    """
+    max_depth_of_cut = input.max_depth_of_cut
+    if max_depth_of_cut is None:
+        if not (
+            input.profile
+            or input.finishing_allowance
+            or input.finishing_feed_rate is not None
+            or input.canned_cycle
+        ):
+            return GCodeOutput(
+                result=[
+                    f"G0 X{input.start_diameter} Z0",  # Rapid to start position
+                    f"G1 X{input.final_diameter} Z-{input.length} F{input.feed_rate}",  # Turning pass
+                ]
+            )
+        # One roughing depth, down to the smallest diameter of the part
+        smallest = min(
+            [input.final_diameter] if not input.profile else [step.diameter for step in input.profile]
+        )
+        max_depth_of_cut = (input.start_diameter - smallest) / 2
+        if max_depth_of_cut <= 0:
+            raise ValueError("The start diameter must be larger than the diameters to turn to")
+    return GCodeOutput(
+        result=turning_cycle(
+            input.start_diameter,
+            input.final_diameter,
+            input.length,
+            input.feed_rate,
+            max_depth_of_cut,
+            input.finishing_allowance,
+            input.finishing_feed_rate,
+            [(step.diameter, step.length) for step in input.profile or []],
+            input.canned_cycle,
+        )
+    )
+
+
+def retract_and_end_program(input: RetractAndEndProgramInput) -> GCodeOutput:
+    """
+    Retracts the tool to a safe position and ends the program.
+
+    Args:
+        input (RetractAndEndProgramInput): Input parameters containing:
+            - retract_x (float): X-coordinate for safe retract (default: 100)
+            - retract_z (float): Z-coordinate for safe retract (default: 100)
+
+    Returns:
+        GcodeOutput (list of strings): A list of G-code commands to retract the tool and end the program
+    """
+    return GCodeOutput(
+        result=[
+            f"G0 X{input.retract_x} Z{input.retract_z}",  # Retract tool
+            "M05",  # Stop spindle
+            "M30",  # End of program
+        ]
+    )
+
+
+pure_gcode_tools = [
+    set_units_and_mode,
+    select_tool_and_start_spindle,
+    move_to_safe_start,
+    face_stock,
+    do_turning,
+    retract_and_end_program,
+]
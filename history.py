@@ -0,0 +1,148 @@
+from collections import Counter
+from event_store import Event
+from memory import Memory
+from utils import estimate_tokens
+
+
+class HistoryManager:
+    """
+    The HistoryManager class keeps the history sent to the LLM within a token budget.
+
+    The HistoryManager class:
+    1. Keeps the perception block and the most recent turns verbatim
+    2. Folds older turns into one compact digest of the tools used and the G-code emitted,
+       capped at half the budget since the program itself is kept on the action server
+    3. Builds the digest deterministically from the typed events, without an LLM call
+    4. Folds in large steps, down to half the budget, so the window stays stable for
+       several iterations and prefix caching keeps working in between
+
+    Attributes:
+        token_budget (int): Estimated number of tokens the history may take
+        keep_recent (int): Minimum number of recent turns always kept verbatim
+        _folded (dict): Number of leading entries folded into the digest, per session
+    """
+
+    def __init__(self, token_budget: int = 4000, keep_recent: int = 4) -> None:
+        """
+        Initialize the HistoryManager.
+
+        Args:
+            token_budget (int): Estimated number of tokens the history may take
+            keep_recent (int): Minimum number of recent turns always kept verbatim
+        """
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self._folded = {}
+
+    def window(self, memory: Memory, session_id: str) -> list[str]:
+        """
+        Get the turns of a session to send to the LLM.
+
+        Args:
+            memory (Memory): Memory holding the session
+            session_id (str): Unique identifier for the session
+
+        Returns:
+            list: Pinned entries, the digest of the folded turns and the recent turns
+        """
+        turns = memory.turns(session_id)
+        events = memory.session_events(session_id)
+        # Entries appended to the session directly have no event
+        events = events + [None] * (len(turns) - len(events))
+
+        folded = min(self._folded.get(session_id, 0), len(turns))
+        window = self._render(turns, events, folded)
+        if sum(estimate_tokens(turn) for turn in window) > self.token_budget:
+            folded = self._fold_point(turns, events, folded)
+            self._folded[session_id] = folded
+            window = self._render(turns, events, folded)
+        return window
+
+    @staticmethod
+    def _is_pinned(event: Event | None) -> bool:
+        return event is not None and event.kind == "perception"
+
+    def _fold_point(self, turns: list[str], events: list, folded: int) -> int:
+        """
+        Find how many leading entries to fold so the verbatim tail fits half the budget.
+
+        Args:
+            turns (list): All the entries of the session
+            events (list): Events of the entries, None where an entry has no event
+            folded (int): Number of entries folded so far
+
+        Returns:
+            int: The new number of folded entries, never less than before
+        """
+        target = self.token_budget // 2
+        kept = 0
+        tokens = 0
+        point = len(turns)
+        while point > folded:
+            index = point - 1
+            if not self._is_pinned(events[index]):
+                cost = estimate_tokens(turns[index])
+                if kept >= self.keep_recent and tokens + cost > target:
+                    break
+                kept += 1
+                tokens += cost
+            point = index
+        return point
+
+    def _render(self, turns: list[str], events: list, folded: int) -> list[str]:
+        pinned = [
+            turn
+            for turn, event in zip(turns[:folded], events[:folded])
+            if self._is_pinned(event)
+        ]
+        to_digest = [event for event in events[:folded] if not self._is_pinned(event)]
+        window = pinned
+        if to_digest:
+            # The verbatim tail is folded down to the other half of the budget
+            window.append(self.digest(to_digest, self.token_budget // 2))
+        window.extend(turns[folded:])
+        return window
+
+    @staticmethod
+    def digest(events: list, token_budget: int | None = None) -> str:
+        """
+        Summarize folded entries from their events.
+
+        The G-code blocks are not repeated, the program on the action server holds them,
+        so the digest only gives their count and the first and last blocks.
+
+        Args:
+            events (list): Events of the folded entries, oldest first, None where an entry has no event
+            token_budget (int): Estimated number of tokens the digest may take, None for no cap
+
+        Returns:
+            str: A compact, deterministic digest of the entries
+        """
+        calls = [event for event in events if event and event.kind == "tool_call"]
+        gcode = [block for event in calls for block in event.gcode]
+        tools = Counter(event.tool_name for event in calls)
+
+        lines = ["HISTORY DIGEST (older turns folded to save context)"]
+        if calls:
+            lines.append(
+                f"Iterations {calls[0].iteration}-{calls[-1].iteration} called "
+                f"{len(calls)} tools in {len({event.iteration for event in calls})} iterations"
+            )
+        lines.append(f"G-code emitted in these turns: {len(gcode)} blocks")
+        if gcode:
+            lines.append(
+                f"From '{gcode[0]}' to '{gcode[-1]}', kept in the program on the server "
+                "(see get_program)"
+            )
+        lines.append(
+            "Tools used: "
+            + (", ".join(f"{name} x{count}" for name, count in tools.items()) or "none")
+        )
+        others = len(events) - len(calls)
+        if others:
+            lines.append(f"Other entries folded: {others}")
+        digest = "\n".join(lines)
+        if token_budget is not None and estimate_tokens(digest) > token_budget:
+            # About four characters per token, like estimate_tokens
+            digest = digest[: max(0, token_budget - 1) * 4]
+        return digest
@@ -0,0 +1,121 @@
+import json
+
+
+class IncrementalObjectParser:
+    """
+    The IncrementalObjectParser class decodes the fields of a streamed JSON object as soon as they are complete.
+
+    The IncrementalObjectParser class:
+    1. Scans every character of the stream once, tracking strings, escapes and nesting
+    2. Skips any text before the object, e.g. a code fence
+    3. Decodes a top-level field once its value is complete: an object or array when its
+       bracket closes, a string or any other value at the comma or brace which ends it
+    4. Leaves the fields which do not decode as JSON to the parse of the whole reply
+
+    Attributes:
+        text (str): The text received so far
+        fields (dict): The top-level fields decoded so far
+        complete (bool): Whether the object was closed
+    """
+
+    __slots__ = (
+        "text",
+        "fields",
+        "complete",
+        "_position",
+        "_depth",
+        "_in_string",
+        "_escape",
+        "_state",
+        "_key_start",
+        "_key",
+        "_value_start",
+    )
+
+    def __init__(self) -> None:
+        self.text = ""
+        self.fields = {}
+        self.complete = False
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        # "key" before a key, "in_key" inside it, "colon" after it, "value" inside its
+        # value and "done" once the value is decoded
+        self._state = "key"
+        self._key_start = 0
+        self._key = None
+        self._value_start = None
+
+    def feed(self, chunk: str) -> list[tuple]:
+        """
+        Parse the next chunk of the stream.
+
+        Args:
+            chunk (str): The text received
+
+        Returns:
+            list: The fields completed by the chunk, as (key, value) pairs
+        """
+        self.text += chunk
+        text = self.text
+        completed = []
+        for position in range(self._position, len(text)):
+            if self.complete:
+                break
+            char = text[position]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._state == "in_key":
+                        self._key = self._decode(text[self._key_start : position + 1])
+                        self._state = "colon"
+                continue
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1 and self._state == "key":
+                    self._key_start = position
+                    self._state = "in_key"
+            elif char == "{" or char == "[":
+                self._depth += 1
+            elif char == "}" or char == "]":
+                self._depth -= 1
+                if self._depth == 1 and self._state == "value":
+                    # A nested object or array closed, the value is complete
+                    self._complete_value(text[self._value_start : position + 1], completed)
+                elif self._depth == 0:
+                    if self._state == "value":
+                        self._complete_value(text[self._value_start : position], completed)
+                    self.complete = True
+            elif self._depth == 1:
+                if char == ":" and self._state == "colon":
+                    self._state = "value"
+                    self._value_start = position + 1
+                elif char == ",":
+                    if self._state == "value":
+                        self._complete_value(text[self._value_start : position], completed)
+                    self._state = "key"
+        self._position = len(text)
+        return completed
+
+    def _complete_value(self, raw: str, completed: list) -> None:
+        self._state = "done"
+        value = self._decode(raw.strip())
+        if value is not _undecodable and isinstance(self._key, str):
+            self.fields[self._key] = value
+            completed.append((self._key, value))
+
+    @staticmethod
+    def _decode(raw: str):
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return _undecodable
+
+
+# Marks a value which is not valid JSON
+_undecodable = object()
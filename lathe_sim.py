@@ -0,0 +1,189 @@
+import numpy as np
+from gcode_parser import ModalState, expand_cycles, iter_blocks
+from mcp_schemas import SimulationOutput
+
+# Tolerance in mm below which a difference of radius is not material
+tolerance = 1e-6
+
+
+class LatheSimulator:
+    """
+    The LatheSimulator class verifies a turning program by removing stock the way the machine would.
+
+    The LatheSimulator class:
+    1. Models the cylindrical stock as a radial profile sampled along Z, with the face at Z0
+    2. Interprets the modal state of the program (G0/G1, G20/G21, G90/G91, F, T, M03/M04/M05/M30)
+       and runs the G71/G70 canned cycles as their expanded passes
+    3. Applies every cutting move to the profile in one vectorized NumPy operation
+    4. Reports the final diameter and length, rapid moves through material, depth-of-cut
+       violations and cuts made without feed, spindle or tool
+
+    X is programmed as a diameter, as usual on a lathe.
+
+    Attributes:
+        stock_diameter (float): Diameter of the raw stock in mm
+        stock_length (float): Length of the raw stock in mm
+        max_depth_of_cut (float): Largest radial depth a single cut may take, in mm
+        resolution (float): Spacing of the profile samples along Z, in mm
+        z (np.ndarray): Z position of every sample, from 0 down to -stock_length
+        radius (np.ndarray): Remaining stock radius at every sample
+    """
+
+    def __init__(
+        self,
+        stock_diameter: float,
+        stock_length: float,
+        max_depth_of_cut: float = 2.0,
+        resolution: float = 0.1,
+    ) -> None:
+        """
+        Create the stock.
+
+        Args:
+            stock_diameter (float): Diameter of the raw stock in mm
+            stock_length (float): Length of the raw stock in mm
+            max_depth_of_cut (float): Largest radial depth a single cut may take, in mm
+            resolution (float): Spacing of the profile samples along Z, in mm
+        """
+        self.stock_diameter = stock_diameter
+        self.stock_length = stock_length
+        self.max_depth_of_cut = max_depth_of_cut
+        self.resolution = resolution
+        samples = int(round(stock_length / resolution)) + 1
+        self.z = -np.linspace(0, stock_length, samples)
+        self.radius = np.full(samples, stock_diameter / 2)
+
+    def _segment(self, x0: float, z0: float, x1: float, z1: float):
+        """
+        Sample the tool path of a straight move at the profile positions.
+
+        Args:
+            x0, z0 (float): Start of the move, X as a diameter
+            x1, z1 (float): End of the move, X as a diameter
+
+        Returns:
+            tuple: Indices of the samples crossed and the tool radius at each of them
+        """
+        r0, r1 = x0 / 2, x1 / 2
+        if abs(z1 - z0) > tolerance:
+            mask = (self.z >= min(z0, z1) - tolerance) & (self.z <= max(z0, z1) + tolerance)
+            indices = np.nonzero(mask)[0]
+            tool_radius = r0 + (self.z[indices] - z0) * (r1 - r0) / (z1 - z0)
+            return indices, tool_radius
+        # A radial move reaches its smallest radius at a single Z
+        if z0 > tolerance or z0 < -self.stock_length - tolerance:
+            return np.array([], dtype=int), np.array([])
+        index = int(np.argmin(np.abs(self.z - z0)))
+        return np.array([index]), np.array([min(r0, r1)])
+
+    def run(self, lines, start: int = 1) -> SimulationOutput:
+        """
+        Simulate a program on the stock.
+
+        Args:
+            lines: The G-code program, as a list of lines, one string or blocks streamed
+                by `gcode_parser.iter_file`
+            start (int): Number of the first block in the reported issues
+
+        Returns:
+            SimulationOutput: The final geometry and every issue found
+        """
+        rapids, depth_violations, issues = [], [], []
+        state = ModalState()
+        # The tool starts clear of the stock
+        x, z = self.stock_diameter + 10, 10.0
+        removed = 0.0
+
+        for block in expand_cycles(iter_blocks(lines, start)):
+            state.update(block)
+            if 70 in block.g or 71 in block.g:
+                issues.append(
+                    f"Block {block.line_number} '{block.raw}' is a canned cycle which could not be "
+                    "expanded, its passes were not verified"
+                )
+                continue
+            if not block.moves:
+                continue
+            x1, z1 = state.endpoint(block, x, z)
+
+            indices, tool_radius = self._segment(x, z, x1, z1)
+            current = self.radius[indices]
+            depth = current - np.maximum(tool_radius, 0)
+            in_material = depth > tolerance
+            if in_material.any():
+                max_depth = float(depth.max())
+                if state.motion == 0:
+                    rapids.append(
+                        f"Block {block.line_number} '{block.raw}' rapids {max_depth:.3f} mm deep through material"
+                    )
+                else:
+                    if not state.feed:
+                        issues.append(f"Block {block.line_number} '{block.raw}' cuts without a feed rate")
+                    if not state.spindle_on:
+                        issues.append(f"Block {block.line_number} '{block.raw}' cuts with the spindle stopped")
+                    if state.tool is None:
+                        issues.append(f"Block {block.line_number} '{block.raw}' cuts before a tool is selected")
+                    if max_depth > self.max_depth_of_cut + tolerance:
+                        depth_violations.append(
+                            f"Block {block.line_number} '{block.raw}' cuts {max_depth:.3f} mm deep, "
+                            f"over the maximum of {self.max_depth_of_cut} mm"
+                        )
+                    new_radius = np.minimum(current, np.maximum(tool_radius, 0))
+                    removed += float(
+                        np.sum(np.pi * (current**2 - new_radius**2)) * self.resolution
+                    )
+                    self.radius[indices] = new_radius
+            x, z = x1, z1
+
+        return self.report(removed, rapids, depth_violations, issues)
+
+    def report(self, removed, rapids, depth_violations, issues) -> SimulationOutput:
+        """
+        Summarize the simulated part.
+
+        Returns:
+            SimulationOutput: The final geometry and every issue found
+        """
+        material = np.nonzero(self.radius > tolerance)[0]
+        if len(material):
+            length = float(self.z[material[0]] - self.z[material[-1]])
+            diameters = 2 * self.radius[material]
+            final_diameter, min_diameter = float(diameters.max()), float(diameters.min())
+        else:
+            length = final_diameter = min_diameter = 0.0
+        return SimulationOutput(
+            final_diameter=round(final_diameter, 4),
+            min_diameter=round(min_diameter, 4),
+            final_length=round(length, 4),
+            removed_volume=round(removed, 3),
+            rapid_through_material=rapids,
+            depth_of_cut_violations=depth_violations,
+            issues=issues,
+            ok=not (rapids or depth_violations or issues),
+        )
+
+
+def simulate_turning(
+    lines,
+    stock_diameter: float,
+    stock_length: float,
+    max_depth_of_cut: float = 2.0,
+    resolution: float = 0.1,
+    start: int = 1,
+) -> SimulationOutput:
+    """
+    Simulate a turning program on a cylindrical stock.
+
+    Args:
+        lines: The G-code program, as a list of blocks or one string
+        stock_diameter (float): Diameter of the raw stock in mm
+        stock_length (float): Length of the raw stock in mm
+        max_depth_of_cut (float): Largest radial depth a single cut may take, in mm
+        resolution (float): Spacing of the profile samples along Z, in mm
+        start (int): Number of the first block in the reported issues
+
+    Returns:
+        SimulationOutput: The final geometry and every issue found
+    """
+    simulator = LatheSimulator(stock_diameter, stock_length, max_depth_of_cut, resolution)
+    return simulator.run(lines, start)
@@ -0,0 +1,289 @@
+import asyncio
+import httpx
+from collections import Counter
+from openai import APIConnectionError, AsyncOpenAI, InternalServerError, RateLimitError
+from rate_limiter import TokenBucketRateLimiter
+from tracing import tracer
+from utils import estimate_tokens
+
+
+class LLMBackend:
+    """
+    The LLMBackend class is the asynchronous gateway through which every LLM call is made.
+
+    The LLMBackend class:
+    1. Wraps a native async OpenAI client, so no call ever occupies an executor thread
+    2. Shares one pooled HTTP connection pool between all the agents of the process
+    3. Enforces per-call deadlines which cancel, and thereby abort, the in-flight request
+    4. Bounds the number of concurrent requests with a semaphore
+    5. Optionally paces the calls through a shared rate limiter and retries rejected ones,
+       the OpenAI client itself never retries so that no request bypasses the limiter
+    6. Lets a call override the response format, e.g. with a JSON schema when the model supports it
+    7. Streams a completion chunk by chunk, so that its fields can be used before it ends
+
+    Attributes:
+        client (AsyncOpenAI): The async OpenAI client using the shared connection pool
+        model (str): Model used for chat completions
+        temperature (float): Sampling temperature
+        max_tokens (int): Maximum number of tokens in a completion
+        response_format (dict): Response format requested from the model
+        structured_outputs (bool): Whether the model accepts json_schema response formats
+        rate_limiter (TokenBucketRateLimiter | None): Shared limiter for the provider's quota
+        max_retries (int): Retries of a call which failed with a transient error
+        max_rate_limit_retries (int): Retries of a call rejected with a 429
+    """
+
+    def __init__(
+        self,
+        api_key: str | None = None,
+        base_url: str | None = None,
+        model: str = "gpt-4o",
+        temperature: float = 0.1,
+        max_tokens: int = 1000,
+        response_format: dict | None = None,
+        max_concurrency: int = 8,
+        max_connections: int = 16,
+        max_retries: int = 2,
+        transport: httpx.AsyncBaseTransport | None = None,
+        rate_limiter: TokenBucketRateLimiter | None = None,
+        max_rate_limit_retries: int = 3,
+        structured_outputs: bool = False,
+    ) -> None:
+        """
+        Initialize the LLMBackend and its connection pool.
+
+        Args:
+            api_key (str): OpenAI API key, read from the environment if not given
+            base_url (str): Base URL of an OpenAI-compatible endpoint
+            model (str): Model used for chat completions
+            temperature (float): Sampling temperature
+            max_tokens (int): Maximum number of tokens in a completion
+            response_format (dict): Response format, defaults to a JSON object
+            max_concurrency (int): Maximum number of requests in flight at once
+            max_connections (int): Size of the shared HTTP connection pool
+            max_retries (int): Retries of a call which failed with a server or connection error,
+                or was rejected with a 429 when there is no rate limiter
+            transport (httpx.AsyncBaseTransport): Optional transport to plug in instead of the network
+            rate_limiter (TokenBucketRateLimiter): Shared limiter, None to call without pacing
+            max_rate_limit_retries (int): Retries of a call rejected with a 429
+            structured_outputs (bool): Whether the model accepts json_schema response formats
+        """
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.response_format = response_format or {"type": "json_object"}
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.structured_outputs = structured_outputs
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            transport=transport,
+        )
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            # Retries go through `_before_retry`, a 429 retried by the client would skip the rate limiter
+            max_retries=0,
+            http_client=self._http_client,
+        )
+
+    async def complete(
+        self,
+        messages: list[dict],
+        timeout: float = 60,
+        response_format: dict | None = None,
+    ) -> str:
+        """
+        Run a chat completion under a deadline.
+
+        The deadline covers both the wait for a free concurrency slot and the request
+        itself. When it expires the request task is cancelled, which closes its
+        connection instead of leaving it running in the background. Waiting for the
+        rate limiter happens before the deadline starts.
+
+        Args:
+            messages (list): Chat messages to send
+            timeout (float): Deadline in seconds for the whole call
+            response_format (dict): Response format of this call, the default one if not given
+
+        Returns:
+            str: The content of the first choice
+
+        Raises:
+            TimeoutError: If the deadline expires before the completion is received
+            RateLimitError: If the call is still rejected after all the retries
+        """
+        estimated_tokens = self.max_tokens + sum(
+            estimate_tokens(message["content"]) for message in messages
+        )
+        with tracer.span(
+            "llm.complete",
+            model=self.model,
+            request_bytes=sum(len(message["content"]) for message in messages),
+        ) as span:
+            retries = Counter()
+            while True:
+                span.set(attempts=retries.total() + 1)
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire(estimated_tokens)
+                try:
+                    return await asyncio.wait_for(
+                        self._complete(
+                            messages,
+                            estimated_tokens,
+                            response_format or self.response_format,
+                        ),
+                        timeout=timeout,
+                    )
+                except (RateLimitError, InternalServerError, APIConnectionError) as e:
+                    await self._before_retry(e, retries)
+
+    async def stream(
+        self,
+        messages: list[dict],
+        timeout: float = 60,
+        response_format: dict | None = None,
+    ):
+        """
+        Run a chat completion and yield its content as it is generated.
+
+        The deadline covers the wait for a concurrency slot and the whole stream. A failed
+        call is retried like in `complete`, but only before its first chunk.
+
+        Args:
+            messages (list): Chat messages to send
+            timeout (float): Deadline in seconds for the whole stream
+            response_format (dict): Response format of this call, the default one if not given
+
+        Yields:
+            str: The chunks of the content of the first choice
+
+        Raises:
+            TimeoutError: If the deadline expires before the stream ends
+            RateLimitError: If the call is still rejected after all the retries
+        """
+        estimated_tokens = self.max_tokens + sum(
+            estimate_tokens(message["content"]) for message in messages
+        )
+        # The consumer runs between two chunks, so the span must not become its current span
+        with tracer.detached_span(
+            "llm.complete",
+            model=self.model,
+            request_bytes=sum(len(message["content"]) for message in messages),
+            streamed=True,
+        ) as span:
+            retries = Counter()
+            while True:
+                span.set(attempts=retries.total() + 1)
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire(estimated_tokens)
+                usage = None
+                response_bytes = 0
+                try:
+                    async with asyncio.timeout(timeout), self._semaphore:
+                        response = await self.client.chat.completions.create(
+                            model=self.model,
+                            messages=messages,
+                            temperature=self.temperature,
+                            max_tokens=self.max_tokens,
+                            response_format=response_format or self.response_format,
+                            stream=True,
+                            stream_options={"include_usage": True},
+                        )
+                        async for chunk in response:
+                            if chunk.usage is not None:
+                                usage = chunk.usage
+                            if chunk.choices and chunk.choices[0].delta.content:
+                                content = chunk.choices[0].delta.content
+                                response_bytes += len(content)
+                                yield content
+                except (RateLimitError, InternalServerError, APIConnectionError) as e:
+                    if response_bytes:
+                        raise
+                    await self._before_retry(e, retries)
+                    continue
+                span.set(response_bytes=response_bytes)
+                if usage is not None:
+                    span.set(
+                        prompt_tokens=usage.prompt_tokens,
+                        completion_tokens=usage.completion_tokens,
+                    )
+                if self.rate_limiter is not None:
+                    self.rate_limiter.on_success()
+                    if usage is not None:
+                        self.rate_limiter.record_usage(estimated_tokens, usage.total_tokens)
+                return
+
+    async def _before_retry(self, error: Exception, retries: Counter) -> None:
+        """
+        Wait before retrying a failed call, or raise its error once it was retried enough.
+
+        A 429 is retried through the rate limiter, whose backoff delays every call sharing
+        it. Server and connection errors, and 429s without a limiter, are retried after an
+        exponential backoff, or the delay requested by the provider.
+
+        Args:
+            error (Exception): The error of the call
+            retries (Counter): Retries of the call so far, by kind
+        """
+        if isinstance(error, RateLimitError) and self.rate_limiter is not None:
+            if retries["rate_limited"] == self.max_rate_limit_retries:
+                raise error
+            retries["rate_limited"] += 1
+            self.rate_limiter.on_rate_limited(_retry_after(error))
+            return
+        if retries["transient"] == self.max_retries:
+            raise error
+        retries["transient"] += 1
+        delay = _retry_after(error) if isinstance(error, RateLimitError) else None
+        await asyncio.sleep(delay if delay is not None else min(8.0, 0.5 * 2 ** (retries["transient"] - 1)))
+
+    async def _complete(
+        self, messages: list[dict], estimated_tokens: int, response_format: dict
+    ) -> str:
+        async with self._semaphore:
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                response_format=response_format,
+            )
+        content = response.choices[0].message.content
+        if response.usage is not None:
+            tracer.current().set(
+                prompt_tokens=response.usage.prompt_tokens,
+                completion_tokens=response.usage.completion_tokens,
+                response_bytes=len(content or ""),
+            )
+        if self.rate_limiter is not None:
+            self.rate_limiter.on_success()
+            if response.usage is not None:
+                self.rate_limiter.record_usage(
+                    estimated_tokens, response.usage.total_tokens
+                )
+        return content
+
+    async def aclose(self) -> None:
+        """
+        Close the shared connection pool.
+        """
+        await self.client.close()
+
+
+def _retry_after(error: RateLimitError) -> float | None:
+    """Read the delay requested by the provider from a 429 response, if any"""
+    headers = error.response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
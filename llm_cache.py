@@ -0,0 +1,187 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache:
+    """
+    The ResponseCache class is a persistent, content-addressed cache of LLM responses.
+
+    The ResponseCache class:
+    1. Keys every response on the model, temperature, response format and full message list
+    2. Stores the responses in a local SQLite database so that they survive the process
+    3. Expires entries after a TTL and evicts the least recently used ones beyond a size budget
+    4. Counts hits, misses and evictions
+
+    Call sites opt in by passing the cache to `generate_with_timeout`; calls made without
+    a cache always reach the model.
+
+    Attributes:
+        path (str): Location of the SQLite database
+        ttl (float | None): Seconds after which an entry expires, None to never expire
+        max_entries (int): Maximum number of entries kept
+        max_bytes (int): Maximum total size of the stored responses
+        hits (int): Number of lookups answered from the cache
+        misses (int): Number of lookups not found or expired
+        evictions (int): Number of entries removed to respect the budgets
+    """
+
+    def __init__(
+        self,
+        path: str = ".llm_cache.sqlite3",
+        ttl: float | None = 7 * 24 * 3600,
+        max_entries: int = 10_000,
+        max_bytes: int = 64 * 1024 * 1024,
+    ) -> None:
+        """
+        Open (or create) the cache database.
+
+        Args:
+            path (str): Location of the SQLite database, ":memory:" for a process-local cache
+            ttl (float | None): Seconds after which an entry expires, None to never expire
+            max_entries (int): Maximum number of entries kept
+            max_bytes (int): Maximum total size of the stored responses
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def make_key(
+        model: str, temperature: float, response_format: dict | None, messages: list[dict]
+    ) -> str:
+        """
+        Compute the content address of a request.
+
+        Args:
+            model (str): Model used for the completion
+            temperature (float): Sampling temperature
+            response_format (dict): Requested response format
+            messages (list): Full list of chat messages
+
+        Returns:
+            str: Hex digest identifying the request
+        """
+        payload = json.dumps(
+            {
+                "model": model,
+                "temperature": temperature,
+                "response_format": response_format,
+                "messages": messages,
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        """
+        Look up a response.
+
+        Args:
+            key (str): Key computed by `make_key`
+
+        Returns:
+            str | None: The cached response, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            response, created = row
+            if self.ttl is not None and now - created > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                self.misses += 1
+                return None
+            self._db.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (now, key)
+            )
+            self._db.commit()
+            self.hits += 1
+            return response
+
+    def put(self, key: str, response: str) -> None:
+        """
+        Store a response and evict the least recently used entries beyond the budgets.
+
+        Args:
+            key (str): Key computed by `make_key`
+            response (str): Response text to store
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode()), now, now),
+            )
+            self._evict()
+            self._db.commit()
+
+    def _evict(self) -> None:
+        if self.ttl is not None:
+            cursor = self._db.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,)
+            )
+            self.evictions += cursor.rowcount
+        count, total = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        while count > self.max_entries or total > self.max_bytes:
+            key, size = self._db.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT 1"
+            ).fetchone()
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.evictions += 1
+            count -= 1
+            total -= size
+
+    def stats(self) -> dict:
+        """
+        Get the cache counters.
+
+        Returns:
+            dict: Hits, misses, evictions and the current number of entries
+        """
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": entries,
+        }
+
+    def close(self) -> None:
+        """
+        Close the underlying database.
+        """
+        with self._lock:
+            self._db.close()
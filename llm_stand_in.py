@@ -0,0 +1,446 @@
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from collections import Counter
+from hashlib import sha256
+from event_store import EventStore
+from prompt_engine import PromptEngine
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+from utils import FunctionName, estimate_tokens
+
+# Iterations which called tools, e.g. "In iteration 3 you called", and the number of them
+# folded into a digest, e.g. "called 9 tools in 4 iterations", so that the next step is known
+# without any session state. An iteration which called no tool does not advance the trajectory
+call_pattern = re.compile(r"\bIn iteration (\d+) you called\b")
+digest_pattern = re.compile(r"\bcalled \d+ tools in (\d+) iterations\b")
+
+# Characters of content in a chunk of a streamed reply, a few tokens like a real provider sends
+stream_chunk_chars = 8
+
+
+def _call(tool: FunctionName, **arguments) -> dict:
+    return {"tool_name": tool.value, "arguments": {"input": arguments}}
+
+
+# Decisions of a successful run of the default turning task, one batch per iteration
+default_trajectory = {
+    "id": "default-turning",
+    "perception": {
+        "task": "Turn a cast iron rod from 50 mm to 30 mm diameter over its 100 mm length",
+        "start_state": "Cylindrical cast iron rod of 50 mm diameter and 100 mm length",
+        "material_info": "Cast iron",
+        "dimension_info": {"start_diameter": 50, "final_diameter": 30, "length": 100},
+        "operations": "Turning in the XZ plane",
+        "end_state": "Rod of 30 mm diameter and 100 mm length",
+    },
+    "decisions": [
+        {
+            "what_was_done_in_previous_step": "Nothing yet",
+            "what_needs_to_be_done_next": "Set up the machine and the tool",
+            "calls": [
+                _call(FunctionName.SET_MACHINE),
+                _call(
+                    FunctionName.SELECT_TOOL_AND_START_SPINDLE,
+                    tool_number="0101",
+                    offset=1,
+                    spindle_speed=1200,
+                ),
+                _call(FunctionName.MOVE_TO_SAFE_START, x=52, z=2),
+            ],
+        },
+        {
+            "what_was_done_in_previous_step": "The machine is set up at a safe start point",
+            "what_needs_to_be_done_next": "Face the stock and turn it to the final diameter",
+            "calls": [
+                _call(FunctionName.FACE_STOCK, z_face=0, feed_rate=0.15),
+                _call(
+                    FunctionName.PERFORM_UNIFORM_TURNING,
+                    start_diameter=50,
+                    final_diameter=30,
+                    length=100,
+                    feed_rate=0.2,
+                    max_depth_of_cut=2,
+                    finishing_allowance=0.5,
+                ),
+            ],
+        },
+        {
+            "what_was_done_in_previous_step": "The stock is turned to the final diameter",
+            "what_needs_to_be_done_next": "End the program and finalize it",
+            "calls": [
+                _call(FunctionName.RETRACT_AND_END_PROGRAM, retract_x=100, retract_z=100),
+                _call(FunctionName.FINALIZE_PROGRAM, program_id="current"),
+            ],
+        },
+        {
+            "what_was_done_in_previous_step": "The program is finalized",
+            "what_needs_to_be_done_next": "Simulate the program and estimate its cycle time",
+            "independent": True,
+            "calls": [
+                _call(FunctionName.SIMULATE_PROGRAM, stock_diameter=50, stock_length=100),
+                _call(FunctionName.ESTIMATE_CYCLE_TIME, program_id="current"),
+            ],
+        },
+    ],
+}
+
+
+def final_decision(answer: str = "The program is complete") -> dict:
+    """The decision ending a run, replayed once a trajectory is exhausted"""
+    return {
+        "what_was_done_in_previous_step": "The program is complete",
+        "what_needs_to_be_done_next": "Give the final answer",
+        "calls": [{"tool_name": FunctionName.FINAL_ANSWER.value, "arguments": {"answer": answer}}],
+    }
+
+
+def load_trajectories(path: str) -> list[dict]:
+    """
+    Load scripted trajectories.
+
+    Every non-empty line of the file is a JSON object with the `perception` reply and the
+    list of `decisions` of one run, and optionally an `id` and the `query` it answers.
+
+    Args:
+        path (str): Path of the JSONL file
+
+    Returns:
+        list: The trajectories
+    """
+    trajectories = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            trajectory = json.loads(line)
+            trajectory.setdefault("id", f"trajectory-{line_number}")
+            trajectories.append(trajectory)
+    return trajectories
+
+
+def trajectories_from_events(event_store: EventStore) -> list[dict]:
+    """
+    Rebuild the trajectories of recorded runs from their event log.
+
+    The tool calls of an iteration become one batched decision, and the run ends with a
+    final answer. Sessions without a valid perception are skipped.
+
+    Args:
+        event_store (EventStore): Event log of the recorded runs
+
+    Returns:
+        list: One trajectory per recorded session
+    """
+    trajectories = []
+    for session_id in event_store.sessions():
+        perception = None
+        batches = {}
+        for event in event_store.load(session_id):
+            if event.kind == "perception" and perception is None:
+                try:
+                    perception = json.loads(event.text[event.text.index("{") :])
+                except ValueError:
+                    pass
+            elif event.kind == "tool_call" and event.tool_name:
+                batches.setdefault(event.iteration, []).append(
+                    {"tool_name": event.tool_name, "arguments": event.arguments}
+                )
+        if perception is None:
+            continue
+        decisions = [
+            {
+                "what_was_done_in_previous_step": "Replayed from a recorded run",
+                "what_needs_to_be_done_next": ", ".join(call["tool_name"] for call in calls),
+                "calls": calls,
+            }
+            for _, calls in sorted(batches.items())
+        ]
+        trajectories.append(
+            {"id": session_id, "perception": perception, "decisions": decisions + [final_decision()]}
+        )
+    return trajectories
+
+
+class FaultProfile:
+    """
+    Latency and failures injected by the stand-in.
+
+    Attributes:
+        latency_ms (float): Mean delay of a reply
+        jitter_ms (float): Standard deviation of the delay
+        error_rate (float): Fraction of requests answered with a 500
+        rate_limit_rate (float): Fraction of requests answered with a 429
+        retry_after_ms (float): Delay requested by the 429 replies
+        malformed_rate (float): Fraction of decisions replied as truncated JSON
+        chunk_interval_ms (float): Delay between two chunks of a streamed reply
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 0,
+        jitter_ms: float = 0,
+        error_rate: float = 0,
+        rate_limit_rate: float = 0,
+        retry_after_ms: float = 200,
+        malformed_rate: float = 0,
+        chunk_interval_ms: float = 0,
+    ) -> None:
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after_ms = retry_after_ms
+        self.malformed_rate = malformed_rate
+        self.chunk_interval_ms = chunk_interval_ms
+
+
+class StandInLLM:
+    """
+    The StandInLLM class is a local stand-in for an OpenAI-compatible chat completions API.
+
+    It lets the whole agent loop run offline, e.g. to test concurrency and scaling without
+    spending a quota. It keeps no session state: the step of a run is the number of
+    iterations which called tools in the history sent with every decision request.
+
+    The StandInLLM class:
+    1. Answers perception requests with the perception of the trajectory matching the query
+    2. Answers decision requests with the next decision of that trajectory, then a final answer
+    3. Delays every reply by a configurable latency with jitter
+    4. Injects 500 errors, 429s with a `retry-after-ms` header and malformed decisions
+    5. Counts the requests it served and the faults it injected
+    6. Streams the replies as server-sent chunks when asked to, with the keys of a decision
+       in the order of the requested schema
+
+    Attributes:
+        trajectories (list): The trajectories replayed, the default turning run if none is given
+        faults (FaultProfile): Latency and failures injected
+        stats (Counter): Number of requests, perceptions, decisions and injected faults
+        app (Starlette): The ASGI application serving `/v1/chat/completions`
+    """
+
+    def __init__(
+        self,
+        trajectories: list[dict] | None = None,
+        faults: FaultProfile | None = None,
+        seed: int | None = None,
+    ) -> None:
+        """
+        Initialize the stand-in.
+
+        Args:
+            trajectories (list): The trajectories to replay
+            faults (FaultProfile): Latency and failures to inject, none by default
+            seed (int): Seed of the latency and fault draws, for reproducible runs
+        """
+        self.trajectories = trajectories or [default_trajectory]
+        self.faults = faults or FaultProfile()
+        self.stats = Counter()
+        self._random = random.Random(seed)
+        self.app = Starlette(
+            routes=[
+                Route("/v1/chat/completions", self.chat_completions, methods=["POST"]),
+                Route("/v1/models", self.models, methods=["GET"]),
+                Route("/stats", self.get_stats, methods=["GET"]),
+            ]
+        )
+
+    def trajectory(self, messages: list[dict]) -> dict:
+        """
+        Pick the trajectory of a request.
+
+        Args:
+            messages (list): Chat messages of the request
+
+        Returns:
+            dict: The trajectory whose query appears in the request, else one chosen
+            deterministically from the text of the request
+        """
+        text = "\n".join(message["content"] for message in messages[:2])
+        for trajectory in self.trajectories:
+            if trajectory.get("query") and trajectory["query"].strip() in text:
+                return trajectory
+        digest = int(sha256(text.encode()).hexdigest()[:8], 16)
+        return self.trajectories[digest % len(self.trajectories)]
+
+    def reply(self, messages: list[dict], key_order: list[str] | None = None) -> str:
+        """
+        Get the content replied to a request.
+
+        Args:
+            messages (list): Chat messages of the request
+            key_order (list): Order of the keys of a decision, e.g. the properties of the
+                requested schema, the recorded order if not given
+
+        Returns:
+            str: The perception or the next decision, as JSON
+        """
+        trajectory = self.trajectory(messages)
+        # A decision request asks for the next step, possibly followed by a repair request
+        if not any(m["content"] == PromptEngine.next_step_question for m in messages):
+            self.stats["perceptions"] += 1
+            return json.dumps(trajectory["perception"])
+
+        self.stats["decisions"] += 1
+        step = len(
+            {
+                int(iteration)
+                for message in messages
+                for iteration in call_pattern.findall(message["content"])
+            }
+        ) + sum(
+            int(count)
+            for message in messages
+            for count in digest_pattern.findall(message["content"])
+        )
+        decisions = trajectory["decisions"]
+        decision = decisions[step] if step < len(decisions) else final_decision()
+        if key_order:
+            rank = {key: position for position, key in enumerate(key_order)}
+            decision = dict(sorted(decision.items(), key=lambda item: rank.get(item[0], len(rank))))
+        content = json.dumps(decision)
+        if self._random.random() < self.faults.malformed_rate:
+            self.stats["malformed"] += 1
+            return content[: len(content) // 2]
+        return content
+
+    async def chat_completions(self, request: Request) -> JSONResponse:
+        body = await request.json()
+        self.stats["requests"] += 1
+
+        faults = self.faults
+        delay = max(0.0, self._random.gauss(faults.latency_ms, faults.jitter_ms)) / 1000
+        if delay:
+            await asyncio.sleep(delay)
+
+        draw = self._random.random()
+        if draw < faults.rate_limit_rate:
+            self.stats["rate_limited"] += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                status_code=429,
+                headers={"retry-after-ms": str(int(faults.retry_after_ms))},
+            )
+        if draw < faults.rate_limit_rate + faults.error_rate:
+            self.stats["errors"] += 1
+            return JSONResponse(
+                {"error": {"message": "Injected server error", "type": "server_error", "code": None}},
+                status_code=500,
+            )
+
+        messages = body["messages"]
+        schema = (body.get("response_format") or {}).get("json_schema", {}).get("schema", {})
+        content = self.reply(messages, list(schema.get("properties", {})))
+        prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+        completion_tokens = estimate_tokens(content)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        if body.get("stream"):
+            self.stats["streams"] += 1
+            include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+            return StreamingResponse(
+                self._chunks(body.get("model", "stand-in"), content, usage if include_usage else None),
+                media_type="text/event-stream",
+            )
+        return JSONResponse(
+            {
+                "id": f"chatcmpl-{self.stats['requests']}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "stand-in"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": content},
+                    }
+                ],
+                "usage": usage,
+            }
+        )
+
+    async def _chunks(self, model: str, content: str, usage: dict | None):
+        """Server-sent chunks of a streamed reply, ending with the usage if requested"""
+        chunk = {
+            "id": f"chatcmpl-{self.stats['requests']}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+        }
+        deltas = [{"role": "assistant", "content": ""}] + [
+            {"content": content[start : start + stream_chunk_chars]}
+            for start in range(0, len(content), stream_chunk_chars)
+        ]
+        for delta in deltas:
+            yield f"data: {json.dumps({**chunk, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]})}\n\n"
+            if self.faults.chunk_interval_ms:
+                await asyncio.sleep(self.faults.chunk_interval_ms / 1000)
+        yield f"data: {json.dumps({**chunk, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})}\n\n"
+        if usage is not None:
+            yield f"data: {json.dumps({**chunk, 'choices': [], 'usage': usage})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    async def models(self, request: Request) -> JSONResponse:
+        return JSONResponse(
+            {"object": "list", "data": [{"id": "stand-in", "object": "model", "owned_by": "local"}]}
+        )
+
+    async def get_stats(self, request: Request) -> JSONResponse:
+        return JSONResponse(dict(self.stats))
+
+
+def add_stand_in_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the trajectory and fault options of the stand-in to a command line parser"""
+    parser.add_argument("--trajectories", help="JSONL file of scripted trajectories")
+    parser.add_argument("--events", help="Event log of recorded runs to replay")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0)
+    parser.add_argument("--retry-after-ms", type=float, default=200)
+    parser.add_argument("--malformed-rate", type=float, default=0)
+    parser.add_argument("--chunk-interval-ms", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def stand_in_from_arguments(args: argparse.Namespace) -> StandInLLM:
+    """Create the stand-in configured on the command line"""
+    trajectories = []
+    if args.trajectories:
+        trajectories += load_trajectories(args.trajectories)
+    if args.events:
+        event_store = EventStore(args.events)
+        try:
+            trajectories += trajectories_from_events(event_store)
+        finally:
+            event_store.close()
+    faults = FaultProfile(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after_ms=args.retry_after_ms,
+        malformed_rate=args.malformed_rate,
+        chunk_interval_ms=args.chunk_interval_ms,
+    )
+    return StandInLLM(trajectories, faults, args.seed)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve a local OpenAI-compatible stand-in LLM.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_stand_in_arguments(parser)
+    args = parser.parse_args()
+
+    uvicorn.run(stand_in_from_arguments(args).app, host=args.host, port=args.port, log_level="warning")
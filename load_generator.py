@@ -0,0 +1,286 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import httpx
+import uvicorn
+import mcp_client
+from batch_runner import load_tasks
+from llm_backend import LLMBackend
+from llm_stand_in import StandInLLM, add_stand_in_arguments, stand_in_from_arguments
+from mcp import StdioServerParameters
+from mcp.client.stdio import get_default_environment
+from rate_limiter import TokenBucketRateLimiter
+from session_pool import MCPSessionPool
+from tracing import percentile, read_durations, tracer
+from trajectory_cache import TrajectoryCache
+
+
+def distribution(values: list) -> dict:
+    """
+    Summarize a latency distribution.
+
+    Args:
+        values (list): Latencies in milliseconds
+
+    Returns:
+        dict: Count, mean, p50, p90, p95, p99 and max, empty when there are no values
+    """
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values), 3),
+        "p50_ms": percentile(values, 0.5),
+        "p90_ms": percentile(values, 0.9),
+        "p95_ms": percentile(values, 0.95),
+        "p99_ms": percentile(values, 0.99),
+        "max_ms": values[-1],
+    }
+
+
+def free_port() -> int:
+    """A local TCP port free at the time of the call"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def sample_pool(pool: MCPSessionPool, samples: list, interval: float) -> None:
+    """Record the leased sessions and the loops waiting for one, until cancelled"""
+    while True:
+        samples.append((pool.busy, pool.waiting))
+        await asyncio.sleep(interval)
+
+
+async def run_one(
+    task: dict, semaphore: asyncio.Semaphore, pool: MCPSessionPool, runs: list
+) -> None:
+    async with semaphore:
+        start = time.perf_counter()
+        _, _, action = await mcp_client.run_agent(
+            task["query"], task["preferences"], interactive=False, session_pool=pool
+        )
+        runs.append(
+            {
+                "task": task["id"],
+                "latency_ms": round((time.perf_counter() - start) * 1000, 3),
+                "tool_calls": len(action.trace) if action else 0,
+                # A run aborted by an error still returns its Action, only a final answer completes it
+                "completed": action is not None and action.finished,
+            }
+        )
+
+
+async def run_load(
+    tasks: list[dict],
+    runs: int,
+    concurrency: int,
+    servers: int,
+    output_dir: str,
+    stand_in: StandInLLM | None = None,
+    llm_url: str | None = None,
+    requests_per_minute: float = 1e6,
+    tokens_per_minute: float = 1e9,
+    sample_interval: float = 0.05,
+    replay: bool = False,
+    stream: bool = False,
+) -> dict:
+    """
+    Drive concurrent agent runs against a stand-in LLM and measure them.
+
+    The runs share a pool of warm action servers and an LLM backend pointed at the
+    stand-in, which is served in process unless the URL of a running one is given. The
+    client and the servers trace their phases to one file, from which the iteration and
+    tool latencies are read.
+
+    Args:
+        tasks (list): The task specs, the runs cycle through them
+        runs (int): Number of agent runs
+        concurrency (int): Maximum number of agent runs at once
+        servers (int): Number of warm action servers
+        output_dir (str): Directory of the trace and the report
+        stand_in (StandInLLM): Stand-in to serve in process
+        llm_url (str): Base URL of a stand-in running elsewhere, used instead of `stand_in`
+        requests_per_minute (float): Request budget of the client's rate limiter
+        tokens_per_minute (float): Token budget of the client's rate limiter
+        sample_interval (float): Seconds between two samples of the pool occupancy
+        replay (bool): Whether recognized tasks replay recorded plans, off so that every
+            run goes through the decision loop
+        stream (bool): Whether decisions are streamed and their calls dispatched early
+
+    Returns:
+        dict: Throughput and latency distributions of the runs which reached their final
+        answer, the number of aborted runs, server saturation and stand-in statistics
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    trace_path = os.path.join(output_dir, "trace.jsonl")
+    if os.path.exists(trace_path):
+        os.remove(trace_path)
+    tracer.open(trace_path)
+
+    server = None
+    server_task = None
+    if llm_url is None:
+        stand_in = stand_in or StandInLLM()
+        port = free_port()
+        server = uvicorn.Server(
+            uvicorn.Config(stand_in.app, host="127.0.0.1", port=port, log_level="warning")
+        )
+        server_task = asyncio.create_task(server.serve())
+        while not server.started:
+            if server_task.done():
+                await server_task
+            await asyncio.sleep(0.01)
+        llm_url = f"http://127.0.0.1:{port}"
+
+    # Every agent run goes through the stand-in, the model name keeps its replies apart in the response cache
+    mcp_client.client = LLMBackend(
+        api_key="stand-in",
+        base_url=f"{llm_url}/v1",
+        model="stand-in",
+        max_concurrency=concurrency,
+        max_connections=concurrency,
+        rate_limiter=TokenBucketRateLimiter(requests_per_minute, tokens_per_minute),
+        structured_outputs=True,
+    )
+
+    if not replay:
+        mcp_client.trajectory_cache = None
+    elif mcp_client.trajectory_cache is None:
+        mcp_client.trajectory_cache = TrajectoryCache(
+            os.getenv("AGENT_TRAJECTORY_CACHE_PATH", ".trajectory_cache.sqlite3")
+        )
+    mcp_client.stream_decisions = stream
+
+    params = mcp_client.server_params
+    pool = MCPSessionPool(
+        StdioServerParameters(
+            command=params.command,
+            args=params.args,
+            env={
+                **get_default_environment(),
+                "AGENT_TRACE_PATH": trace_path,
+                "AGENT_TRACE_PROCESS": "server",
+            },
+        ),
+        size=servers,
+    )
+    samples = []
+    results = []
+    semaphore = asyncio.Semaphore(concurrency)
+    try:
+        await pool.start()
+        sampler = asyncio.create_task(sample_pool(pool, samples, sample_interval))
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(
+                *(
+                    run_one(tasks[index % len(tasks)], semaphore, pool, results)
+                    for index in range(runs)
+                ),
+                return_exceptions=True,
+            )
+        finally:
+            elapsed = time.perf_counter() - start
+            sampler.cancel()
+    finally:
+        await pool.close()
+        await mcp_client.client.aclose()
+        if server is not None:
+            server.should_exit = True
+            await server_task
+    # The servers have exited, so all their spans are in the trace
+    tracer.close()
+
+    if stand_in is not None and server is not None:
+        stand_in_stats = dict(stand_in.stats)
+    else:
+        async with httpx.AsyncClient() as http:
+            stand_in_stats = (await http.get(f"{llm_url}/stats")).json()
+
+    spans = read_durations(trace_path)
+    completed = [run for run in results if run["completed"]]
+    report = {
+        "runs": runs,
+        "completed": len(completed),
+        "aborted": runs - len(completed),
+        "concurrency": concurrency,
+        "servers": servers,
+        "elapsed_seconds": round(elapsed, 3),
+        "tasks_per_second": round(len(completed) / elapsed, 3) if elapsed else None,
+        "run_latency": distribution([run["latency_ms"] for run in completed]),
+        "tool_calls_per_run": (
+            round(sum(run["tool_calls"] for run in completed) / len(completed), 2)
+            if completed
+            else None
+        ),
+        "iteration_latency": distribution(spans.get("iteration", [])),
+        "llm_latency": distribution(spans.get("llm.complete", [])),
+        "tool_latency": distribution(spans.get("server.tool", [])),
+        "server_saturation": {
+            # Share of the time the servers were leased, and spent executing tools
+            "lease_utilization": (
+                round(sum(busy for busy, _ in samples) / (len(samples) * servers), 3)
+                if samples
+                else None
+            ),
+            "tool_utilization": round(
+                sum(spans.get("server.tool", [])) / (elapsed * 1000 * servers), 3
+            ),
+            "peak_waiting": max((waiting for _, waiting in samples), default=0),
+            "lease_wait": distribution(spans.get("pool.lease_wait", [])),
+        },
+        "stand_in": stand_in_stats,
+        "trace": trace_path,
+    }
+    with open(os.path.join(output_dir, "load_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Drive concurrent agent runs against a local stand-in LLM."
+    )
+    parser.add_argument("--tasks", help="JSONL file of task specs, the default task if not given")
+    parser.add_argument("--runs", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--servers", type=int, default=None)
+    parser.add_argument("--output-dir", default="load_output")
+    parser.add_argument("--llm-url", help="Base URL of a running stand-in, one is served in process if not given")
+    parser.add_argument("--requests-per-minute", type=float, default=1e6)
+    parser.add_argument("--tokens-per-minute", type=float, default=1e9)
+    parser.add_argument("--replay", action="store_true", help="Replay the plans of recognized tasks")
+    parser.add_argument("--stream", action="store_true", help="Stream the decisions and dispatch their calls early")
+    parser.add_argument("--log-level", default="WARNING")
+    add_stand_in_arguments(parser)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level)
+    mcp_client.logger.setLevel(args.log_level)
+    tasks = (
+        load_tasks(args.tasks)
+        if args.tasks
+        else [{"id": "default", "query": mcp_client.default_query, "preferences": ""}]
+    )
+    report = asyncio.run(
+        run_load(
+            tasks,
+            args.runs,
+            args.concurrency,
+            args.servers or args.concurrency,
+            args.output_dir,
+            stand_in=None if args.llm_url else stand_in_from_arguments(args),
+            llm_url=args.llm_url,
+            requests_per_minute=args.requests_per_minute,
+            tokens_per_minute=args.tokens_per_minute,
+            replay=args.replay,
+            stream=args.stream,
+        )
+    )
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,110 @@
+import json
+from mcp import ClientSession
+from mcp.server.fastmcp.tools import ToolManager
+from mcp.types import CallToolResult, TextContent
+from pydantic import BaseModel
+from gcode_tools import pure_gcode_tools
+
+
+def to_text_content(result: BaseModel | str) -> list[TextContent]:
+    """
+    Convert the return value of a pure tool to the content the MCP server sends for it.
+
+    Args:
+        result (BaseModel | str): The output model of the tool, or its text
+
+    Returns:
+        list: The text content of the result
+    """
+    if isinstance(result, BaseModel):
+        result = json.dumps(result.model_dump(mode="json"))
+    return [TextContent(type="text", text=result)]
+
+
+class LocalToolExecutor:
+    """
+    The LocalToolExecutor class runs the pure G-code tools inside the client process.
+
+    The LocalToolExecutor class:
+    1. Registers the same functions and input schemas as the MCP action server
+    2. Dispatches calls to those tools directly, skipping JSON-RPC and the stdio round trip
+    3. Falls back to the MCP session for every other tool, e.g. the side-effecting paint tool
+    4. Returns results identical to the remote path, errors included
+    5. Forwards the G-code produced locally to the server's program buffer in one
+       `append_to_program` call, right before the next remote call or on `flush`
+
+    It exposes the same `call_tool` as a `ClientSession`, so it can be handed to `Action`
+    in place of the session.
+
+    Attributes:
+        session (ClientSession): The MCP session used for the tools which are not local
+        local_calls (int): Number of calls served in process
+        remote_calls (int): Number of calls forwarded to the MCP session
+        pending (list): Sections of G-code produced locally and not yet sent to the server
+    """
+
+    def __init__(self, session: ClientSession, tools: list = pure_gcode_tools) -> None:
+        """
+        Initialize the LocalToolExecutor.
+
+        Args:
+            session (ClientSession): The MCP session used for the tools which are not local
+            tools (list): Pure functions to serve in process
+        """
+        self.session = session
+        self.local_calls = 0
+        self.remote_calls = 0
+        self.pending = []
+        self._tool_manager = ToolManager()
+        for fn in tools:
+            self._tool_manager.add_tool(fn)
+
+    def is_local(self, name: str) -> bool:
+        """
+        Check whether a tool is served in process.
+
+        Args:
+            name (str): Name of the tool
+
+        Returns:
+            bool: True if the tool is executed locally
+        """
+        return self._tool_manager.get_tool(name) is not None
+
+    async def call_tool(self, name: str, arguments: dict | None = None) -> CallToolResult:
+        """
+        Call a tool, in process if possible and over the MCP session otherwise.
+
+        Args:
+            name (str): Name of the tool
+            arguments (dict): Arguments of the tool call
+
+        Returns:
+            CallToolResult: The result, as the MCP server would have returned it
+        """
+        if not self.is_local(name):
+            await self.flush()
+            self.remote_calls += 1
+            return await self.session.call_tool(name, arguments=arguments)
+
+        self.local_calls += 1
+        # Mirror the MCP server: validate, run, convert, and report errors in the result
+        try:
+            result = await self._tool_manager.call_tool(name, arguments or {})
+            self.pending.append({"section": name, "blocks": result.result})
+            return CallToolResult(content=to_text_content(result), isError=False)
+        except Exception as e:
+            return CallToolResult(
+                content=[TextContent(type="text", text=str(e))], isError=True
+            )
+
+    async def flush(self) -> None:
+        """
+        Append the G-code produced locally to the current program on the server.
+        """
+        if not self.pending:
+            return
+        sections, self.pending = self.pending, []
+        await self.session.call_tool(
+            "append_to_program", arguments={"input": {"sections": sections}}
+        )
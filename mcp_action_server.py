@@ -1,157 +1,242 @@
 # basic import
-from mcp.server.fastmcp import FastMCP
+import os
 import sys
-from use_paint_preview_with_mac import *
-from mcp_schemas import *
+import json
+import asyncio
+import functools
+from tool_backends import StartupProfiler, BackendRegistry
+
+# Profile the cold start, the budget is the time allowed until the first list_tools
+startup = StartupProfiler(
+    budget_ms=float(os.getenv("CNC_SERVER_STARTUP_BUDGET_MS", 1500))
+)
+
+with startup.phase("import mcp.server.fastmcp"):
+    from mcp.server.fastmcp import FastMCP
+with startup.phase("import mcp_schemas"):
+    from mcp_schemas import *
+with startup.phase("import gcode_tools"):
+    from gcode_tools import pure_gcode_tools
+with startup.phase("import program_buffer"):
+    from program_buffer import ProgramStore
+with startup.phase("import tracing"):
+    from tracing import tracer
+
+# Tool backends are declared here and only imported on their first call
+backends = BackendRegistry(startup)
+backends.register("paint_preview", "use_paint_preview_with_mac:open_paint_with_text_mac")
+backends.register("headless", "paint_renderers:render_text_to_png")
+backends.register("simulator", "lathe_sim:simulate_turning")
+backends.register("cycle_time", "cycle_time:estimate_cycle_time")
+
+# Backend of the paint tool: "headless" renders PNG files, "paint_preview" drives Mac Preview
+paint_backend = os.getenv("CNC_PAINT_BACKEND", "headless")
+
+
+class ProfiledFastMCP(FastMCP):
+    """FastMCP server which reports its time to the first list_tools to the startup profiler and traces the tool executions"""
+
+    async def list_tools(self):
+        tools = await super().list_tools()
+        startup.mark_list_tools()
+        return tools
+
+    async def call_tool(self, name, arguments):
+        with tracer.span("server.tool", tool=name) as span:
+            result = await super().call_tool(name, arguments)
+            span.set(response_bytes=sum(len(getattr(item, "text", "")) for item in result))
+            return result
+
 
 # instantiate an MCP server client
-mcp = FastMCP("CNC Simulator")
+mcp = ProfiledFastMCP("CNC Simulator")
+
+# Programs assembled from the G-code tools, one current program per client connection
+programs = ProgramStore()
+
+
+def connection_key():
+    """Identify the client connection of the request being served"""
+    try:
+        return id(mcp.get_context().session)
+    except ValueError:
+        return None
+
+
+def accumulating(gcode_tool):
+    """Wrap a G-code tool so that its output is also appended to the current program"""
+
+    @functools.wraps(gcode_tool)
+    def wrapper(*args, **kwargs):
+        output = gcode_tool(*args, **kwargs)
+        programs.current(connection_key()).append(output.result, gcode_tool.__name__)
+        return output
+
+    return wrapper
+
+
+def program_output(program) -> ProgramOutput:
+    return ProgramOutput(
+        program_id=program.program_id,
+        finalized=program.finalized,
+        result=program.render() if program.finalized else program.listing(),
+    )
+
 
 # DEFINE TOOLS
 
+# Pure G-code tools, shared with the in-process executor of the client
+for gcode_tool in pure_gcode_tools:
+    mcp.tool()(accumulating(gcode_tool))
+
 
 @mcp.tool()
-def set_units_and_mode() -> GCodeOutput:
+def start_program() -> ProgramOutput:
     """
-    Sets the CNC machine to use metric units, absolute positioning,
-    feed per revolution mode, and selects the XZ plane.
+    Starts a new, empty G-code program. The G-code returned by every tool is appended to it automatically.
 
     Returns:
-        GcodeOutput (list of strings): A list of G-code commands to set the units and mode
+        ProgramOutput: The id of the new program
     """
-    return GCodeOutput(
-        result=[
-            "G21",  # Units in mm
-            "G90",  # Absolute positioning
-            "G95",  # Feed per revolution
-            "G18",  # XZ plane selection
-        ]
-    )
+    return program_output(programs.start(connection_key()))
 
 
 @mcp.tool()
-def select_tool_and_start_spindle(input: SelectToolAndStartSpindleInput) -> GCodeOutput:
+def append_to_program(input: AppendToProgramInput) -> ProgramOutput:
     """
-    Selects the tool and starts the spindle at a given speed.
+    Appends sections of G-code blocks to a program.
 
     Args:
-        input (SelectToolAndStartSpindleInput): Input parameters containing:
-            - tool_number (str): Tool number (e.g. T0101)
-            - offset (int): Tool offset number
-            - spindle_speed (int): Spindle speed in RPM
+        input (AppendToProgramInput): Input parameters containing:
+            - program_id (str): Id of the program (default: current)
+            - sections (list): Sections to append, each with a section name and its blocks
 
     Returns:
-        GCodeOutput (list of strings): A list of G-code commands to select the tool and start the spindle
+        ProgramOutput: The numbered blocks of the program
     """
-    return GCodeOutput(
-        result=[
-            f"T{input.tool_number}{input.offset:02d}",  # Tool selection
-            f"G97 S{input.spindle_speed} M03",  # Spindle on clockwise with RPM
-        ]
+    program = (
+        programs.current(connection_key())
+        if input.program_id == "current"
+        else programs.get(connection_key(), input.program_id)
     )
+    for section in input.sections:
+        program.append(section.blocks, section.section)
+    return program_output(program)
 
 
 @mcp.tool()
-def move_to_safe_start(input: MoveToSafeStartInput) -> GCodeOutput:
+def get_program(input: ProgramIdInput) -> ProgramOutput:
     """
-    Moves the tool to a safe starting position before cutting.
+    Shows the G-code program collected so far as numbered blocks.
 
     Args:
-        input (MoveToSafeStartInput): Input parameters containing:
-            - x (float): X-coordinate in mm
-            - z (float): Z-coordinate in mm
+        input (ProgramIdInput): Input parameters containing:
+            - program_id (str): Id of the program (default: current)
 
     Returns:
-        GcodeOutput (list of strings): A list of G-code commands to move the tool to a safe starting position
+        ProgramOutput: The numbered blocks of the program, or its final text once finalized
     """
-    return GCodeOutput(result=[f"G0 X{input.x} Z{input.z}"])
+    return program_output(programs.get(connection_key(), input.program_id))
 
 
 @mcp.tool()
-def face_stock(input: FaceStockInput) -> GCodeOutput:
+def annotate_program(input: AnnotateProgramInput) -> ProgramOutput:
     """
-    Faces the end of the stock to ensure it's flat.
+    Adds a comment to one block of the G-code program.
 
     Args:
-        input (FaceStockInput): Input parameters containing:
-            - z_face (float): Final Z position to face to (usually 0)
-            - feed_rate (float): Feed rate for facing
+        input (AnnotateProgramInput): Input parameters containing:
+            - program_id (str): Id of the program (default: current)
+            - index (int): Number of the block as shown by get_program
+            - comment (str): Comment explaining the block
 
     Returns:
-        GcodeOutput (list of strings): A list of G-code commands to face the end of the stock
+        ProgramOutput: The numbered blocks of the program
     """
-    return GCodeOutput(
-        result=[
-            f"G1 Z{input.z_face} F{input.feed_rate}",  # Feed to face
-            "G0 Z2",  # Retract after facing
-        ]
-    )
+    program = programs.get(connection_key(), input.program_id)
+    program.annotate(input.index, input.comment)
+    return program_output(program)
 
 
 @mcp.tool()
-def do_turning(input: DoTurningInput) -> GCodeOutput:
+def reorder_program(input: ReorderProgramInput) -> ProgramOutput:
     """
-    Turns along the full length of the cylinder to reduce its diameter uniformly.
+    Reorders the blocks of the G-code program.
 
     Args:
-        input (DoTurningInput): Input parameters containing:
-            - start_diameter (float): Initial diameter of the rod in mm
-            - final_diameter (float): Final diameter after turning in mm
-            - length (float): Length of the cut along Z-axis in mm
-            - feed_rate (float): Feed rate in mm/rev
+        input (ReorderProgramInput): Input parameters containing:
+            - program_id (str): Id of the program (default: current)
+            - order (list of int): Block numbers, as shown by get_program, in their new order
 
     Returns:
-        GcodeOutput (list of strings)A list of G-code commands to cut along the full length of the cylinder
+        ProgramOutput: The numbered blocks of the program
     """
-    return GCodeOutput(
-        result=[
-            f"G0 X{input.start_diameter} Z0",  # Rapid to start position
-            f"G1 X{input.final_diameter} Z-{input.length} F{input.feed_rate}",  # Turning pass
-        ]
-    )
+    program = programs.get(connection_key(), input.program_id)
+    program.reorder(input.order)
+    return program_output(program)
 
 
 @mcp.tool()
-def retract_and_end_program(input: RetractAndEndProgramInput) -> GCodeOutput:
+def finalize_program(input: ProgramIdInput) -> ProgramOutput:
     """
-    Retracts the tool to a safe position and ends the program.
+    Finalizes the G-code program. It can no longer be changed and can be shown with add_text_in_paint by its id.
 
     Args:
-        input (RetractAndEndProgramInput): Input parameters containing:
-            - retract_x (float): X-coordinate for safe retract (default: 100)
-            - retract_z (float): Z-coordinate for safe retract (default: 100)
+        input (ProgramIdInput): Input parameters containing:
+            - program_id (str): Id of the program (default: current)
 
     Returns:
-        GcodeOutput (list of strings): A list of G-code commands to retract the tool and end the program
+        ProgramOutput: The final program text with a comment opening every section
     """
-    return GCodeOutput(
-        result=[
-            f"G0 X{input.retract_x} Z{input.retract_z}",  # Retract tool
-            "M05",  # Stop spindle
-            "M30",  # End of program
-        ]
-    )
+    program = programs.get(connection_key(), input.program_id)
+    program.finalized = True
+    return program_output(program)
 
 
 @mcp.tool()
 async def add_text_in_paint(input: AddTextInPaintInput) -> TextContentOutput:
     """
-    Creates a new image, opens it in Mac Preview, creates a rectangle on the image and adds the text to the rectangle.
+    Creates a new image with a rectangle on it and adds the text to the rectangle.
+    By default the image is rendered headless into PNG pages, otherwise it is drawn in Mac Preview.
 
     Args:
         input (AddTextInPaintInput): Input parameters containing:
             - text: Text to add to the image
+            - program_id: Id of a program to show instead of a text, "current" for the current program
 
     Returns:
         TextContentOutput: A message indicating if the text was added successfully or not
     """
     try:
-        open_paint_with_text_mac(input.text)
+        if input.program_id:
+            program = programs.get(connection_key(), input.program_id)
+            text = "\n".join(program.render())
+            shown = f"Program {program.program_id} ({len(program.blocks)} blocks)"
+        elif input.text is not None:
+            text = input.text
+            shown = f"Text:'{input.text}'"
+        else:
+            raise ValueError("Either a text or a program_id is required")
+
+        if paint_backend == "headless":
+            render_text_to_png = backends.get("headless")
+            pages = render_text_to_png(text)
+            return TextContentOutput(
+                result=[
+                    {
+                        "type": "text",
+                        "text": f"{shown} rendered successfully to {', '.join(pages)}",
+                    }
+                ]
+            )
+
+        open_paint_with_text_mac = backends.get("paint_preview")
+        open_paint_with_text_mac(text)
         return TextContentOutput(
             result=[
                 {
                     "type": "text",
-                    "text": f"Text:'{input.text}' added successfully to the paint application",
+                    "text": f"{shown} added successfully to the paint application",
                 }
             ]
         )
@@ -214,9 +299,79 @@ def verify_step(input: VerifyStepInput) -> TextContentOutput:
     )
 
 
+@mcp.tool()
+def simulate_program(input: SimulateProgramInput) -> SimulationOutput:
+    """
+    Simulates the G-code program on a cylindrical stock to check the part it produces.
+    Use it instead of verify_step to check diameters, lengths, rapid moves and depths of cut.
+
+    Args:
+        input (SimulateProgramInput): Input parameters containing:
+            - program_id (str): Id of the program to simulate (default: current)
+            - gcode (list of str): Blocks to simulate instead of a program (optional)
+            - stock_diameter (float): Diameter of the raw stock in mm
+            - stock_length (float): Length of the raw stock in mm, the face being at Z0
+            - max_depth_of_cut (float): Largest radial depth allowed for a single cut in mm (default: 2)
+            - resolution (float): Spacing of the simulation along Z in mm (default: 0.1)
+
+    Returns:
+        SimulationOutput: Final and minimum diameter, final length, removed volume,
+        rapid moves through material, depth-of-cut violations and other issues by block number
+    """
+    simulate_turning = backends.get("simulator")
+    if input.gcode is not None:
+        blocks, start = input.gcode, 1
+    else:
+        # Numbered like get_program, so that issues point at the blocks to fix
+        blocks, start = programs.get(connection_key(), input.program_id).blocks, 0
+    return simulate_turning(
+        blocks,
+        input.stock_diameter,
+        input.stock_length,
+        input.max_depth_of_cut,
+        input.resolution,
+        start,
+    )
+
+
+@mcp.tool()
+def estimate_cycle_time(input: EstimateCycleTimeInput) -> CycleTimeOutput:
+    """
+    Estimates how long the G-code program runs on the machine, to compare candidate programs.
+
+    Args:
+        input (EstimateCycleTimeInput): Input parameters containing:
+            - program_id (str): Id of the program to estimate (default: current)
+            - gcode (list of str): Blocks to estimate instead of a program (optional)
+            - machine (MachineProfile): Rapid rates in mm/min, maximum spindle speed in RPM,
+              tool change and spindle start times in seconds and home position (optional)
+
+    Returns:
+        CycleTimeOutput: Total, cutting, rapid and overhead seconds and the time of every block
+    """
+    estimate = backends.get("cycle_time")
+    if input.gcode is not None:
+        return estimate(input.gcode, input.machine)
+    # Numbered like get_program
+    return estimate(programs.get(connection_key(), input.program_id).blocks, input.machine, 0)
+
+
 # DEFINE RESOURCES
 
 
+@mcp.resource("program://{program_id}")
+def get_program_resource(program_id: str) -> str:
+    """Get the text of a G-code program"""
+    return "\n".join(programs.get(None, program_id).render())
+
+
+@mcp.resource("startup://report")
+def get_startup_report() -> str:
+    """Get the cold start profile of the server"""
+    return json.dumps(startup.report(), indent=2)
+
+
+
 @mcp.resource("greeting://{name}")
 def get_greeting(name: str) -> GreetingOutput:
     """Get a personalized greeting"""
@@ -245,8 +400,19 @@ def debug_error(error: str) -> DebugErrorOutput:
     )
 
 
+def profile_startup():
+    """Measure the time to the first list_tools in process and print the startup report"""
+    asyncio.run(mcp.list_tools())
+    print(json.dumps(startup.report(), indent=2))
+    if not startup.report()["within_budget"]:
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     # Check if running with mcp dev command
+    if len(sys.argv) > 1 and sys.argv[1] == "profile":
+        profile_startup()
+        sys.exit(0)
     print("STARTING")
     if len(sys.argv) > 1 and sys.argv[1] == "dev":
         mcp.run()  # Run without transport for dev server
@@ -1,10 +1,20 @@
 import os
+import json
 import logging
 from dotenv import load_dotenv
 from mcp import ClientSession, StdioServerParameters, types
-from mcp.client.stdio import stdio_client
+from mcp.client.stdio import stdio_client, get_default_environment
 import asyncio
-from openai import OpenAI
+import time
+from llm_backend import LLMBackend
+from llm_cache import ResponseCache
+from event_store import EventStore
+from prompt_engine import PromptEngine
+from local_tools import LocalToolExecutor
+from rate_limiter import TokenBucketRateLimiter
+from tool_manifest import ToolManifest
+from trajectory_cache import TrajectoryCache, reports_failure
+from tracing import tracer
 from concurrent.futures import TimeoutError
 from utils import *
 from rich.console import Console
@@ -20,8 +30,39 @@ from action import *
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Shared limiter for the provider quota, the free tier allows 15 requests per minute
+rate_limiter = TokenBucketRateLimiter(
+    requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", 15)),
+    tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", 30000)),
+)
+
+# Initialize the async LLM backend, shared by perception and decision. Decisions are
+# constrained to the tool schemas unless the model rejects json_schema response formats
+client = LLMBackend(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    rate_limiter=rate_limiter,
+    structured_outputs=os.getenv("LLM_STRUCTURED_OUTPUTS", "1") == "1",
+)
+
+# Persistent log of the events of every session, shared by all the agent loops
+event_store = EventStore(os.getenv("AGENT_EVENTS_PATH", ".agent_events.sqlite3"))
+
+# Persistent response cache, used by the perception call which is identical for repeated jobs
+response_cache = ResponseCache(os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite3"))
+
+# Tools of the action server remembered between runs, so that perception can start before the server
+tool_manifest = ToolManifest(os.getenv("TOOL_MANIFEST_PATH", ".tool_manifest.json"))
+
+# Plans of successful runs, replayed for recognized tasks with AGENT_TRAJECTORY_REPLAY=1. Off by
+# default, since a replayed plan is only checked by its tool errors and the simulator
+trajectory_cache = (
+    TrajectoryCache(os.getenv("AGENT_TRAJECTORY_CACHE_PATH", ".trajectory_cache.sqlite3"))
+    if os.getenv("AGENT_TRAJECTORY_REPLAY", "0") == "1"
+    else None
+)
+
+# Decisions streamed so that their calls start before the end of the reply, off unless LLM_STREAM_DECISIONS=1
+stream_decisions = os.getenv("LLM_STREAM_DECISIONS", "0") == "1"
 
 # Initialize rich console
 console = Console()
@@ -38,103 +79,346 @@ logger = logging.getLogger("mcp_client")
 max_iterations = 10
 last_response = None
 
+# How to spawn the MCP action server, which traces its tool executions to the same file
+server_params = StdioServerParameters(
+    command="python",
+    args=["mcp_action_server.py"],
+    env=(
+        {
+            **get_default_environment(),
+            "AGENT_TRACE_PATH": tracer.path,
+            "AGENT_TRACE_PROCESS": "server",
+        }
+        if tracer.enabled
+        else None
+    ),
+)
 
-async def main(user_preferences):
-    print("Starting main execution...")
-
-    # Create the memory object to store the user preferences and the iteration responses
-    mem = Memory()
-    session_id = str(uuid4())
-    mem.session[session_id] = []
-
-    # Ask the user preferences before beginning of the agentic workflow
-    mem.preferences.append(user_preferences)
-
-    # Create a decision object to make decisions for our use case
-    decision = Decision(mem, client, logger)
 
-    # User query
-    query = """
+# User query
+default_query = """
 TASK:
 --------------------------------
 You are given a cylindrical cast iron rod of length 10 cm and diameter 5 cm. You need to turn the rod to a diameter of 3 cm without altering the length of the rod. You need to come up with a program to do this. Remember turning is done in the XZ plane.
 
 Once you have the code to perform this operation, visualize the answer in a paint tool.
 """
-    logger.info(f"User Query:\n{query}\n")
 
-    current_iteration = 0
 
-    try:
-        # Create a single MCP server connection
-        print("Establishing connection to MCP server...")
-        server_params = StdioServerParameters(
-            command="python", args=["mcp_action_server.py"]
+async def perceive(query, tools_description):
+    """
+    Run the perception step, which only needs the description of the tools.
+
+    Args:
+        query (str): The task given to the agent
+        tools_description (str): Prompt rendering of the tools
+
+    Returns:
+        str: The validated perception of the task
+    """
+    with tracer.span("perception"):
+        perception_prompt = build_perception_prompt(tools_description, query)
+        # Only a reply which validates is cached, an invalid one would be served again on every run
+        perception_response_text = await generate_with_timeout(
+            client,
+            perception_prompt,
+            cache=response_cache,
+            validate=PerceptionObject.model_validate_json,
         )
 
-        async with stdio_client(server_params) as (read, write):
-            print("Connection established, creating session...")
-            async with ClientSession(read, write) as session:
-                print("Session created, initializing...")
-                await session.initialize()
-
-                # Get available tools
-                print("Requesting tool list...")
-                tools_result = await session.list_tools()
-                tools = tools_result.tools
-                tools_description = get_description_from_tools(tools)
-
-                # Create an action object to execute the tools for our taks
-                action = Action(tools, mem, logger)
-
-                # Create perception output
-                perception_prompt = build_perception_prompt(tools_description, query)
-                perception_response_text = await generate_with_timeout(
-                    client, perception_prompt
-                )
+        # Validate the perceived output
+        PerceptionObject.model_validate_json(perception_response_text)
+    return perception_response_text
 
-                # Validate the perceived output
-                PerceptionObject.model_validate_json(perception_response_text)
 
-                mem.session[session_id].append(
-                    f"\nMY PERCEPTION\nI have percieved this information from the given query:\n{perception_response_text}"
-                )
+async def discover_tools(session):
+    """
+    Initialize a new MCP session and get the tools of the server.
+
+    Args:
+        session (ClientSession): The session, not initialized yet
 
-                logger.info(f"\nPerceived the user's task and extracted this information about the task:\n{perception_response_text}")
+    Returns:
+        tuple: The tools and their prompt description
+    """
+    print("Session created, initializing...")
+    await session.initialize()
 
-                while current_iteration < max_iterations:
+    # Get available tools
+    print("Requesting tool list...")
+    tools_result = await session.list_tools()
+    tools = tools_result.tools
+    return tools, get_description_from_tools(tools)
 
-                    # Introduce a sleep to be generous to the cloud provider
-                    # For free tier, we have a max of 15 requests per minute
-                    await asyncio.sleep(2)
 
-                    logger.info(f"\n--- Iteration {current_iteration + 1} ---")
+async def perceive_while_connecting(query, cached, connect):
+    """
+    Overlap the perception call with the start of the action server.
 
-                    try:
+    With a cached tool manifest, perception starts right away from the cached tool
+    description while `connect` spawns the server and discovers its tools. Once both are
+    done, the cached description is checked against the live one, and the perception is
+    only thrown away if the tools drifted.
 
-                        function_call = await decision.decide(session_id, query, tools)
+    Args:
+        query (str): The task given to the agent
+        cached (tuple | None): Tools and description of the manifest, None if there is none
+        connect: Coroutine returning the live tools and their description
 
-                        to_continue = await action.execute_action(
-                            function_call, session, session_id, current_iteration + 1
-                        )
+    Returns:
+        tuple: The live tools, their description and the perception, None if it must be redone
+    """
+    started = time.perf_counter()
+    perception_task = (
+        asyncio.create_task(perceive(query, cached[1])) if cached is not None else None
+    )
+    try:
+        tools, tools_description = await connect
+    except BaseException:
+        if perception_task is not None:
+            perception_task.cancel()
+        raise
+
+    perception = None
+    if perception_task is not None:
+        if tool_manifest.reconcile(server_params, cached, tools, tools_description):
+            perception = await perception_task
+        else:
+            logger.warning("The tools of the server changed, perceiving the task again")
+            perception_task.cancel()
+    else:
+        tool_manifest.save(server_params, tools, tools_description)
+    logger.info(
+        f"Server ready in {time.perf_counter() - started:.2f}s"
+        + (", perception overlapped" if perception is not None else "")
+    )
+    return tools, tools_description, perception
+
+
+async def agent_loop(
+    query, mem, session_id, decision, session, tools, tools_description, perception=None
+):
+    """
+    Perceive the task and run the decide/act iterations over an initialized MCP session.
+
+    Args:
+        query (str): The task given to the agent
+        mem (Memory): Memory holding the session of this run
+        session_id (str): Unique identifier for the memory session
+        decision (Decision): Decision object of this run
+        session (ClientSession): Initialized MCP session of the action server
+        tools (list): Tools of the action server
+        tools_description (str): Prompt rendering of the tools
+        perception (str): Perception already made while the server was starting, if any
+
+    Returns:
+        Action: The Action of the run, holding the trace of the executed tool calls
+    """
+    # Create an action object to execute the tools for our taks
+    action = Action(tools, mem, logger)
+
+    # Pure G-code tools run in process, the others go over the MCP session
+    tool_executor = LocalToolExecutor(session)
+
+    # Every run collects its G-code into a fresh program on the server
+    await session.call_tool("start_program", arguments={})
+
+    # Create perception output, unless it was made while the server was starting
+    perception_response_text = perception or await perceive(query, tools_description)
+
+    mem.store(
+        f"\nMY PERCEPTION\nI have percieved this information from the given query:\n{perception_response_text}",
+        session_id,
+        kind="perception",
+    )
+
+    logger.info(f"\nPerceived the user's task and extracted this information about the task:\n{perception_response_text}")
+
+    current_iteration = 0
+    decisions = []
+    finished = False
+
+    # Calls of a streamed decision start executing while the rest of its reply arrives
+    early_actions = []
+
+    def dispatch(function_call, recorded):
+        early_actions.append(
+            asyncio.create_task(
+                action.execute_action(
+                    function_call, tool_executor, session_id, current_iteration + 1, recorded
+                )
+            )
+        )
+
+    # A recognized task replays the plan of its last successful run, without any decision call
+    plan = trajectory_cache.lookup(perception_response_text) if trajectory_cache else None
+    if plan is not None:
+        logger.info(f"Recognized the task, replaying a plan of {len(plan)} steps")
+        with tracer.span("replay", steps=len(plan)) as span:
+            current_iteration, finished = await trajectory_cache.replay(
+                plan, action, tool_executor, session_id, decisions
+            )
+            span.set(finished=finished)
+        if not finished:
+            logger.warning(f"The replayed plan did not validate at step {current_iteration}, asking the LLM")
+
+    while not finished and current_iteration < max_iterations:
+
+        logger.info(f"\n--- Iteration {current_iteration + 1} ---")
+
+        try:
+
+            with tracer.span("iteration", number=current_iteration + 1):
+                early_actions.clear()
+                function_call = await decision.decide(session_id, query, tools, dispatch)
+                if function_call is not None:
+                    decisions.append(function_call)
+
+                if early_actions:
+                    to_continue = await early_actions[0]
+                else:
+                    to_continue = await action.execute_action(
+                        function_call, tool_executor, session_id, current_iteration + 1
+                    )
+
+            if not to_continue:
+                finished = True
+                break
+
+        except Exception as e:
+            logger.error(f"Error details: {str(e)}")
+            logger.error(f"Error type: {type(e)}")
+            break
+
+        finally:
+            # A decision which failed after dispatching leaves its calls running
+            for task in early_actions:
+                if not task.done():
+                    task.cancel()
+
+        current_iteration += 1
+
+    await tool_executor.flush()
+
+    # A run which reached its answer without any failed call or check becomes the plan of its kind of task
+    if trajectory_cache is not None:
+        if finished and not any(
+            entry["is_error"] or reports_failure(entry["result"]) for entry in action.trace
+        ):
+            trajectory_cache.record(perception_response_text, decisions)
+        logger.info(f"Trajectory cache: {trajectory_cache.stats}")
+    logger.info(f"Decision replies: {decision.structured_output.stats}")
+    if tracer.enabled:
+        logger.info(f"Latency per phase (spans in {tracer.path}): {json.dumps(tracer.summary(), indent=2)}")
+    return action
+
+
+async def run_agent(
+    query, user_preferences, interactive=True, plan_mode=True, session_pool=None
+):
+    """
+    Run one agent loop on a query with its own Memory session and Decision/Action pair.
+
+    Args:
+        query (str): The task given to the agent
+        user_preferences (str): Preferences of the user for this task
+        interactive (bool): Whether the decision step pauses in an interactive console
+        plan_mode (bool): Whether a decision may batch several tool calls in one LLM round trip
+        session_pool (MCPSessionPool): Pool of warm action servers, a fresh server is spawned if not given
+
+    Returns:
+        tuple: The Memory, the session id and the Action (None if the server could not be reached)
+    """
+    # Create the memory object to store the user preferences and the iteration responses
+    mem = Memory(event_store)
+    session_id = str(uuid4())
+    mem.new_session(session_id)
+
+    # Ask the user preferences before beginning of the agentic workflow
+    mem.preferences.append(user_preferences)
 
-                        if not to_continue:
-                            break
+    # Create a decision object to make decisions for our use case
+    decision = Decision(
+        mem,
+        client,
+        logger,
+        prompt_engine=PromptEngine(plan_mode=plan_mode),
+        interactive=interactive,
+        streaming=stream_decisions,
+    )
+    action = None
 
-                    except Exception as e:
-                        logger.error(f"Error details: {str(e)}")
-                        logger.error(f"Error type: {type(e)}")
-                        break
+    logger.info(f"User Query:\n{query}\n")
 
-                    current_iteration += 1
+    try:
+        if session_pool is not None:
+            # Perceive while waiting for a lease, the pool knows the tools of its servers
+            cached_description = session_pool.tools_description()
+            perception_task = (
+                asyncio.create_task(perceive(query, cached_description))
+                if cached_description is not None
+                else None
+            )
+            try:
+                # Lease a warm server, its tool list was negotiated when it was spawned
+                async with session_pool.lease() as pooled:
+                    perception = None
+                    if pooled.tools_description == cached_description:
+                        perception = await perception_task
+                    elif perception_task is not None:
+                        # Made with other tools, agent_loop perceives the task again
+                        perception_task.cancel()
+                    action = await agent_loop(
+                        query,
+                        mem,
+                        session_id,
+                        decision,
+                        pooled.session,
+                        pooled.tools,
+                        pooled.tools_description,
+                        perception,
+                    )
+            finally:
+                if perception_task is not None and not perception_task.done():
+                    perception_task.cancel()
+            return mem, session_id, action
+
+        # Create a single MCP server connection
+        print("Establishing connection to MCP server...")
+        cached = tool_manifest.load(server_params)
+        async with stdio_client(server_params) as (read, write):
+            print("Connection established, creating session...")
+            async with ClientSession(read, write) as session:
+                tools, tools_description, perception = await perceive_while_connecting(
+                    query, cached, discover_tools(session)
+                )
+
+                action = await agent_loop(
+                    query,
+                    mem,
+                    session_id,
+                    decision,
+                    session,
+                    tools,
+                    tools_description,
+                    perception,
+                )
 
     except Exception as e:
         print(f"Error in main execution: {e}")
         import traceback
 
         traceback.print_exc()
+
+    return mem, session_id, action
+
+
+async def main(user_preferences):
+    print("Starting main execution...")
+    try:
+        await run_agent(default_query, user_preferences)
     finally:
-        pass
+        logger.info(f"LLM response cache: {response_cache.stats()}")
 
 
 if __name__ == "__main__":
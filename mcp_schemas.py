@@ -24,11 +24,21 @@ class FaceStockInput(BaseModel):
     feed_rate: float
 
 
+class TurningProfileStep(BaseModel):
+    diameter: float
+    length: float
+
+
 class DoTurningInput(BaseModel):
     start_diameter: float
     final_diameter: float
     length: float
     feed_rate: float
+    max_depth_of_cut: Optional[float] = None
+    finishing_allowance: float = 0.0
+    finishing_feed_rate: Optional[float] = None
+    profile: Optional[List[TurningProfileStep]] = None
+    canned_cycle: bool = False
 
 
 class RetractAndEndProgramInput(BaseModel):
@@ -37,7 +47,58 @@ class RetractAndEndProgramInput(BaseModel):
 
 
 class AddTextInPaintInput(BaseModel):
-    text: str
+    text: Optional[str] = None
+    program_id: Optional[str] = None
+
+
+class ProgramIdInput(BaseModel):
+    program_id: str = "current"
+
+
+class ProgramSection(BaseModel):
+    section: str
+    blocks: List[str]
+
+
+class AppendToProgramInput(BaseModel):
+    program_id: str = "current"
+    sections: List[ProgramSection]
+
+
+class AnnotateProgramInput(BaseModel):
+    program_id: str = "current"
+    index: int
+    comment: str
+
+
+class ReorderProgramInput(BaseModel):
+    program_id: str = "current"
+    order: List[int]
+
+
+class SimulateProgramInput(BaseModel):
+    program_id: str = "current"
+    gcode: Optional[List[str]] = None
+    stock_diameter: float
+    stock_length: float
+    max_depth_of_cut: float = 2.0
+    resolution: float = 0.1
+
+
+class MachineProfile(BaseModel):
+    rapid_rate_x: float = 10000
+    rapid_rate_z: float = 12000
+    max_spindle_speed: float = 4000
+    tool_change_time: float = 2.0
+    spindle_start_time: float = 1.5
+    home_x: float = 100
+    home_z: float = 100
+
+
+class EstimateCycleTimeInput(BaseModel):
+    program_id: str = "current"
+    gcode: Optional[List[str]] = None
+    machine: Optional[MachineProfile] = None
 
 
 class ShowReasoningInput(BaseModel):
@@ -53,6 +114,39 @@ class GCodeOutput(BaseModel):
     result: List[str]
 
 
+class ProgramOutput(BaseModel):
+    program_id: str
+    finalized: bool
+    result: List[str]
+
+
+class SimulationOutput(BaseModel):
+    final_diameter: float
+    min_diameter: float
+    final_length: float
+    removed_volume: float
+    rapid_through_material: List[str]
+    depth_of_cut_violations: List[str]
+    issues: List[str]
+    ok: bool
+
+
+class BlockTime(BaseModel):
+    line_number: int
+    block: str
+    kind: str
+    seconds: float
+
+
+class CycleTimeOutput(BaseModel):
+    total_seconds: float
+    cutting_seconds: float
+    rapid_seconds: float
+    overhead_seconds: float
+    blocks: List[BlockTime]
+    warnings: List[str]
+
+
 class TextContentOutput(BaseModel):
     result: List[dict]
 
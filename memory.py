@@ -1,4 +1,70 @@
 from collections import defaultdict
+from event_store import Event, EventStore
+from utils import estimate_tokens
+
+history_separator = "\n\n"
+
+
+class RenderedSession:
+    """
+    Incrementally maintained rendering of a session's history.
+
+    Entries are only ever appended to a session, so the view renders each entry once,
+    appends it to the joined text and keeps running totals of the rendered length and
+    token count. The recalled text, with the preferences before the history, is kept
+    until the next append or a change of the preferences.
+
+    Attributes:
+        segments (list): Rendered entries, oldest first
+        length (int): Length of the joined history text
+        tokens (int): Estimated number of tokens in the history
+        text (str): The history entries joined into one text
+    """
+
+    __slots__ = ("segments", "length", "tokens", "text", "_recalled")
+
+    def __init__(self) -> None:
+        self.segments = []
+        self.length = 0
+        self.tokens = 0
+        self.text = ""
+        self._recalled = None
+
+    def extend(self, entries: list[str]) -> None:
+        """
+        Render new entries and update the running totals.
+
+        Args:
+            entries (list): Entries appended to the session since the last update
+        """
+        if not entries:
+            return
+        joined = history_separator.join(entries)
+        if self.segments:
+            joined = history_separator + joined
+        # Only the local name refers to the text, so that CPython grows it in place
+        text = self.text
+        self.text = None
+        text += joined
+        self.text = text
+        self.segments.extend(entries)
+        self.length += len(joined)
+        self.tokens += sum(estimate_tokens(entry) for entry in entries)
+        self._recalled = None
+
+    def recalled(self, header: str) -> str:
+        """
+        Get the history under a header, rendering it again only after a change.
+
+        Args:
+            header (str): The preferences header
+
+        Returns:
+            str: The header, the history text and a final newline
+        """
+        if self._recalled is None or self._recalled[0] != header:
+            self._recalled = (header, f"{header}{self.text}\n")
+        return self._recalled[1]
 
 
 class Memory:
@@ -12,32 +78,130 @@ class Memory:
     3. Provides methods to store and recall information
     4. Supports the decision-making process with historical context
 
+    Every entry is recorded as a typed `Event`. With an `EventStore` the events are
+    persisted as they are stored and the sessions of earlier processes are loaded lazily,
+    the first time they are accessed. The prompt text in `session` is a view over the
+    events, and its rendering is kept up to date incrementally, so recalling only costs
+    work for the entries added since the previous recall.
+
     Attributes:
         preferences (list): List of user preferences
         session (defaultdict): Dictionary of session-specific information
+        events (dict): Typed events of every loaded session, aligned with `session`
+        event_store (EventStore | None): Persistent log of the events, None to keep them in memory only
     """
 
-    def __init__(self) -> None:
+    def __init__(self, event_store: EventStore | None = None) -> None:
         """
         Initialize the Memory class with empty preferences and session storage.
+
+        Args:
+            event_store (EventStore): Optional persistent log shared by any number of sessions
         """
         self.preferences = []
         self.session = defaultdict(lambda: [])
+        self.events = {}
+        self.event_store = event_store
+        self._rendered = {}
+
+    def _load(self, session_id: str) -> list[Event]:
+        """
+        Get the events of a session, loading them from the event store on first access.
+
+        Args:
+            session_id: Unique identifier for the session
+
+        Returns:
+            list: The events of the session
+        """
+        if session_id not in self.events:
+            events = self.event_store.load(session_id) if self.event_store else []
+            self.events[session_id] = events
+            if events:
+                self.session[session_id] = [event.text for event in events]
+        return self.events[session_id]
+
+    def new_session(self, session_id: str) -> None:
+        """
+        Create a session, resuming it if it was persisted by an earlier run.
 
-    def store(self, info: str, session_id: str):
+        Args:
+            session_id: Unique identifier for the session
+        """
+        self._load(session_id)
+        if session_id not in self.session:
+            self.session[session_id] = []
+
+    def store(self, info: str, session_id: str, kind: str = "note", **fields):
         """
         Store information in a specific session.
 
         Args:
             info: Information to be stored
             session_id: Unique identifier for the session
+            kind: What the entry records, e.g. "perception" or "tool_call"
+            **fields: Structured details of the entry, see `Event`
 
         Raises:
             Exception: If the session_id does not exist
         """
+        events = self._load(session_id)
         if not session_id in self.session:
             raise Exception("Requested to store an info in a non existing session")
+        event = Event(
+            session_id,
+            len(events),
+            kind,
+            info,
+            tokens=estimate_tokens(info),
+            **fields,
+        )
+        events.append(event)
         self.session[session_id].append(info)
+        if self.event_store is not None:
+            self.event_store.append(event)
+
+    def session_events(self, session_id: str) -> list[Event]:
+        """
+        Get the typed events of a specific session.
+
+        Args:
+            session_id: Unique identifier for the session
+
+        Returns:
+            list: The events of the session, oldest first
+        """
+        return list(self._load(session_id))
+
+    def _view(self, session_id: str) -> RenderedSession:
+        """
+        Bring the rendered view of a session up to date with its entries.
+
+        Only the entries appended since the last update are rendered. If the session was
+        truncated or its last rendered entry replaced, the view is rebuilt from scratch.
+
+        Args:
+            session_id: Unique identifier for the session
+
+        Returns:
+            RenderedSession: The up to date view
+        """
+        self._load(session_id)
+        entries = self.session[session_id]
+        view = self._rendered.get(session_id)
+        rendered = len(view.segments) if view else 0
+        if view is None or rendered > len(entries) or (
+            rendered and entries[rendered - 1] is not view.segments[-1]
+        ):
+            view = self._rendered[session_id] = RenderedSession()
+            rendered = 0
+        if rendered < len(entries):
+            view.extend(entries[rendered:])
+        return view
+
+    def _preferences_header(self) -> str:
+        prefs = "\n".join(self.preferences)
+        return f"User Preferences:\n{prefs}\nInteraction History:\n"
 
     def recall(self, session_id: str, include_preferences: bool = True) -> str:
         """
@@ -50,9 +214,52 @@ class Memory:
         Returns:
             str: Formatted string containing session history and preferences
         """
-        all_info = self.session[session_id]
-        all_info = "\n\n".join(all_info)
+        view = self._view(session_id)
         if include_preferences:
-            prefs = "\n".join(self.preferences)
-            all_info = f"User Preferences:\n{prefs}\nInteraction History:\n{all_info}\n"
-        return all_info
+            return view.recalled(self._preferences_header())
+        return view.text
+
+    def rendered_length(self, session_id: str, include_preferences: bool = True) -> int:
+        """
+        Get the length of what `recall` returns without rendering it.
+
+        Args:
+            session_id: Unique identifier for the session
+            include_preferences (bool): Whether to include user preferences
+
+        Returns:
+            int: Number of characters of the recalled text
+        """
+        length = self._view(session_id).length
+        if include_preferences:
+            length += len(self._preferences_header()) + 1
+        return length
+
+    def token_count(self, session_id: str, include_preferences: bool = True) -> int:
+        """
+        Get the estimated number of tokens of what `recall` returns without rendering it.
+
+        Args:
+            session_id: Unique identifier for the session
+            include_preferences (bool): Whether to include user preferences
+
+        Returns:
+            int: Estimated number of tokens of the recalled text
+        """
+        tokens = self._view(session_id).tokens
+        if include_preferences:
+            tokens += estimate_tokens(self._preferences_header())
+        return tokens
+
+    def turns(self, session_id: str) -> list[str]:
+        """
+        Get the interaction history of a specific session as separate turns.
+
+        Args:
+            session_id: Unique identifier for the session
+
+        Returns:
+            list: The stored entries of the session, oldest first. The list is the rendered
+            view itself, so it must not be modified
+        """
+        return self._view(session_id).segments
@@ -0,0 +1,138 @@
+import io
+import os
+import tempfile
+import textwrap
+from functools import lru_cache
+from uuid import uuid4
+from PIL import Image, ImageDraw, ImageFont
+
+# Monospace fonts tried in order, the first one found is used
+monospace_fonts = [
+    "DejaVuSansMono.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf",
+    "/System/Library/Fonts/Menlo.ttc",
+    "/Library/Fonts/Courier New.ttf",
+    "cour.ttf",
+]
+
+
+@lru_cache(maxsize=8)
+def load_monospace_font(size: int = 16) -> ImageFont.ImageFont:
+    """
+    Load a monospace font, falling back to the bitmap font bundled with Pillow.
+
+    Args:
+        size (int): Font size in points
+
+    Returns:
+        ImageFont: The font to draw with
+    """
+    for font in monospace_fonts:
+        try:
+            return ImageFont.truetype(font, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+def layout_pages(text: str, columns: int, lines_per_page: int) -> list[list[str]]:
+    """
+    Wrap the text to a fixed number of columns and split it into pages.
+
+    Args:
+        text (str): Text to lay out, e.g. a G-code program
+        columns (int): Maximum characters per line
+        lines_per_page (int): Maximum lines per page
+
+    Returns:
+        list: Pages, each a list of lines
+    """
+    lines = []
+    for line in text.splitlines() or [""]:
+        lines.extend(
+            textwrap.wrap(
+                line,
+                width=columns,
+                subsequent_indent="  ",
+                replace_whitespace=False,
+                drop_whitespace=False,
+            )
+            or [""]
+        )
+    return [
+        lines[start : start + lines_per_page]
+        for start in range(0, len(lines), lines_per_page)
+    ]
+
+
+def render_text_to_png(
+    text: str,
+    output_dir: str | None = None,
+    width: int = 800,
+    height: int = 600,
+    font_size: int = 16,
+    margin: int = 20,
+    return_bytes: bool = False,
+) -> list:
+    """
+    Rasterize text into one or more PNG pages without any display.
+
+    The text is drawn with a monospace font inside a rectangle, long lines are wrapped
+    and long programs are split into as many pages as needed.
+
+    Args:
+        text (str): Text to render
+        output_dir (str): Directory for the pages, the system temporary directory if not given
+        width (int): Page width in pixels
+        height (int): Page height in pixels
+        font_size (int): Font size in points
+        margin (int): Margin around the rectangle in pixels
+        return_bytes (bool): Return the PNG bytes of every page instead of the file paths
+
+    Returns:
+        list: The file path, or the PNG bytes, of every page
+    """
+    font = load_monospace_font(font_size)
+    left, top, right, bottom = font.getbbox("M")
+    char_width = max(1, right - left)
+    line_height = max(1, bottom - top) + font_size // 3
+    padding = margin // 2
+
+    text_width = width - 2 * (margin + padding)
+    text_height = height - 2 * (margin + padding)
+    pages = layout_pages(
+        text,
+        columns=max(1, text_width // char_width),
+        lines_per_page=max(1, text_height // line_height),
+    )
+
+    output_dir = output_dir or tempfile.gettempdir()
+    name = f"cnc_program_{uuid4().hex[:8]}"
+    outputs = []
+    for number, lines in enumerate(pages, start=1):
+        img = Image.new("RGB", (width, height), "white")
+        draw = ImageDraw.Draw(img)
+        draw.rectangle(
+            [margin, margin, width - margin, height - margin], outline="black", width=2
+        )
+        y = margin + padding
+        for line in lines:
+            draw.text((margin + padding, y), line, fill="black", font=font)
+            y += line_height
+        if len(pages) > 1:
+            draw.text(
+                (width - margin - 12 * char_width, height - margin + 2),
+                f"page {number}/{len(pages)}",
+                fill="gray",
+                font=font,
+            )
+
+        if return_bytes:
+            buffer = io.BytesIO()
+            img.save(buffer, format="PNG")
+            outputs.append(buffer.getvalue())
+        else:
+            path = os.path.join(output_dir, f"{name}_page{number}.png")
+            img.save(path)
+            outputs.append(path)
+    return outputs
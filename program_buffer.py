@@ -0,0 +1,167 @@
+from uuid import uuid4
+
+
+class ProgramBuffer:
+    """
+    A G-code program assembled on the server from the output of the tools.
+
+    Every block keeps its own comment, and blocks appended together form a section
+    named after the tool which produced them.
+
+    Attributes:
+        program_id (str): Unique identifier of the program
+        blocks (list): The G-code blocks in program order
+        comments (list): Comment of every block, aligned with `blocks`
+        sections (list): Section (producing tool) of every block, aligned with `blocks`
+        finalized (bool): Whether the program is complete and can no longer change
+    """
+
+    __slots__ = ("program_id", "blocks", "comments", "sections", "finalized")
+
+    def __init__(self, program_id: str) -> None:
+        self.program_id = program_id
+        self.blocks = []
+        self.comments = []
+        self.sections = []
+        self.finalized = False
+
+    def _check_open(self) -> None:
+        if self.finalized:
+            raise ValueError(f"Program {self.program_id} is finalized and cannot be changed")
+
+    def append(self, blocks: list[str], section: str) -> None:
+        """
+        Append blocks at the end of the program.
+
+        Args:
+            blocks (list): G-code blocks to append
+            section (str): Name of the section, usually the tool which produced the blocks
+        """
+        self._check_open()
+        self.blocks.extend(blocks)
+        self.comments.extend([""] * len(blocks))
+        self.sections.extend([section] * len(blocks))
+
+    def annotate(self, index: int, comment: str) -> None:
+        """
+        Set the comment of a block.
+
+        Args:
+            index (int): Position of the block, starting at 0
+            comment (str): Comment to attach to the block
+        """
+        self._check_open()
+        self.comments[index] = comment
+
+    def reorder(self, order: list[int]) -> None:
+        """
+        Reorder the blocks.
+
+        Args:
+            order (list): New order given as a permutation of the current block positions
+
+        Raises:
+            ValueError: If the order is not a permutation of the block positions
+        """
+        self._check_open()
+        if sorted(order) != list(range(len(self.blocks))):
+            raise ValueError(
+                f"The order must be a permutation of 0..{len(self.blocks) - 1}"
+            )
+        self.blocks = [self.blocks[i] for i in order]
+        self.comments = [self.comments[i] for i in order]
+        self.sections = [self.sections[i] for i in order]
+
+    def listing(self) -> list[str]:
+        """
+        Get the numbered blocks, for reviewing the program before editing it.
+
+        Returns:
+            list: One "index: block (comment)" line per block
+        """
+        return [
+            f"{i}: {block}" + (f" ({comment})" if comment else "")
+            for i, (block, comment) in enumerate(zip(self.blocks, self.comments))
+        ]
+
+    def render(self) -> list[str]:
+        """
+        Get the program text, with a comment line opening every section.
+
+        Returns:
+            list: The lines of the program
+        """
+        lines = []
+        previous = None
+        for block, comment, section in zip(self.blocks, self.comments, self.sections):
+            if section != previous:
+                lines.append(f"({section.replace('_', ' ').upper()})")
+                previous = section
+            lines.append(f"{block} ({comment})" if comment else block)
+        return lines
+
+
+class ProgramStore:
+    """
+    The ProgramStore class keeps the programs of every client connected to the server.
+
+    Each connection has a current program to which the G-code tools append automatically.
+    A new current program is started explicitly, or on the first append.
+
+    Attributes:
+        programs (dict): All the programs by id
+    """
+
+    def __init__(self) -> None:
+        self.programs = {}
+        self._current = {}
+
+    def start(self, owner) -> ProgramBuffer:
+        """
+        Start a new program and make it the current one of a connection.
+
+        Args:
+            owner: Key of the connection
+
+        Returns:
+            ProgramBuffer: The new, empty program
+        """
+        program = ProgramBuffer(uuid4().hex[:12])
+        self.programs[program.program_id] = program
+        self._current[owner] = program.program_id
+        return program
+
+    def current(self, owner) -> ProgramBuffer:
+        """
+        Get the current program of a connection, starting one if needed.
+
+        Args:
+            owner: Key of the connection
+
+        Returns:
+            ProgramBuffer: The current program
+        """
+        program_id = self._current.get(owner)
+        if program_id is None or self.programs[program_id].finalized:
+            return self.start(owner)
+        return self.programs[program_id]
+
+    def get(self, owner, program_id: str = "current") -> ProgramBuffer:
+        """
+        Get a program by id.
+
+        Args:
+            owner: Key of the connection, used to resolve "current"
+            program_id (str): Id of the program, or "current"
+
+        Returns:
+            ProgramBuffer: The program
+
+        Raises:
+            KeyError: If there is no such program
+        """
+        if program_id == "current":
+            program_id = self._current.get(owner)
+        if program_id not in self.programs:
+            raise KeyError(f"Unknown program: {program_id}")
+        return self.programs[program_id]
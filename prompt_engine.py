@@ -0,0 +1,137 @@
+import hashlib
+import json
+from typing import List
+from mcp import Tool
+from sub_prompts import *
+from utils import system_prompt, get_description_from_tools
+
+
+class PromptEngine:
+    """
+    The PromptEngine class builds the messages sent to the LLM in the decision step.
+
+    Instead of re-rendering the tool descriptions and all the instruction blocks into one
+    large user message on every iteration, the PromptEngine:
+    1. Builds the static system/tool prefix once per tool-set version and caches it
+    2. Emits every iteration as the same stable prefix followed by the appended turns only
+    3. Keeps the message list append-only so that provider-side prefix caching can kick in
+
+    Attributes:
+        persona (str): The persona placed at the top of the system message
+        plan_mode (bool): Whether the LLM is asked for a batch of tool calls per step
+        _prefix_cache (dict): Rendered static prefixes keyed on the tool-set version
+        _tool_set (tuple): The tools seen last and their version, so that the same tool
+            list is hashed only once
+    """
+
+    next_step_question = "What should I do next?"
+
+    def __init__(self, persona: str = system_prompt, plan_mode: bool = False) -> None:
+        """
+        Initialize the PromptEngine with an empty prefix cache.
+
+        Args:
+            persona (str): The persona placed at the top of the system message
+            plan_mode (bool): Ask for an ordered batch of tool calls instead of a single call
+        """
+        self.persona = persona
+        self.plan_mode = plan_mode
+        self._prefix_cache = {}
+        self._tool_set = ((), None)
+
+    @staticmethod
+    def tools_version(tools: List[Tool]) -> str:
+        """
+        Compute a stable version identifier for a set of tools.
+
+        Args:
+            tools (list): List of available tools
+
+        Returns:
+            str: A hex digest which changes whenever a tool is added, removed or redescribed
+        """
+        digest = hashlib.sha256()
+        for tool in tools:
+            digest.update(tool.name.encode())
+            digest.update(b"\0")
+            digest.update((tool.description or "").encode())
+            digest.update(b"\0")
+            digest.update(json.dumps(tool.inputSchema, sort_keys=True).encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def static_prefix(self, tools: List[Tool]) -> str:
+        """
+        Get the static instructions and tool descriptions for a set of tools.
+
+        The prefix is rendered only the first time a tool-set version is seen, and the
+        version is only computed again when the tools are not those of the previous call.
+
+        Args:
+            tools (list): List of available tools
+
+        Returns:
+            str: The static part of the decision prompt
+        """
+        seen, version = self._tool_set
+        if len(seen) != len(tools) or any(a is not b for a, b in zip(seen, tools)):
+            version = self.tools_version(tools)
+            self._tool_set = (tuple(tools), version)
+        if version not in self._prefix_cache:
+            tools_description = get_description_from_tools(tools)
+            response_instruction = (
+                decision_plan_response_instruction
+                if self.plan_mode
+                else decision_response_instruction
+            )
+            self._prefix_cache[version] = f"""
+{general_instructions}
+
+Here is a list of all the tools available at your disposal:
+{tools_description}
+
+{special_instructions}
+
+{fallback_handling}
+
+{response_instruction}
+"""
+        return self._prefix_cache[version]
+
+    def build_messages(
+        self,
+        tools: List[Tool],
+        query: str,
+        preferences: List[str],
+        turns: List[str],
+    ) -> List[dict]:
+        """
+        Build the chat messages for one decision step.
+
+        The first two messages (system prefix and the user's task) never change within a
+        session and every turn stored in memory is appended as its own message, so each
+        iteration only extends the previous request.
+
+        Args:
+            tools (list): List of available tools
+            query (str): The current task query
+            preferences (list): User preferences for the session
+            turns (list): Interaction history recorded so far, oldest first
+
+        Returns:
+            list: Messages ready to be sent to the chat completions API
+        """
+        prefs = "\n".join(preferences)
+        messages = [
+            {
+                "role": "system",
+                "content": f"{self.persona}\n{self.static_prefix(tools)}",
+            },
+            {
+                "role": "user",
+                "content": f"User Query:\n{query}\nUser Preferences:\n{prefs}",
+            },
+        ]
+        messages.extend({"role": "user", "content": turn} for turn in turns)
+        messages.append({"role": "user", "content": self.next_step_question})
+        return messages
@@ -0,0 +1,123 @@
+import asyncio
+import time
+
+
+class TokenBucketRateLimiter:
+    """
+    The TokenBucketRateLimiter class keeps LLM calls within the provider's quota.
+
+    The TokenBucketRateLimiter class:
+    1. Tracks two token buckets, one for requests per minute and one for tokens per minute
+    2. Lets a call through immediately while both buckets have capacity
+    3. Makes only the calls that would exceed the budget wait until enough capacity refills
+    4. Backs off adaptively when the provider still answers with a 429, honouring `Retry-After`
+
+    One limiter is meant to be shared by every agent of the process.
+
+    Attributes:
+        requests_per_minute (float): Request budget per minute
+        tokens_per_minute (float): Token budget per minute
+        max_backoff (float): Upper bound in seconds of the adaptive backoff
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        max_backoff: float = 60,
+    ) -> None:
+        """
+        Initialize the limiter with full buckets.
+
+        Args:
+            requests_per_minute (float): Request budget per minute
+            tokens_per_minute (float): Token budget per minute
+            max_backoff (float): Upper bound in seconds of the adaptive backoff
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_backoff = max_backoff
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._backoff = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(
+            self.requests_per_minute,
+            self._requests + elapsed * self.requests_per_minute / 60,
+        )
+        self._tokens = min(
+            self.tokens_per_minute,
+            self._tokens + elapsed * self.tokens_per_minute / 60,
+        )
+
+    async def acquire(self, tokens: int) -> float:
+        """
+        Wait until a call of the given size fits in the budget, then reserve it.
+
+        Waiting callers are served in arrival order.
+
+        Args:
+            tokens (int): Estimated number of tokens the call will consume
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        # A single call larger than the whole budget would otherwise wait forever
+        tokens = min(tokens, self.tokens_per_minute)
+        start = time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._blocked_until - now
+                if self._requests < 1:
+                    wait = max(wait, (1 - self._requests) * 60 / self.requests_per_minute)
+                if self._tokens < tokens:
+                    wait = max(wait, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+                if wait <= 0:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return time.monotonic() - start
+                await asyncio.sleep(wait)
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """
+        Correct the token bucket once the real usage of a call is known.
+
+        Args:
+            estimated_tokens (int): Tokens reserved by `acquire`
+            actual_tokens (int): Tokens reported by the provider
+        """
+        self._tokens = min(
+            self.tokens_per_minute, self._tokens + estimated_tokens - actual_tokens
+        )
+
+    def on_rate_limited(self, retry_after: float | None = None) -> float:
+        """
+        Block every caller after the provider rejected a call with a 429.
+
+        Without a `Retry-After` the pause doubles on every consecutive rejection.
+
+        Args:
+            retry_after (float | None): Seconds requested by the provider, if any
+
+        Returns:
+            float: Seconds for which calls are blocked
+        """
+        if retry_after is None:
+            self._backoff = min(self.max_backoff, max(1.0, self._backoff * 2))
+            retry_after = self._backoff
+        self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+        return retry_after
+
+    def on_success(self) -> None:
+        """
+        Reset the adaptive backoff after a call went through.
+        """
+        self._backoff = 0.0
@@ -0,0 +1,210 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from mcp import ClientSession, StdioServerParameters, Tool
+from mcp.client.stdio import stdio_client
+from tracing import tracer
+from utils import get_description_from_tools
+
+logger = logging.getLogger("session_pool")
+
+
+class PooledSession:
+    """
+    A warm MCP session owned by the pool.
+
+    The stdio connection and the session are entered and exited by one background task,
+    so that they can be leased to agent loops running in other tasks.
+
+    Attributes:
+        session (ClientSession): The initialized MCP session
+        tools (list): The tools of the server
+        tools_description (str): Prompt rendering of the tools
+        server_version (tuple): Name and version reported by the server
+        leases (int): Number of times the session was leased
+    """
+
+    __slots__ = (
+        "session",
+        "tools",
+        "tools_description",
+        "server_version",
+        "leases",
+        "_stop",
+        "_task",
+    )
+
+    def __init__(self) -> None:
+        self.session = None
+        self.tools = []
+        self.tools_description = ""
+        self.server_version = None
+        self.leases = 0
+        self._stop = asyncio.Event()
+        self._task = None
+
+
+class MCPSessionPool:
+    """
+    The MCPSessionPool class keeps warm MCP action servers alive and leases them to agent loops.
+
+    The MCPSessionPool class:
+    1. Spawns K server processes up front and initializes a session with each of them
+    2. Leases a session to one agent loop at a time and takes it back afterwards
+    3. Health-checks a session with a ping before leasing it and recycles dead or worn out ones
+    4. Caches the negotiated tool list and its description per server version, so a
+       recycled server skips `list_tools`
+
+    Attributes:
+        server_params (StdioServerParameters): How to spawn the action server
+        size (int): Number of warm sessions
+        max_leases (int): Leases after which a session is recycled
+        health_check_timeout (float): Seconds a ping may take before the session counts as dead
+        waiting (int): Number of agent loops currently waiting for a lease
+    """
+
+    def __init__(
+        self,
+        server_params: StdioServerParameters,
+        size: int = 2,
+        max_leases: int = 100,
+        health_check_timeout: float = 5,
+    ) -> None:
+        """
+        Initialize the pool. No server is spawned until `start` is awaited.
+
+        Args:
+            server_params (StdioServerParameters): How to spawn the action server
+            size (int): Number of warm sessions
+            max_leases (int): Leases after which a session is recycled
+            health_check_timeout (float): Seconds a ping may take before the session counts as dead
+        """
+        self.server_params = server_params
+        self.size = size
+        self.max_leases = max_leases
+        self.health_check_timeout = health_check_timeout
+        self.waiting = 0
+        self._idle = asyncio.Queue()
+        self._tools_cache = {}
+
+    async def start(self) -> None:
+        """
+        Spawn and initialize all the sessions of the pool concurrently.
+        """
+        sessions = await asyncio.gather(*(self._spawn() for _ in range(self.size)))
+        for pooled in sessions:
+            self._idle.put_nowait(pooled)
+
+    async def _spawn(self) -> PooledSession:
+        """
+        Start a server and wait until its session is ready.
+
+        Returns:
+            PooledSession: The ready session
+
+        Raises:
+            Exception: Whatever prevented the server from starting
+        """
+        pooled = PooledSession()
+        ready = asyncio.get_running_loop().create_future()
+        pooled._task = asyncio.create_task(self._serve(pooled, ready))
+        await ready
+        return pooled
+
+    async def _serve(self, pooled: PooledSession, ready: asyncio.Future) -> None:
+        try:
+            async with stdio_client(self.server_params) as (read, write):
+                async with ClientSession(read, write) as session:
+                    init = await session.initialize()
+                    pooled.server_version = (
+                        init.serverInfo.name,
+                        init.serverInfo.version,
+                        self.server_params.command,
+                        tuple(self.server_params.args),
+                    )
+                    if pooled.server_version not in self._tools_cache:
+                        tools = (await session.list_tools()).tools
+                        self._tools_cache[pooled.server_version] = (
+                            tools,
+                            get_description_from_tools(tools),
+                        )
+                    pooled.tools, pooled.tools_description = self._tools_cache[
+                        pooled.server_version
+                    ]
+                    pooled.session = session
+                    ready.set_result(pooled)
+                    await pooled._stop.wait()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            else:
+                logger.warning(f"Pooled MCP session terminated: {e}")
+
+    async def _stop_session(self, pooled: PooledSession) -> None:
+        pooled._stop.set()
+        await asyncio.gather(pooled._task, return_exceptions=True)
+
+    async def _healthy(self, pooled: PooledSession) -> bool:
+        if pooled._task.done():
+            return False
+        try:
+            await asyncio.wait_for(
+                pooled.session.send_ping(), timeout=self.health_check_timeout
+            )
+            return True
+        except Exception:
+            return False
+
+    @asynccontextmanager
+    async def lease(self):
+        """
+        Lease a healthy session for the duration of the context.
+
+        Yields:
+            PooledSession: The leased session with its cached tools
+        """
+        self.waiting += 1
+        try:
+            with tracer.span("pool.lease_wait", waiting=self.waiting):
+                pooled = await self._idle.get()
+        finally:
+            self.waiting -= 1
+
+        try:
+            if pooled.leases >= self.max_leases or not await self._healthy(pooled):
+                logger.info("Recycling a pooled MCP session")
+                await self._stop_session(pooled)
+                pooled = await self._spawn()
+        except BaseException:
+            # Keep the pool at its size even if the replacement could not be spawned
+            self._idle.put_nowait(pooled)
+            raise
+
+        pooled.leases += 1
+        try:
+            yield pooled
+        finally:
+            self._idle.put_nowait(pooled)
+
+    @property
+    def busy(self) -> int:
+        """Number of sessions currently leased"""
+        return self.size - self._idle.qsize()
+
+    def tools_description(self) -> str | None:
+        """
+        Get the cached description of the server tools without leasing a session.
+
+        Returns:
+            str | None: The description, None before any server was started
+        """
+        for _, description in self._tools_cache.values():
+            return description
+        return None
+
+    async def close(self) -> None:
+        """
+        Stop every idle session of the pool.
+        """
+        while not self._idle.empty():
+            await self._stop_session(self._idle.get_nowait())
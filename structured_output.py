@@ -0,0 +1,460 @@
+import ast
+import copy
+import difflib
+import json
+import re
+from hashlib import sha256
+from utils import FunctionCall, FunctionName
+
+# Keys which the model sometimes uses instead of the expected ones
+key_aliases = {
+    "tool_name": ("tool", "function", "function_name", "name", "tool_call"),
+    "arguments": ("args", "parameters", "params", "input_arguments"),
+    "calls": ("tool_calls", "plan", "steps", "actions"),
+}
+# How close a misspelt tool name must be to a real one to be corrected
+tool_name_cutoff = 0.75
+
+
+def _resolve(schema: dict, defs: dict) -> dict:
+    """Inline the $ref of a schema, so that every variant is self-contained"""
+    if isinstance(schema, dict):
+        if "$ref" in schema:
+            return _resolve(defs[schema["$ref"].split("/")[-1]], defs)
+        return {k: _resolve(v, defs) for k, v in schema.items() if k != "$defs"}
+    if isinstance(schema, list):
+        return [_resolve(item, defs) for item in schema]
+    return schema
+
+
+def strict_schema(schema: dict) -> dict:
+    """
+    Turn a JSON schema into one accepted by strict structured outputs.
+
+    Every object lists all its properties as required and forbids other properties,
+    optional properties become nullable instead, and the keywords strict mode rejects
+    (defaults and titles) are dropped.
+
+    Args:
+        schema (dict): JSON schema, e.g. the input schema of an MCP tool
+
+    Returns:
+        dict: The strict schema, with its references inlined
+    """
+    schema = _resolve(copy.deepcopy(schema), schema.get("$defs", {}))
+
+    def visit(node):
+        if isinstance(node, list):
+            return [visit(item) for item in node]
+        if not isinstance(node, dict):
+            return node
+        node = {k: visit(v) for k, v in node.items() if k not in ("default", "title")}
+        if node.get("type") == "object":
+            properties = node.setdefault("properties", {})
+            required = set(node.get("required", []))
+            for name, value in properties.items():
+                if name not in required and not _nullable(value):
+                    properties[name] = {"anyOf": [value, {"type": "null"}]}
+            node["required"] = list(properties)
+            node["additionalProperties"] = False
+        return node
+
+    return visit(schema)
+
+
+def _nullable(schema: dict) -> bool:
+    return schema.get("type") == "null" or any(
+        option.get("type") == "null" for option in schema.get("anyOf", [])
+    )
+
+
+class StructuredOutput:
+    """
+    The StructuredOutput class makes the decisions of the LLM parse as FunctionCall objects.
+
+    The StructuredOutput class:
+    1. Derives a strict JSON schema from FunctionCall and the input schema of every tool,
+       which pins the arguments of each tool name, for backends which constrain decoding
+    2. Repairs malformed replies locally: it extracts the JSON, coerces the shape and the
+       aliases of the keys, fuzzy-matches misspelt tool names and normalizes the arguments
+       against the tool schemas, e.g. wrapping them in "input"
+    3. Counts the replies which were valid, repaired or rejected, and the retries they cost
+
+    Attributes:
+        stats (dict): Number of valid, repaired and rejected replies and of retried decisions
+    """
+
+    def __init__(self) -> None:
+        self.stats = {"valid": 0, "repaired": 0, "rejected": 0, "retried": 0}
+        self._formats = {}
+
+    def response_format(self, tools, plan_mode: bool = False, calls_first: bool = False) -> dict:
+        """
+        Get the response format constraining the decisions to valid tool calls.
+
+        It is built once per tool set, as the schema must not change between calls for
+        the provider to reuse its compiled grammar.
+
+        Args:
+            tools (list): Tools available to the agent
+            plan_mode (bool): Whether a decision is a batch of calls rather than a single call
+            calls_first (bool): Whether the calls come before the prose, for streamed decisions
+
+        Returns:
+            dict: A json_schema response format
+        """
+        key = (
+            sha256(
+                json.dumps(
+                    [(t.name, t.inputSchema) for t in tools], sort_keys=True
+                ).encode()
+            ).hexdigest(),
+            plan_mode,
+            calls_first,
+        )
+        if key not in self._formats:
+            self._formats[key] = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "function_call",
+                    "strict": True,
+                    "schema": self.decision_schema(tools, plan_mode, calls_first),
+                },
+            }
+        return self._formats[key]
+
+    @staticmethod
+    def decision_schema(tools, plan_mode: bool = False, calls_first: bool = False) -> dict:
+        """
+        Derive the strict JSON schema of a decision.
+
+        Constrained decoding generates the properties in the order of the schema, so with
+        `calls_first` the calls are complete before the model writes its prose.
+
+        Args:
+            tools (list): Tools available to the agent
+            plan_mode (bool): Whether a decision is a batch of calls rather than a single call
+            calls_first (bool): Whether the calls come before the prose
+
+        Returns:
+            dict: The schema, one variant of tool call per tool known to FunctionName
+        """
+        fields = FunctionCall.model_json_schema()["properties"]
+        known = {f.value for f in FunctionName}
+        variants = [
+            {
+                "type": "object",
+                "properties": {
+                    "tool_name": {"type": "string", "enum": [tool.name]},
+                    "arguments": strict_schema(tool.inputSchema),
+                },
+                "required": ["tool_name", "arguments"],
+                "additionalProperties": False,
+            }
+            for tool in tools
+            if tool.name in known
+        ]
+        variants.append(
+            {
+                "type": "object",
+                "properties": {
+                    "tool_name": {"type": "string", "enum": [FunctionName.FINAL_ANSWER.value]},
+                    "arguments": {
+                        "type": "object",
+                        "properties": {"answer": {"type": "string"}},
+                        "required": ["answer"],
+                        "additionalProperties": False,
+                    },
+                },
+                "required": ["tool_name", "arguments"],
+                "additionalProperties": False,
+            }
+        )
+
+        properties = {
+            "what_was_done_in_previous_step": {
+                "type": "string",
+                "description": fields["what_was_done_in_previous_step"]["description"],
+            },
+            "what_needs_to_be_done_next": {
+                "type": "string",
+                "description": fields["what_needs_to_be_done_next"]["description"],
+            },
+        }
+        if plan_mode:
+            properties["calls"] = {
+                "type": "array",
+                "description": fields["calls"]["description"],
+                "items": {"anyOf": variants},
+            }
+            properties["independent"] = {
+                "type": "boolean",
+                "description": fields["independent"]["description"],
+            }
+        else:
+            properties["call"] = {"anyOf": variants}
+        if calls_first:
+            # "independent" first, so that a batch is fully determined when its calls close
+            prose = ("what_was_done_in_previous_step", "what_needs_to_be_done_next")
+            properties = {
+                **{k: v for k, v in reversed(properties.items()) if k not in prose},
+                **{k: properties[k] for k in prose},
+            }
+        return {
+            "type": "object",
+            "properties": properties,
+            "required": list(properties),
+            "additionalProperties": False,
+        }
+
+    def parse(self, text: str, tools) -> FunctionCall:
+        """
+        Parse a decision, repairing it locally if it is not valid as is.
+
+        Args:
+            text (str): The reply of the LLM
+            tools (list): Tools available to the agent, for normalizing the arguments
+
+        Returns:
+            FunctionCall: The decision
+
+        Raises:
+            ValueError: If the reply cannot be repaired, with the reason to send back to the LLM
+        """
+        schemas = {tool.name: tool.inputSchema for tool in tools}
+        try:
+            data = json.loads(text)
+            # The strict schema nests the single call under "call"
+            if isinstance(data, dict) and isinstance(data.get("call"), dict):
+                data.update(data.pop("call"))
+            function_call = FunctionCall.model_validate(data)
+            self.stats["valid"] += 1
+        except ValueError as e:
+            error = e
+            try:
+                function_call = FunctionCall.model_validate(self.repair(text, tools))
+            except (ValueError, SyntaxError) as e:
+                self.stats["rejected"] += 1
+                raise ValueError(f"{error}\nThe local repair failed too: {e}") from e
+            self.stats["repaired"] += 1
+
+        return self._normalize(function_call, schemas)
+
+    def validate_fields(self, fields: dict, tools) -> FunctionCall:
+        """
+        Validate the call fields of a decision before its prose is known, e.g. while streaming.
+
+        No repair is attempted and the statistics are left to the parse of the whole reply.
+
+        Args:
+            fields (dict): The call fields, "calls" and "independent", "call", or "tool_name"
+                and "arguments"
+            tools (list): Tools available to the agent, for normalizing the arguments
+
+        Returns:
+            FunctionCall: The decision, with empty prose
+
+        Raises:
+            ValueError: If the fields do not make a valid decision
+        """
+        data = {
+            "what_was_done_in_previous_step": "",
+            "what_needs_to_be_done_next": "",
+            **fields,
+        }
+        if isinstance(data.get("call"), dict):
+            data.update(data.pop("call"))
+        function_call = FunctionCall.model_validate(data)
+        return self._normalize(function_call, {tool.name: tool.inputSchema for tool in tools})
+
+    @staticmethod
+    def _normalize(function_call: FunctionCall, schemas: dict) -> FunctionCall:
+        # Constrained replies fill the optional arguments with nulls, drop them for the defaults
+        for call in function_call.calls or [function_call]:
+            if call.tool_name is not None and call.tool_name.value in schemas:
+                call.arguments = normalize_arguments(
+                    call.arguments or {}, schemas[call.tool_name.value]
+                )
+        return function_call
+
+    def repair(self, text: str, tools) -> dict:
+        """
+        Repair a malformed decision into the shape of a FunctionCall.
+
+        Args:
+            text (str): The reply of the LLM
+            tools (list): Tools available to the agent
+
+        Returns:
+            dict: The repaired decision, still to be validated
+
+        Raises:
+            ValueError: If no JSON object can be recovered from the reply
+        """
+        data = extract_json(text)
+        if isinstance(data, list):
+            data = {"calls": data}
+        if not isinstance(data, dict):
+            raise ValueError("The reply is not a JSON object")
+        data = _rename_aliases(data)
+
+        # The strict schema nests the single call under "call"
+        if isinstance(data.get("call"), dict):
+            data.update(_rename_aliases(data.pop("call")))
+        data.setdefault("what_was_done_in_previous_step", "")
+        data.setdefault("what_needs_to_be_done_next", "")
+        if isinstance(data.get("independent"), str):
+            data["independent"] = data["independent"].strip().lower() == "true"
+
+        schemas = {tool.name: tool.inputSchema for tool in tools}
+        if data.get("calls"):
+            data["calls"] = [
+                self._repair_call(_rename_aliases(call), schemas)
+                for call in data["calls"]
+                if isinstance(call, dict)
+            ]
+        if data.get("tool_name") is not None:
+            data.update(self._repair_call(data, schemas))
+        return data
+
+    def _repair_call(self, call: dict, schemas: dict) -> dict:
+        """Fix the tool name and the arguments of one call"""
+        name = match_tool_name(call.get("tool_name"))
+        arguments = call.get("arguments")
+        if isinstance(arguments, str):
+            try:
+                arguments = extract_json(arguments)
+            except ValueError:
+                arguments = {"answer": arguments} if name == FunctionName.FINAL_ANSWER.value else {}
+        if name in schemas:
+            arguments = normalize_arguments(arguments or {}, schemas[name])
+        return {"tool_name": name, "arguments": arguments}
+
+
+def extract_json(text: str):
+    """
+    Recover the JSON value of a reply wrapped in prose or code fences, or written with
+    trailing commas, single quotes or Python literals.
+
+    Args:
+        text (str): The reply
+
+    Returns:
+        The decoded value
+
+    Raises:
+        ValueError: If no JSON value can be recovered
+    """
+    text = re.sub(r"```(?:json)?", "", text).strip()
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        raise ValueError("No JSON object found in the reply")
+    start = min(starts)
+    end = text.rfind("}" if text[start] == "{" else "]")
+    candidate = text[start : end + 1]
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        pass
+    candidate = re.sub(r",\s*([}\]])", r"\1", candidate)
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        pass
+    python_literal = re.sub(
+        r"\b(true|false|null)\b",
+        lambda m: {"true": "True", "false": "False", "null": "None"}[m.group(1)],
+        candidate,
+    )
+    try:
+        return ast.literal_eval(python_literal)
+    except (ValueError, SyntaxError) as e:
+        raise ValueError(f"The reply is not valid JSON: {e}") from e
+
+
+def _rename_aliases(data: dict) -> dict:
+    data = dict(data)
+    for key, aliases in key_aliases.items():
+        if key not in data:
+            for alias in aliases:
+                if alias in data:
+                    data[key] = data.pop(alias)
+                    break
+    return data
+
+
+def match_tool_name(name):
+    """
+    Match a possibly misspelt tool name to a FunctionName value.
+
+    The enum member names (e.g. PERFORM_UNIFORM_TURNING) are accepted as well.
+
+    Args:
+        name: The tool name given by the LLM
+
+    Returns:
+        The value of the matching FunctionName, or the name unchanged if none is close enough
+    """
+    if not isinstance(name, str):
+        return name
+    normalized = re.sub(r"[\s\-]+", "_", name.strip().strip("()")).lower()
+    candidates = {f.value: f.value for f in FunctionName}
+    candidates.update({f.name.lower(): f.value for f in FunctionName})
+    if normalized in candidates:
+        return candidates[normalized]
+    close = difflib.get_close_matches(normalized, list(candidates), n=1, cutoff=tool_name_cutoff)
+    return candidates[close[0]] if close else name
+
+
+def normalize_arguments(arguments: dict, schema: dict) -> dict:
+    """
+    Fit the arguments of a call to the input schema of its tool.
+
+    Arguments given flat are wrapped in the single "input" object the tools expect,
+    numbers given as strings are converted and null optional values are dropped so
+    that their defaults apply.
+
+    Args:
+        arguments (dict): Arguments given by the LLM
+        schema (dict): Input schema of the tool
+
+    Returns:
+        dict: The normalized arguments
+    """
+    defs = schema.get("$defs", {})
+    properties = schema.get("properties", {})
+    if (
+        list(properties) == ["input"]
+        and "input" not in arguments
+        and arguments
+    ):
+        arguments = {"input": arguments}
+    return _coerce(arguments, _resolve(schema, defs), defs)
+
+
+def _coerce(value, schema: dict, defs: dict):
+    schema = _resolve(schema, defs)
+    if "anyOf" in schema and value is not None:
+        options = [o for o in schema["anyOf"] if o.get("type") != "null"]
+        if len(options) == 1:
+            schema = _resolve(options[0], defs)
+    kind = schema.get("type")
+    if kind == "object" and isinstance(value, dict):
+        properties = schema.get("properties", {})
+        required = set(schema.get("required", []))
+        return {
+            key: _coerce(item, properties.get(key, {}), defs)
+            for key, item in value.items()
+            if not (item is None and key not in required)
+        }
+    if kind == "array" and isinstance(value, list):
+        return [_coerce(item, schema.get("items", {}), defs) for item in value]
+    if kind in ("number", "integer") and isinstance(value, str):
+        try:
+            number = float(value.strip())
+        except ValueError:
+            return value
+        return int(number) if kind == "integer" and number.is_integer() else number
+    if kind == "string" and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return value
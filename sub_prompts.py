@@ -1,5 +1,9 @@
 import json
-from utils import decision_response_dict, perception_response_dict
+from utils import (
+    decision_response_dict,
+    decision_plan_response_dict,
+    perception_response_dict,
+)
 
 general_instructions = """
 GENERAL INSTRUCTIONS:
@@ -9,7 +13,7 @@ You can reason, you are capable of planning and thinking step by step.
 For any given problem, you first identify the problem, break it down into smaller steps, come up with a plan and then execute the plan only ONE STEP AT A TIME.
 You can reason in multiple ways. Since you are good at CNC operations, you can use different modes of reasoning like spatial (Understading geometry, understanding the spatial relationships between the parts), algorithmic (sequence of operations, mixing and matching operations to perform complex tasks etc.), optimization (which code is more efficient, would lead to less wastage and give best results both from the life of tool, quality of the part, convenience of the operator etc.), safety (safety of the operator, safety of the machine, safety of the part etc.), other (Any miscellaneous thought or reasoning that you may think and feel is relevant). It will help you to first identify the kind of reasoning you would like to use (one or multiple) before coming up with the plan. 
 You have access to various tools to perform different operations on the CNC machine. 
-Additionally, you also have access to a paint tool. Use it like a notepad. Gather all the commands obtained from the iterations and stitch them together to form a comprehensive program that can be run on the CNC machine. This is what the paint tool needs to show to the user i.e. the final program. Do not forget to add comments to the program to make it understandable to the user.
+Additionally, you also have access to a paint tool. The G-code returned by the tools is collected automatically, in call order, into a program on the server; you do not need to stitch it together yourself. Use `get_program` to review the numbered blocks, `annotate_program` to add comments that make the program understandable to the user, `reorder_program` if a block is out of place and `finalize_program` once it is complete. Then show the final program in the paint tool by calling it with the `program_id` instead of re-sending the text.
 """
 
 special_instructions = """
@@ -22,6 +26,9 @@ SPECIAL INSTRUCTIONS:
 - If you are asked to display the answer in a paint tool, you must first use the paint tool and do that before giving out the final answer.
 - For any given problem, ALWAYS THINK ALL THE STEPS THROUGH in the first pass and display the reasoning to the user.
 - After each arithmetic operation that you perform, you MUST VERIFY if the last performed step is correct or not. This function can be called multiple times. Just don't call it in succession. Call if after every arithmetic operation. IFF the verification is dubious or can be interpreted in different ways, you are allowed to call it in succession.
+- When calling `do_turning`, always pass a `max_depth_of_cut` (e.g. 2 mm radial) so that the stock is removed in several roughing passes instead of one plunge, and a `finishing_allowance` (e.g. 0.2 mm) when a finishing pass is wanted.
+- To check the geometry of the G-code program (final diameter and length, rapid moves through the stock, depth of each cut), call `simulate_program` with the stock dimensions instead of `verify_step`. It simulates the program collected on the server and reports every issue with the number of the block to fix.
+- When you hesitate between two ways of writing a step (e.g. the depth of cut or the feed of `do_turning`), compare them with `estimate_cycle_time` on their `gcode` and keep the faster one which passes `simulate_program`.
 """
 
 fallback_handling = """
@@ -41,6 +48,16 @@ You must respond with a json object which abides to the following schema:
 Please note that the argument dict in the above schema MUST contain the necessary arguments of the tool call which is provided in the list of tools available at your disposal above.
 """
 
+decision_plan_response_instruction = f"""
+You must respond with a json object which abides to the following schema:
+```json
+{json.dumps(decision_plan_response_dict, indent=2)}
+```
+
+`calls` is an ordered batch of tool calls which are executed one after the other in a single step. Put every call whose arguments you already know into the batch, e.g. all the G-code steps of the program, instead of spending one step per call. If a call fails, the rest of the batch is skipped and you get to decide again.
+Please note that the argument dict of every call MUST contain the necessary arguments of the tool call which is provided in the list of tools available at your disposal above.
+"""
+
 perception_response_instruction = f"""
 You must respond with a json object which abides to the following schema:
 ```json
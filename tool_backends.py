@@ -0,0 +1,147 @@
+import importlib
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+
+class StartupProfiler:
+    """
+    The StartupProfiler class measures the cold start of the MCP action server.
+
+    The StartupProfiler class:
+    1. Times each named startup phase, e.g. the import of a module
+    2. Times the lazy imports of the tool backends when they happen
+    3. Records the time from the start of the server module to the first `list_tools`
+    4. Warns on stderr when the time to the first `list_tools` exceeds the budget
+
+    Attributes:
+        budget_ms (float): Cold start budget in milliseconds
+        phases (dict): Duration in milliseconds of every startup phase
+        lazy_imports (dict): Duration in milliseconds of every lazily imported backend module
+        first_list_tools_ms (float | None): Time from start to the first `list_tools`
+    """
+
+    def __init__(self, budget_ms: float = 1500) -> None:
+        """
+        Start the clock.
+
+        Args:
+            budget_ms (float): Cold start budget in milliseconds
+        """
+        self.budget_ms = budget_ms
+        self.phases = {}
+        self.lazy_imports = {}
+        self.first_list_tools_ms = None
+        self._start = time.perf_counter()
+
+    def elapsed_ms(self) -> float:
+        """Milliseconds since the profiler was created"""
+        return (time.perf_counter() - self._start) * 1000
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Time a startup phase.
+
+        Args:
+            name (str): Name under which the duration is reported
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round((time.perf_counter() - start) * 1000, 3)
+
+    def mark_list_tools(self) -> None:
+        """
+        Record the first `list_tools` and check the budget.
+        """
+        if self.first_list_tools_ms is not None:
+            return
+        self.first_list_tools_ms = round(self.elapsed_ms(), 3)
+        if self.first_list_tools_ms > self.budget_ms:
+            print(
+                f"Server cold start took {self.first_list_tools_ms} ms, over the budget of "
+                f"{self.budget_ms} ms: {json.dumps(self.phases)}",
+                file=sys.stderr,
+            )
+
+    def report(self) -> dict:
+        """
+        Get the startup report.
+
+        Returns:
+            dict: Phase and lazy import durations, time to first `list_tools` and the budget
+        """
+        return {
+            "phases_ms": dict(self.phases),
+            "lazy_imports_ms": dict(self.lazy_imports),
+            "first_list_tools_ms": self.first_list_tools_ms,
+            "budget_ms": self.budget_ms,
+            "within_budget": self.first_list_tools_ms is None
+            or self.first_list_tools_ms <= self.budget_ms,
+        }
+
+
+class BackendRegistry:
+    """
+    The BackendRegistry class declares the backends of the tools without importing them.
+
+    A backend is registered as a "module:attribute" target and its module is imported
+    the first time the backend is requested, so heavy or display-bound dependencies
+    (e.g. pyautogui) cost nothing for servers which never call the tools using them.
+
+    Attributes:
+        profiler (StartupProfiler | None): Profiler recording the lazy import times
+    """
+
+    def __init__(self, profiler: StartupProfiler | None = None) -> None:
+        """
+        Initialize an empty registry.
+
+        Args:
+            profiler (StartupProfiler): Profiler recording the lazy import times
+        """
+        self.profiler = profiler
+        self._targets = {}
+        self._loaded = {}
+
+    def register(self, name: str, target: str) -> None:
+        """
+        Declare a backend.
+
+        Args:
+            name (str): Name of the backend
+            target (str): Where the backend lives, as "module:attribute"
+        """
+        self._targets[name] = target
+        self._loaded.pop(name, None)
+
+    def names(self) -> list[str]:
+        """Names of the registered backends"""
+        return list(self._targets)
+
+    def get(self, name: str):
+        """
+        Get a backend, importing its module on first use.
+
+        Args:
+            name (str): Name of the backend
+
+        Returns:
+            The backend object, usually a function
+
+        Raises:
+            KeyError: If no backend was registered under that name
+        """
+        if name not in self._loaded:
+            module_name, attribute = self._targets[name].split(":")
+            start = time.perf_counter()
+            module = importlib.import_module(module_name)
+            if self.profiler is not None and module_name not in self.profiler.lazy_imports:
+                self.profiler.lazy_imports[module_name] = round(
+                    (time.perf_counter() - start) * 1000, 3
+                )
+            self._loaded[name] = getattr(module, attribute)
+        return self._loaded[name]
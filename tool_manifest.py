@@ -0,0 +1,119 @@
+import json
+import os
+from hashlib import sha256
+from mcp import StdioServerParameters, Tool
+
+
+class ToolManifest:
+    """
+    The ToolManifest class remembers the tools of the action server between runs.
+
+    The tool list only changes with the server code, so a run can build its prompts from
+    the manifest of the previous run while the server is still starting, and check the
+    manifest against the live tool list once the server is up.
+
+    The ToolManifest class:
+    1. Fingerprints a server from its command, its arguments and its script file
+    2. Stores the tools and their prompt description per fingerprint in a JSON file
+    3. Reconciles a stored manifest with the live tools, replacing it when they drifted
+
+    Attributes:
+        path (str): Path of the JSON manifest file
+    """
+
+    def __init__(self, path: str = ".tool_manifest.json") -> None:
+        """
+        Initialize the manifest, loading the file if it exists.
+
+        Args:
+            path (str): Path of the JSON manifest file
+        """
+        self.path = path
+        try:
+            with open(path) as file:
+                self._entries = json.load(file)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    @staticmethod
+    def fingerprint(server_params: StdioServerParameters) -> str:
+        """
+        Identify a server version without starting it.
+
+        Args:
+            server_params (StdioServerParameters): How the server is spawned
+
+        Returns:
+            str: Hash of the command, the arguments and the size and modification time
+            of the arguments which are files, e.g. the server script
+        """
+        parts = [server_params.command, *server_params.args]
+        for arg in server_params.args:
+            path = os.path.join(str(server_params.cwd or ""), arg)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                parts.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+        return sha256("\0".join(parts).encode()).hexdigest()[:16]
+
+    def load(self, server_params: StdioServerParameters) -> tuple | None:
+        """
+        Get the tools stored for a server.
+
+        Args:
+            server_params (StdioServerParameters): How the server is spawned
+
+        Returns:
+            tuple | None: The tools and their description, None if the server is unknown
+        """
+        entry = self._entries.get(self.fingerprint(server_params))
+        if entry is None:
+            return None
+        try:
+            tools = [Tool.model_validate(tool) for tool in entry["tools"]]
+        except ValueError:
+            return None
+        return tools, entry["description"]
+
+    def save(self, server_params: StdioServerParameters, tools: list, description: str) -> None:
+        """
+        Store the tools of a server.
+
+        Args:
+            server_params (StdioServerParameters): How the server is spawned
+            tools (list): The live tools of the server
+            description (str): Prompt rendering of the tools
+        """
+        self._entries[self.fingerprint(server_params)] = {
+            "tools": [tool.model_dump(mode="json") for tool in tools],
+            "description": description,
+        }
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(self._entries, file)
+        os.replace(temporary, self.path)
+
+    def reconcile(
+        self,
+        server_params: StdioServerParameters,
+        cached: tuple | None,
+        tools: list,
+        description: str,
+    ) -> bool:
+        """
+        Check a stored manifest against the live tools, storing the live ones if they differ.
+
+        Args:
+            server_params (StdioServerParameters): How the server is spawned
+            cached (tuple | None): The tools and description loaded before the server started
+            tools (list): The live tools of the server
+            description (str): Prompt rendering of the live tools
+
+        Returns:
+            bool: True if the manifest matched, so that prompts built from it are still valid
+        """
+        if cached is not None and cached[1] == description and [
+            tool.model_dump(mode="json") for tool in cached[0]
+        ] == [tool.model_dump(mode="json") for tool in tools]:
+            return True
+        self.save(server_params, tools, description)
+        return False
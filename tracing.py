@@ -0,0 +1,307 @@
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from uuid import uuid4
+
+# Span in which new spans are opened, per asyncio task
+_current_span = ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    One timed phase of a run, e.g. a decision or a tool call.
+
+    Attributes:
+        name (str): Name of the phase, spans of the same name are summarized together
+        trace_id (str): Id shared by a span and all its descendants
+        span_id (str): Id of the span
+        parent_id (str | None): Id of the enclosing span
+        attributes (dict): Measurements of the phase, e.g. token counts or byte sizes
+        start (float): Wall clock start time
+        duration_ms (float | None): Duration once the span is closed
+    """
+
+    __slots__ = (
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "attributes",
+        "start",
+        "duration_ms",
+        "_perf_start",
+        "_token",
+    )
+
+    def __init__(self, name: str, parent, attributes: dict) -> None:
+        self.name = name
+        self.span_id = uuid4().hex[:16]
+        self.trace_id = parent.trace_id if parent is not None else uuid4().hex
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration_ms = None
+        self._perf_start = time.perf_counter()
+        self._token = None
+
+    def set(self, **attributes) -> None:
+        """Record measurements on the span"""
+        self.attributes.update(attributes)
+
+    def record(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """Span handed out when tracing is disabled, it records nothing"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes) -> None:
+        pass
+
+
+_noop_span = _NoopSpan()
+
+
+class _SpanContext:
+    __slots__ = ("tracer", "span", "detached")
+
+    def __init__(self, tracer, span: Span, detached: bool = False) -> None:
+        self.tracer = tracer
+        self.span = span
+        self.detached = detached
+
+    def __enter__(self) -> Span:
+        if not self.detached:
+            self.span._token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        span = self.span
+        span.duration_ms = round((time.perf_counter() - span._perf_start) * 1000, 3)
+        if exc_type is not None:
+            span.attributes["error"] = exc_type.__name__
+        if span._token is not None:
+            _current_span.reset(span._token)
+        self.tracer._finish(span)
+        return False
+
+
+class Tracer:
+    """
+    The Tracer class records where the time of a run goes.
+
+    The Tracer class:
+    1. Opens nested spans around the phases of the agent loop, following asyncio tasks
+    2. Exports every closed span as one JSON line to a local file
+    3. Summarizes the durations per phase as count, p50, p95 and total
+    4. Hands out a shared no-op span when disabled, so that instrumented code costs
+       one attribute check per span
+
+    Attributes:
+        path (str | None): JSONL file the spans are appended to
+        enabled (bool): Whether spans are recorded
+        process (str): Name of the process writing the spans, e.g. "client" or "server"
+    """
+
+    def __init__(self, path: str | None = None, process: str = "client") -> None:
+        """
+        Initialize the tracer.
+
+        Args:
+            path (str): JSONL file to append the spans to, None to disable tracing
+            process (str): Name of the process writing the spans
+        """
+        self.path = path
+        self.enabled = path is not None
+        self.process = process
+        self._durations = defaultdict(list)
+        self._lock = threading.Lock()
+        self._file = open(path, "a", buffering=1) if self.enabled else None
+
+    @classmethod
+    def from_env(cls, process: str = "client") -> "Tracer":
+        """
+        Create the tracer configured by the AGENT_TRACE_PATH environment variable.
+
+        Args:
+            process (str): Name of the process writing the spans
+
+        Returns:
+            Tracer: A tracer writing to AGENT_TRACE_PATH, disabled if it is not set
+        """
+        return cls(os.getenv("AGENT_TRACE_PATH") or None, process)
+
+    def open(self, path: str) -> None:
+        """
+        Start recording to a JSONL file, e.g. for a load test, instead of the current one.
+
+        Args:
+            path (str): JSONL file to append the spans to
+        """
+        self.close()
+        self.path = path
+        self._file = open(path, "a", buffering=1)
+        self.enabled = True
+
+    def span(self, name: str, **attributes):
+        """
+        Open a span, as a context manager, under the current span.
+
+        Args:
+            name (str): Name of the phase
+            **attributes: Measurements known when the phase starts
+
+        Returns:
+            The context manager of the span, yielding the span
+        """
+        if not self.enabled:
+            return _noop_span
+        return _SpanContext(self, Span(name, _current_span.get(), attributes))
+
+    def detached_span(self, name: str, **attributes):
+        """
+        Open a span under the current span without making it the current one, e.g. around
+        an async generator, whose consumer runs in the same context between two chunks.
+
+        Args:
+            name (str): Name of the phase
+            **attributes: Measurements known when the phase starts
+
+        Returns:
+            The context manager of the span, yielding the span
+        """
+        if not self.enabled:
+            return _noop_span
+        return _SpanContext(self, Span(name, _current_span.get(), attributes), detached=True)
+
+    def current(self):
+        """The innermost open span, a no-op span when there is none or tracing is disabled"""
+        span = _current_span.get() if self.enabled else None
+        return span if span is not None else _noop_span
+
+    def _finish(self, span: Span) -> None:
+        record = span.record()
+        record["process"] = self.process
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            self._durations[span.name].append(span.duration_ms)
+            # One write per span, so that the client and the server can append to the same file
+            self._file.write(line)
+
+    def summary(self) -> dict:
+        """
+        Summarize the spans closed in this process.
+
+        Returns:
+            dict: Count, p50, p95 and total milliseconds per phase
+        """
+        with self._lock:
+            return summarize(self._durations)
+
+    def close(self) -> None:
+        """Close the JSONL file"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self.enabled = False
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    Get a percentile by the nearest-rank method.
+
+    Args:
+        values (list): Sorted values
+        fraction (float): Percentile as a fraction, e.g. 0.95
+
+    Returns:
+        float: The value at that rank
+    """
+    return values[max(1, math.ceil(fraction * len(values))) - 1]
+
+
+def summarize(durations: dict) -> dict:
+    """
+    Summarize span durations per phase.
+
+    Args:
+        durations (dict): Durations in milliseconds per phase name
+
+    Returns:
+        dict: Count, p50, p95 and total milliseconds per phase
+    """
+    summary = {}
+    for name, values in sorted(durations.items()):
+        values = sorted(values)
+        summary[name] = {
+            "count": len(values),
+            "p50_ms": percentile(values, 0.5),
+            "p95_ms": percentile(values, 0.95),
+            "total_ms": round(sum(values), 3),
+        }
+    return summary
+
+
+def read_durations(path: str) -> dict:
+    """
+    Read the span durations of a JSONL trace, including those written by the action server.
+
+    Args:
+        path (str): The JSONL trace
+
+    Returns:
+        dict: Durations in milliseconds per phase name
+    """
+    durations = defaultdict(list)
+    with open(path) as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            durations[record["name"]].append(record["duration_ms"])
+    return durations
+
+
+def summarize_file(path: str) -> dict:
+    """
+    Summarize the spans of a JSONL trace, including those written by the action server.
+
+    Args:
+        path (str): The JSONL trace
+
+    Returns:
+        dict: Count, p50, p95 and total milliseconds per phase
+    """
+    return summarize(read_durations(path))
+
+
+# Tracer of this process, enabled by setting AGENT_TRACE_PATH. The client passes both
+# variables on to the action server, which then traces its tool executions as "server"
+tracer = Tracer.from_env(os.getenv("AGENT_TRACE_PROCESS", "client"))
+
+
+if __name__ == "__main__":
+    # Usage: python tracing.py trace.jsonl
+    print(json.dumps(summarize_file(sys.argv[1]), indent=2))
@@ -0,0 +1,366 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from perception import PerceptionObject
+from utils import FunctionCall, FunctionName
+
+# A dimension written with its unit, e.g. "5 cm" or "100mm"
+dimension_pattern = re.compile(r"^\s*([-+]?(?:\d+\.?\d*|\.\d+))\s*([a-zA-Z\"]*)\s*$")
+millimetres_per_unit = {
+    "": None,
+    "mm": 1.0,
+    "cm": 10.0,
+    "m": 1000.0,
+    "in": 25.4,
+    "inch": 25.4,
+    "inches": 25.4,
+    '"': 25.4,
+}
+
+# Tool arguments which are dimensions of the part, by the perceived dimension each one
+# usually comes from, e.g. the stock diameter of simulate_program is the start diameter
+dimension_arguments = {
+    "start_diameter": "start_diameter",
+    "final_diameter": "final_diameter",
+    "length": "length",
+    "stock_diameter": "start_diameter",
+    "stock_length": "length",
+}
+
+
+def flatten_dimensions(dimension_info: dict, prefix: str = "") -> dict:
+    """
+    Flatten the perceived dimensions into numbers.
+
+    Args:
+        dimension_info (dict): The dimensions of a PerceptionObject, possibly nested
+        prefix (str): Path of the enclosing dimension
+
+    Returns:
+        dict: The value of every numeric dimension by its dotted path, in mm when its
+        unit is known, and None for the dimensions which are not numbers
+    """
+    values = {}
+    for key, value in dimension_info.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten_dimensions(value, f"{path}."))
+        elif isinstance(value, bool):
+            values[path] = None
+        elif isinstance(value, (int, float)):
+            values[path] = float(value)
+        else:
+            match = dimension_pattern.match(str(value))
+            unit = match and millimetres_per_unit.get(match.group(2).lower(), False)
+            if not match or unit is False:
+                values[path] = None
+            else:
+                values[path] = float(match.group(1)) * (unit or 1.0)
+    return values
+
+
+def task_signature(perception: PerceptionObject) -> str:
+    """
+    Identify the kind of a task, regardless of its numbers.
+
+    Args:
+        perception (PerceptionObject): The perceived task
+
+    Returns:
+        str: Hash of the normalized operations and of the shape of the dimensions, i.e.
+        their paths and whether they are numbers
+    """
+    operations = " ".join(re.findall(r"[a-z0-9]+", perception.operations.lower()))
+    shape = sorted(
+        (path, value is not None)
+        for path, value in flatten_dimensions(perception.dimension_info).items()
+    )
+    payload = json.dumps({"operations": operations, "shape": shape})
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def parameterize(value, dimensions: dict, argument: str | None = None):
+    """
+    Replace the dimension arguments of a tool call by the perceived dimensions they come from.
+
+    Only the arguments named in `dimension_arguments` are parameterized, and only with a
+    perceived dimension of exactly the same value, every other argument is recorded as it
+    is. When several dimensions have the value, the one named like the argument wins.
+
+    Args:
+        value: The arguments, or one of their values
+        dimensions (dict): The flattened perceived dimensions
+        argument (str): Name of the argument `value` is the value of
+
+    Returns:
+        The arguments with the dimension arguments replaced by a placeholder naming the dimension
+
+    Raises:
+        ValueError: If a dimension argument matches no perceived dimension, or several
+            dimensions none of which is named like it
+    """
+    if isinstance(value, dict):
+        return {key: parameterize(item, dimensions, key) for key, item in value.items()}
+    if isinstance(value, list):
+        return [parameterize(item, dimensions) for item in value]
+    if (
+        argument not in dimension_arguments
+        or isinstance(value, bool)
+        or not isinstance(value, (int, float))
+    ):
+        return value
+    matches = [
+        path
+        for path, dimension in dimensions.items()
+        if dimension is not None and abs(dimension - value) <= 1e-9 * max(1.0, abs(value))
+    ]
+    if len(matches) > 1:
+        named = dimension_arguments[argument]
+        matches = [path for path in matches if path.rsplit(".", 1)[-1] in (argument, named)]
+    if len(matches) != 1:
+        raise ValueError(
+            f"{argument}={value} matches {len(matches) or 'no'} perceived dimensions"
+        )
+    return {"$dimension": matches[0]}
+
+
+def instantiate(value, dimensions: dict):
+    """
+    Fill the placeholders of parameterized arguments with the dimensions of a new task.
+
+    Args:
+        value: The parameterized arguments, or one of their values
+        dimensions (dict): The flattened perceived dimensions of the new task
+
+    Returns:
+        The arguments with numbers in place of the placeholders
+
+    Raises:
+        KeyError: If a placeholder refers to a dimension the new task does not have, or
+            is not a plain dimension, e.g. a scaled one recorded by an earlier version
+    """
+    if isinstance(value, dict):
+        if "$dimension" in value:
+            dimension = dimensions[value["$dimension"]]
+            if dimension is None or len(value) > 1:
+                raise KeyError(value["$dimension"])
+            number = round(dimension, 6)
+            return int(number) if number.is_integer() else number
+        return {key: instantiate(item, dimensions) for key, item in value.items()}
+    if isinstance(value, list):
+        return [instantiate(item, dimensions) for item in value]
+    return value
+
+
+def reports_failure(result) -> bool:
+    """Whether a tool result reports a failed check, e.g. a simulation with "ok": false"""
+    for item in result if isinstance(result, list) else [result]:
+        try:
+            payload = json.loads(item)
+        except (TypeError, ValueError):
+            continue
+        if isinstance(payload, dict) and payload.get("ok") is False:
+            return True
+    return False
+
+
+class TrajectoryCache:
+    """
+    The TrajectoryCache class replays the plans of successful runs for recognized tasks.
+
+    Most jobs are the same task with different numbers. Once the perception of a job
+    matches a task which was solved before, the decisions of that run can be executed
+    again with the new numbers, which saves all the decision calls of the LLM.
+
+    The TrajectoryCache class:
+    1. Identifies a task by its operations and the shape of its dimensions
+    2. Records the decisions of a successful run, with the dimension arguments of the tools
+       turned into placeholders for the perceived dimensions, and every other argument as it is
+    3. Instantiates a recorded plan with the dimensions of a new task
+    4. Replays it step by step, stopping at the first step which fails validation so
+       that the agent loop can take over
+
+    Attributes:
+        path (str): Location of the SQLite database
+        stats (dict): Number of lookups hit and missed, runs recorded, runs not recorded
+            because their dimensions were ambiguous, plans replayed to the end and plans
+            abandoned for the LLM loop
+    """
+
+    def __init__(self, path: str = ".trajectory_cache.sqlite3") -> None:
+        """
+        Open (or create) the trajectory database.
+
+        Args:
+            path (str): Location of the SQLite database, ":memory:" for a process-local cache
+        """
+        self.path = path
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "recorded": 0,
+            "refused": 0,
+            "replayed": 0,
+            "fallbacks": 0,
+        }
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS trajectories (
+                signature TEXT PRIMARY KEY,
+                operations TEXT NOT NULL,
+                plan TEXT NOT NULL,
+                runs INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._db.commit()
+
+    def record(self, perception_text: str, decisions: list[FunctionCall]) -> bool:
+        """
+        Record the decisions of a successful run.
+
+        Args:
+            perception_text (str): The perception of the task, as JSON
+            decisions (list): The decisions executed, in order, ending with the final answer
+
+        Returns:
+            bool: True if the plan was recorded, False if there is none or a dimension
+            argument cannot be tied to exactly one perceived dimension
+        """
+        if not decisions:
+            return False
+        perception = PerceptionObject.model_validate_json(perception_text)
+        dimensions = flatten_dimensions(perception.dimension_info)
+        try:
+            plan = [
+                parameterize(decision.model_dump(mode="json", exclude_none=True), dimensions)
+                for decision in decisions
+            ]
+        except ValueError:
+            with self._lock:
+                self.stats["refused"] += 1
+            return False
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                """
+                INSERT INTO trajectories VALUES (?, ?, ?, 1, ?, ?)
+                ON CONFLICT (signature) DO UPDATE SET
+                    plan = excluded.plan, runs = runs + 1, last_used = excluded.last_used
+                """,
+                (task_signature(perception), perception.operations, json.dumps(plan), now, now),
+            )
+            self._db.commit()
+            self.stats["recorded"] += 1
+        return True
+
+    def lookup(self, perception_text: str) -> list[FunctionCall] | None:
+        """
+        Get the plan of a recognized task, instantiated with its dimensions.
+
+        Args:
+            perception_text (str): The perception of the task, as JSON
+
+        Returns:
+            list | None: The decisions to replay, None if the task is not recognized or
+            the recorded plan does not fit its dimensions
+        """
+        perception = PerceptionObject.model_validate_json(perception_text)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT plan FROM trajectories WHERE signature = ?",
+                (task_signature(perception),),
+            ).fetchone()
+        if row is None:
+            self.stats["misses"] += 1
+            return None
+        dimensions = flatten_dimensions(perception.dimension_info)
+        try:
+            plan = [
+                FunctionCall.model_validate(instantiate(decision, dimensions))
+                for decision in json.loads(row[0])
+            ]
+        except (KeyError, ValueError):
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return plan
+
+    async def replay(
+        self, plan: list[FunctionCall], action, session, session_id: str, decisions: list
+    ) -> tuple:
+        """
+        Execute a recorded plan until it ends or a step fails validation.
+
+        A step fails when one of its calls returns an error, when a check such as the
+        simulator reports a failure, or when a batch is cut short. The failure is kept in
+        memory, so that the LLM takes over from the state the plan left.
+
+        Args:
+            plan (list): The decisions to replay
+            action (Action): Action of the run, executing the calls and recording them in memory
+            session: The MCP session, or the local tool executor wrapping it
+            session_id (str): Unique identifier for the memory session
+            decisions (list): Decisions of the run, the replayed ones are appended to it
+
+        Returns:
+            tuple: The number of iterations used and whether the plan reached its final answer
+        """
+        for step, function_call in enumerate(plan, start=1):
+            calls = [
+                call
+                for call in function_call.planned_calls()
+                if call.tool_name != FunctionName.FINAL_ANSWER
+            ]
+            executed = len(action.trace)
+            try:
+                to_continue = await action.execute_action(
+                    function_call, session, session_id, step
+                )
+            except Exception as e:
+                failure = str(e)
+            else:
+                entries = action.trace[executed:]
+                failed = [
+                    entry["tool_name"]
+                    for entry in entries
+                    if entry["is_error"] or reports_failure(entry["result"])
+                ]
+                failure = (
+                    f"{', '.join(failed)} failed"
+                    if failed
+                    else "the batch was cut short"
+                    if len(entries) < len(calls)
+                    else None
+                )
+            if failure is not None:
+                self.stats["fallbacks"] += 1
+                action.memory.store(
+                    f"Step {step} of a plan replayed from a previous run of this kind of task did not "
+                    f"validate ({failure}). Check the state of the program and continue from there.\n",
+                    session_id,
+                    kind="replay_failed",
+                    iteration=step,
+                )
+                return step, False
+            decisions.append(function_call)
+            if not to_continue:
+                self.stats["replayed"] += 1
+                return step, True
+        # The plan ended without a final answer, the LLM decides what is left
+        self.stats["fallbacks"] += 1
+        return len(plan), False
+
+    def close(self) -> None:
+        """
+        Close the underlying database.
+        """
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,180 @@
+import math
+
+# Radial distance in mm by which the tool clears the surface it just cut before returning
+retract_clearance = 0.5
+# Distance in mm in front of the face from which every pass starts
+approach_clearance = 2.0
+
+
+def _mm(value: float) -> float:
+    """Round a coordinate to the micron, so that blocks read X46.667 instead of X46.66666666666667"""
+    return round(value, 3)
+
+
+def normalize_profile(final_diameter: float, length: float, profile=None) -> list:
+    """
+    Get the target profile as shoulders ordered from the face inwards.
+
+    Args:
+        final_diameter (float): Final diameter of a plain cylinder in mm
+        length (float): Length of the plain cylinder along Z in mm
+        profile (list): (diameter, length) steps of a stepped shaft, each step
+            running from the end of the previous one to `length` mm from the face
+
+    Returns:
+        list: (diameter, z_end) steps, with z_end negative
+
+    Raises:
+        ValueError: If the steps do not go away from the face or the diameters
+            decrease away from the face, which would need an undercut
+    """
+    steps = profile or [(final_diameter, length)]
+    previous_length, previous_diameter = 0.0, 0.0
+    normalized = []
+    for diameter, step_length in steps:
+        if step_length <= previous_length:
+            raise ValueError("Profile steps must be ordered by increasing length from the face")
+        if diameter < previous_diameter:
+            raise ValueError("Profile diameters must not decrease away from the face")
+        normalized.append((diameter, -step_length))
+        previous_length, previous_diameter = step_length, diameter
+    return normalized
+
+
+def plan_roughing_passes(
+    start_diameter: float,
+    profile: list,
+    max_depth_of_cut: float,
+    finishing_allowance: float = 0.0,
+) -> list:
+    """
+    Plan the roughing passes down to the profile plus the finishing allowance.
+
+    The stock is removed band by band, each band running from one shoulder diameter
+    down to the next, so that every shoulder is roughed exactly to its allowance. A band
+    is split into the fewest passes allowed by the maximum depth of cut, all of the same
+    depth, and every pass stops at the first shoulder it would reach, so that no pass
+    cuts air beyond the material it removes.
+
+    Args:
+        start_diameter (float): Diameter of the stock in mm
+        profile (list): (diameter, z_end) steps from `normalize_profile`
+        max_depth_of_cut (float): Largest radial depth of a pass in mm
+        finishing_allowance (float): Radial stock left for the finishing pass in mm
+
+    Returns:
+        list: (diameter, z_end) of every roughing pass, in cutting order
+    """
+    if max_depth_of_cut <= 0:
+        raise ValueError("The maximum depth of cut must be positive")
+    levels = sorted(
+        {diameter + 2 * finishing_allowance for diameter, _ in profile}, reverse=True
+    )
+
+    passes = []
+    current = start_diameter
+    for level in levels:
+        radial_stock = (current - level) / 2
+        if radial_stock <= 1e-9:
+            continue
+        count = math.ceil(radial_stock / max_depth_of_cut - 1e-9)
+        depth = radial_stock / count
+        for number in range(1, count + 1):
+            diameter = current - 2 * depth * number
+            z_end = None
+            for step_diameter, step_z_end in profile:
+                if step_diameter + 2 * finishing_allowance > diameter + 1e-9:
+                    break
+                z_end = step_z_end
+            passes.append((diameter, z_end))
+        current = level
+    return passes
+
+
+def finishing_contour(start_diameter: float, profile: list) -> list:
+    """
+    Get the finishing contour of the profile, from the approach point back out to the stock.
+
+    Args:
+        start_diameter (float): Diameter of the stock in mm
+        profile (list): (diameter, z_end) steps from `normalize_profile`
+
+    Returns:
+        list: G-code blocks of the contour, without feed
+    """
+    blocks = [f"G0 X{_mm(profile[0][0])}"]
+    for index, (diameter, z_end) in enumerate(profile):
+        if index:
+            blocks.append(f"G1 X{_mm(diameter)}")
+        blocks.append(f"G1 Z{_mm(z_end)}")
+    blocks.append(f"G1 X{_mm(start_diameter + 2 * retract_clearance)}")
+    return blocks
+
+
+def turning_cycle(
+    start_diameter: float,
+    final_diameter: float,
+    length: float,
+    feed_rate: float,
+    max_depth_of_cut: float,
+    finishing_allowance: float = 0.0,
+    finishing_feed_rate: float | None = None,
+    profile=None,
+    canned_cycle: bool = False,
+) -> list[str]:
+    """
+    Generate the roughing and finishing passes turning a stock down to a profile.
+
+    Expanded passes feed along Z only while in material, pull off radially by
+    `retract_clearance` and return to the start of the next pass at rapid. With
+    `canned_cycle` the same passes are left to the control as a G71 roughing cycle
+    followed by a G70 finishing cycle over the contour.
+
+    Args:
+        start_diameter (float): Diameter of the stock in mm
+        final_diameter (float): Final diameter of a plain cylinder in mm
+        length (float): Length of the plain cylinder along Z in mm
+        feed_rate (float): Roughing feed rate in mm/rev
+        max_depth_of_cut (float): Largest radial depth of a roughing pass in mm
+        finishing_allowance (float): Radial stock left for the finishing pass in mm,
+            0 to rough a plain cylinder straight to size
+        finishing_feed_rate (float): Finishing feed rate in mm/rev, the roughing feed if not given
+        profile (list): (diameter, length) steps of a stepped shaft instead of the plain cylinder
+        canned_cycle (bool): Emit G71/G70 canned cycles instead of expanded blocks
+
+    Returns:
+        list: The G-code blocks
+    """
+    steps = normalize_profile(final_diameter, length, profile)
+    finishing_feed_rate = finishing_feed_rate or feed_rate
+    start_x = _mm(start_diameter + 2 * retract_clearance)
+    blocks = [f"G0 X{start_x} Z{approach_clearance}"]
+
+    if canned_cycle:
+        contour = finishing_contour(start_diameter, steps)
+        first, last = 100, 100 + len(contour) - 1
+        blocks += [
+            f"G71 U{_mm(max_depth_of_cut)} R{retract_clearance}",
+            f"G71 P{first} Q{last} U{_mm(2 * finishing_allowance)} W0 F{feed_rate}",
+        ]
+        contour[1] += f" F{finishing_feed_rate}"
+        blocks += [f"N{first + i} {block}" for i, block in enumerate(contour)]
+        blocks.append(f"G70 P{first} Q{last}")
+        return blocks
+
+    for diameter, z_end in plan_roughing_passes(
+        start_diameter, steps, max_depth_of_cut, finishing_allowance
+    ):
+        blocks += [
+            f"G0 X{_mm(diameter)}",
+            f"G1 Z{_mm(z_end)} F{feed_rate}",
+            f"G0 X{_mm(diameter + 2 * retract_clearance)}",
+            f"G0 Z{approach_clearance}",
+        ]
+    # Shoulders between two roughing levels are only reached by the contour pass
+    if finishing_allowance > 0 or len(steps) > 1:
+        contour = finishing_contour(start_diameter, steps)
+        contour[1] += f" F{finishing_feed_rate}"
+        blocks += contour
+        blocks.append(f"G0 Z{approach_clearance}")
+    return blocks
@@ -1,6 +1,6 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from enum import Enum
-import json, asyncio
+import json
 
 system_prompt = """
 You are an expert CNC agent who has a PhD. in the engineering discipline of Manufacturing Sciences. You are a very hands on agent and have practical knowledge about the working of a CNC (Compute Numeric Controlled (Lathe)).
@@ -15,10 +15,22 @@ class FunctionName(Enum):
     PERFORM_UNIFORM_TURNING = "do_turning"
     RETRACT_AND_END_PROGRAM = "retract_and_end_program"
     ADD_TEXT_IN_PAINT = "add_text_in_paint"
+    GET_PROGRAM = "get_program"
+    ANNOTATE_PROGRAM = "annotate_program"
+    REORDER_PROGRAM = "reorder_program"
+    FINALIZE_PROGRAM = "finalize_program"
+    SIMULATE_PROGRAM = "simulate_program"
+    ESTIMATE_CYCLE_TIME = "estimate_cycle_time"
+    VERIFY_STEP = "verify_step"
     REASONING = "show_reasoning"
     FINAL_ANSWER = "final_answer"
 
 
+class ToolCall(BaseModel):
+    tool_name: FunctionName
+    arguments: dict | None
+
+
 class FunctionCall(BaseModel):
     what_was_done_in_previous_step: str = Field(
         ..., description="A brief of what action was performed in the previous step"
@@ -27,8 +39,28 @@ class FunctionCall(BaseModel):
         ...,
         description="What is the next step that needs to be done as per the plan of action to complete the user's task",
     )
-    tool_name: FunctionName
-    arguments: dict | None
+    tool_name: FunctionName | None = None
+    arguments: dict | None = None
+    calls: list[ToolCall] | None = Field(
+        None,
+        description="An ordered batch of tool calls to execute in one step, used instead of tool_name and arguments",
+    )
+    independent: bool = Field(
+        False,
+        description="Whether the calls of the batch do not depend on each other and may run concurrently",
+    )
+
+    @model_validator(mode="after")
+    def check_single_call_or_batch(self):
+        if self.tool_name is None and not self.calls:
+            raise ValueError("Either tool_name or a non empty list of calls is required")
+        return self
+
+    def planned_calls(self) -> list[ToolCall]:
+        """The calls to execute for this decision, in order"""
+        if self.calls:
+            return self.calls
+        return [ToolCall(tool_name=self.tool_name, arguments=self.arguments)]
 
 
 decision_response_dict = {
@@ -38,6 +70,18 @@ decision_response_dict = {
     "arguments": f"<dict>: Suitable arguments based on the tool name as provided in the list of tools available to you",
 }
 
+decision_plan_response_dict = {
+    "what_was_done_in_previous_step": "<str> A brief description of what action was taken in the previous step",
+    "what_needs_to_be_done_next": "<str> Looking at the plan of action, what are the next actions that I need to take so that the user's task can be accomplished",
+    "calls": [
+        {
+            "tool_name": f"<str>: Can be one of these function names: {', '.join([x.value for x in FunctionName])}",
+            "arguments": "<dict>: Suitable arguments based on the tool name as provided in the list of tools available to you",
+        }
+    ],
+    "independent": "<bool>: true only if none of the calls needs the result of an earlier call in the list",
+}
+
 perception_response_dict = {
     "task": "<str> A brief description of what user wants to do",
     "start_state": "<str> If the user provides a task, what is the start state of the object on which the machining needs to be done",
@@ -63,33 +107,58 @@ class ReasoningStep(BaseModel):
     are_there_any_issues_in_reasoning: bool
 
 
-async def generate_with_timeout(client, prompt, timeout=60):
-    """Generate content with a timeout"""
+def estimate_tokens(text: str) -> int:
+    """Cheap estimate of the number of tokens in a text, about four characters per token"""
+    return len(text) // 4 + 1
+
+
+def build_messages(prompt):
+    """Wrap a plain prompt into chat messages, pass a list of messages through as is"""
+    if isinstance(prompt, list):
+        return prompt
+    return [
+        {
+            "role": "system",
+            "content": system_prompt,
+        },
+        {"role": "user", "content": prompt},
+    ]
+
+
+async def generate_with_timeout(
+    client, prompt, timeout=60, cache=None, response_format=None, validate=None
+):
+    """
+    Generate content with a timeout on the async LLM backend, optionally through a response cache.
+    A reply is cached only if `validate`, when given, accepts it without raising a ValueError.
+    """
+    messages = build_messages(prompt)
+    response_format = response_format or client.response_format
+    if cache is not None:
+        key = cache.make_key(
+            client.model, client.temperature, response_format, messages
+        )
+        content = cache.get(key)
+        if content is not None:
+            print("LLM response served from cache")
+            return content
+
     print("Starting LLM generation...")
     try:
-        # Convert the synchronous chat.completions.create call to run in a thread
-        loop = asyncio.get_event_loop()
-        response = await asyncio.wait_for(
-            loop.run_in_executor(
-                None,
-                lambda: client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": system_prompt,
-                        },
-                        {"role": "user", "content": prompt},
-                    ],
-                    temperature=0.1,
-                    max_tokens=1000,
-                    response_format={"type": "json_object"},
-                ),
-            ),
-            timeout=timeout,
+        # The backend aborts the request itself once the deadline expires
+        content = await client.complete(
+            messages, timeout=timeout, response_format=response_format
         )
         print("LLM generation completed")
-        return response.choices[0].message.content
+        if cache is not None:
+            try:
+                if validate is not None:
+                    validate(content)
+            except ValueError:
+                print("LLM response not cached, it did not validate")
+            else:
+                cache.put(key, content)
+        return content
     except TimeoutError:
         print("LLM generation timed out!")
         raise